@@ -0,0 +1,69 @@
+import argparse
+import ast
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_default_files():
+    for name in ("config.py", "config.py.example"):
+        path = os.path.join(REPO_ROOT, "src", name)
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and any(
+                isinstance(t, ast.Name) and t.id == "OTA_FILES_TO_UPDATE" for t in node.targets
+            ):
+                return ast.literal_eval(node.value)
+    return []
+
+
+def build_manifest(files, version):
+    entries = {}
+    for filepath in files:
+        with open(os.path.join(REPO_ROOT, filepath), "rb") as f:
+            content = f.read()
+        entries[filepath] = {
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "size": len(content),
+        }
+    return {"version": version, "files": entries}
+
+
+def sign_manifest(manifest, key):
+    body = json.dumps(manifest, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    signature = hmac.new(key.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return signature.encode("ascii") + b"\n" + body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генериране на подписан OTA манифест")
+    parser.add_argument("files", nargs="*", help="файлове спрямо корена на репото (по подразбиране OTA_FILES_TO_UPDATE)")
+    parser.add_argument("--key", default=os.environ.get("OTA_MANIFEST_KEY"), help="HMAC ключ (или OTA_MANIFEST_KEY)")
+    parser.add_argument("--version", default=time.strftime("%Y%m%d%H%M%S"), help="версия на манифеста")
+    parser.add_argument("--output", default=os.path.join(REPO_ROOT, "ota_manifest.json"))
+    args = parser.parse_args(argv)
+
+    if not args.key:
+        parser.error("липсва HMAC ключ (--key или OTA_MANIFEST_KEY)")
+
+    files = args.files or load_default_files()
+    if not files:
+        parser.error("няма файлове за манифеста")
+
+    data = sign_manifest(build_manifest(files, args.version), args.key)
+    with open(args.output, "wb") as f:
+        f.write(data)
+    print("Манифест {} ({} файла, версия {})".format(args.output, len(files), args.version))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
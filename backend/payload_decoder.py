@@ -0,0 +1,312 @@
+import argparse
+import json
+import struct
+import sys
+import zlib
+
+STRUCT_FORMATS = {
+    # версия: (формат, полета)
+    1: ("<BIhHHHHB", ("version", "unix", "temperature", "humidity", "mq2", "pm25", "pm10", "flags")),
+}
+# Версия 2: пакет с проби - заглавка (версия, t0, брой) + записи с Δt спрямо t0
+BATCH_HEADER = "<BIH"
+BATCH_SAMPLE = ("<HhHHHHB", ("dt", "temperature", "humidity", "mq2", "pm25", "pm10", "flags"))
+BATCH_COLUMNS = ("temperature", "humidity", "mq2", "pm25", "pm10")
+# Версия 3: като версия 2 + GPS сегмент (zig-zag varint разлики на lat/lon x1e5 и време спрямо t0)
+BATCH_TRACK_VERSION = 3
+TRACK_SCALE = 100000.0
+
+CBOR_KEYS = {
+    "t": "temperature",
+    "h": "humidity",
+    "mq": "mq2",
+    "p25": "pm25",
+    "p10": "pm10",
+    "ts": "unix",
+    "f": "flags",
+    "s": "stats",
+    "trk": "track",
+}
+
+FLAG_SIM = 0x01
+FLAG_SIM_AVAILABLE = 0x02
+FLAG_WIFI_CONNECTED = 0x04
+
+
+class CBORDecoder:
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def _take(self, n):
+        if self.pos + n > len(self.data):
+            raise ValueError("CBOR: непълни данни")
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    def _argument(self, info):
+        if info < 24:
+            return info
+        if info == 24:
+            return self._take(1)[0]
+        if info == 25:
+            return struct.unpack(">H", self._take(2))[0]
+        if info == 26:
+            return struct.unpack(">I", self._take(4))[0]
+        if info == 27:
+            return struct.unpack(">Q", self._take(8))[0]
+        raise ValueError("CBOR: неподдържана дължина {}".format(info))
+
+    def decode(self):
+        initial = self._take(1)[0]
+        major = initial >> 5
+        info = initial & 0x1F
+
+        if major == 7:
+            if info == 20:
+                return False
+            if info == 21:
+                return True
+            if info in (22, 23):
+                return None
+            if info == 25:
+                return struct.unpack(">e", self._take(2))[0]
+            if info == 26:
+                return struct.unpack(">f", self._take(4))[0]
+            if info == 27:
+                return struct.unpack(">d", self._take(8))[0]
+            raise ValueError("CBOR: неподдържана проста стойност {}".format(info))
+
+        if info == 31 and major in (4, 5):
+            return self._indefinite(major)
+
+        value = self._argument(info)
+        if major == 0:
+            return value
+        if major == 1:
+            return -1 - value
+        if major == 2:
+            return bytes(self._take(value))
+        if major == 3:
+            return self._take(value).decode("utf-8")
+        if major == 4:
+            return [self.decode() for _ in range(value)]
+        if major == 5:
+            result = {}
+            for _ in range(value):
+                key = self.decode()
+                result[key] = self.decode()
+            return result
+        if major == 6:
+            # Таговете се игнорират - връща се само стойността
+            return self.decode()
+        raise ValueError("CBOR: неподдържан тип {}".format(major))
+
+    def _indefinite(self, major):
+        items = []
+        while self.data[self.pos] != 0xFF:
+            items.append(self.decode())
+        self.pos += 1
+        if major == 4:
+            return items
+        return dict(zip(items[0::2], items[1::2]))
+
+
+def decode_cbor(data):
+    decoder = CBORDecoder(data)
+    value = decoder.decode()
+    if decoder.pos != len(data):
+        raise ValueError("CBOR: излишни байтове след стойността")
+    return value
+
+
+def _round(value, ndigits=2):
+    # CBOR от устройството е float32 - закръгляне до точността на JSON формата
+    if isinstance(value, float):
+        return round(value, ndigits)
+    if isinstance(value, dict):
+        return {k: _round(v, ndigits) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_round(v, ndigits) for v in value]
+    return value
+
+
+def _flags(flags):
+    return {
+        "type": "sim" if flags & FLAG_SIM else "wifi",
+        "sim_available": bool(flags & FLAG_SIM_AVAILABLE),
+        "wifi_connected": bool(flags & FLAG_WIFI_CONNECTED),
+    }
+
+
+def _scaled(value, scale, missing):
+    return None if value == missing else round(value / scale, 2)
+
+
+def _struct_sample(raw):
+    return {
+        "temperature": _scaled(raw["temperature"], 100.0, -32768),
+        "humidity": _scaled(raw["humidity"], 100.0, 0xFFFF),
+        "mq2": None if raw["mq2"] == 0xFFFF else raw["mq2"],
+        "pm25": _scaled(raw["pm25"], 10.0, 0xFFFF),
+        "pm10": _scaled(raw["pm10"], 10.0, 0xFFFF),
+        "communication": _flags(raw["flags"]),
+    }
+
+
+def _unzigzag(value):
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+
+def _track_points(deltas, t0):
+    points = []
+    lat = lon = 0
+    t = t0
+    for i in range(0, len(deltas) - 2, 3):
+        lat += deltas[i]
+        lon += deltas[i + 1]
+        t += deltas[i + 2]
+        points.append({"unix": t, "lat": round(lat / TRACK_SCALE, 5), "lon": round(lon / TRACK_SCALE, 5)})
+    return points
+
+
+def decode_track_varint(data, t0):
+    # брой точки, после Δlat, Δlon, Δt за всяка точка (LEB128 + zig-zag)
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append(value)
+            value = shift = 0
+    if shift:
+        raise ValueError("track: незавършено varint число")
+    if not values or len(values) != 1 + 3 * values[0]:
+        raise ValueError("track: невалиден брой стойности")
+    return _track_points([_unzigzag(v) for v in values[1:]], t0)
+
+
+def decode_track_polyline(text, t0):
+    # Google encoded polyline с три измерения: lat, lon, Δt
+    values = []
+    value = shift = 0
+    for char in text:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(_unzigzag(value))
+            value = shift = 0
+    if shift or len(values) % 3:
+        raise ValueError("track: непълен polyline")
+    return _track_points(values, t0)
+
+
+def decode_struct_batch(data):
+    header_len = struct.calcsize(BATCH_HEADER)
+    version, t0, count = struct.unpack_from(BATCH_HEADER, data, 0)
+    fmt, fields = BATCH_SAMPLE
+    size = struct.calcsize(fmt)
+    end = header_len + count * size
+    if len(data) < end or (version == 2 and len(data) != end):
+        raise ValueError("struct: очаквани {} байта, получени {}".format(end, len(data)))
+    samples = []
+    for i in range(count):
+        raw = dict(zip(fields, struct.unpack_from(fmt, data, header_len + i * size)))
+        sample = {"unix": t0 + raw["dt"]}
+        sample.update(_struct_sample(raw))
+        samples.append(sample)
+    result = {"format": "struct", "version": version, "samples": samples}
+    if version == BATCH_TRACK_VERSION:
+        result["track"] = decode_track_varint(data[end:], t0)
+    return result
+
+
+def decode_struct(data):
+    version = data[0]
+    if version in (2, BATCH_TRACK_VERSION):
+        return decode_struct_batch(data)
+    if version not in STRUCT_FORMATS:
+        raise ValueError("struct: непозната версия {}".format(version))
+    fmt, fields = STRUCT_FORMATS[version]
+    if len(data) != struct.calcsize(fmt):
+        raise ValueError("struct: очаквани {} байта, получени {}".format(struct.calcsize(fmt), len(data)))
+    raw = dict(zip(fields, struct.unpack(fmt, data)))
+
+    result = {"format": "struct", "version": version, "unix": raw["unix"]}
+    result.update(_struct_sample(raw))
+    return result
+
+
+def expand_batch(columns, fmt):
+    # Колонен пакет (JSON/CBOR) -> списък от проби с абсолютно време
+    samples = []
+    t0 = columns["t0"]
+    for i, dt in enumerate(columns["dt"]):
+        sample = {"unix": t0 + dt}
+        for name in BATCH_COLUMNS:
+            sample[name] = _round(columns[name][i])
+        sample["communication"] = _flags(columns["flags"][i])
+        samples.append(sample)
+    result = {"format": fmt, "samples": samples}
+    if "device_id" in columns:
+        result["device_id"] = columns["device_id"]
+    if "stats" in columns:
+        result["stats"] = columns["stats"]
+    track = columns.get("track", columns.get("trk"))
+    if isinstance(track, str):
+        result["track"] = decode_track_polyline(track, t0)
+    elif track is not None:
+        result["track"] = decode_track_varint(track, t0)
+    return result
+
+
+def decode(payload):
+    # Форматът се разпознава по първия байт
+    if not payload:
+        raise ValueError("празно съобщение")
+    first = payload[0]
+    if first == 0x78:
+        # zlib компресиран пакет (MQTT_BATCH_DEFLATE)
+        result = decode(zlib.decompress(payload))
+        result["compressed"] = True
+        return result
+    if first == ord("{"):
+        result = json.loads(payload.decode("utf-8"))
+        if "dt" in result:
+            return expand_batch(result, "json")
+        result["format"] = "json"
+        return result
+    if 0xA0 <= first <= 0xBF:
+        record = {CBOR_KEYS.get(key, key): value for key, value in decode_cbor(payload).items()}
+        if "dt" in record:
+            return expand_batch(record, "cbor")
+        result = {"format": "cbor"}
+        for name, value in record.items():
+            if name == "flags":
+                result["communication"] = _flags(value)
+            else:
+                result[name] = _round(value)
+        return result
+    return decode_struct(payload)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Декодиране на MQTT съобщения от станцията (JSON, CBOR или struct)")
+    parser.add_argument("payload", nargs="?", help="съобщение в hex (по подразбиране се чете двоично от stdin)")
+    args = parser.parse_args(argv)
+
+    if args.payload:
+        data = bytes.fromhex(args.payload)
+    else:
+        data = sys.stdin.buffer.read()
+
+    print(json.dumps(decode(data), indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,14 +4,26 @@ import time
 if "src" not in sys.path:
     sys.path.append("src")
 
+import uasyncio as asyncio
 import config
 from dht22 import DHT22Sensor
 from mq2 import MQ2Sensor
 from sds011 import SDS011Sensor
 from sim7600 import SIM7600
-from wifi_manager import WiFiManager
+from sim_socket import SIMNetwork
+from wifi_manager import WiFiManager, WIFI_CONNECTED, WIFI_FAILED
+from link_manager import LinkManager, LINK_SIM, LINK_WIFI, csq_to_dbm
 from speed_test import SpeedTest
 from ota_updater import OTAUpdater
+from scheduler import Scheduler
+from profiler import StageProfiler
+from aggregator import WindowAggregator
+from sample_batch import SampleBatch
+from deadband import DeadbandFilter
+from alarm import AlarmEngine
+from gps_policy import GPSPolicy
+from track import TrackBuffer
+from payload_codec import PayloadCodec, unix_time, FLAG_SIM, FLAG_SIM_AVAILABLE, FLAG_WIFI_CONNECTED
 
 mqtt_client = None
 if hasattr(config, 'MQTT_ENABLED'):
@@ -19,6 +31,9 @@ if hasattr(config, 'MQTT_ENABLED'):
         try:
             from mqtt_client import MQTTClient
             mqtt_client = MQTTClient()
+            if getattr(config, 'OFFLINE_QUEUE_ENABLED', False):
+                from offline_queue import OfflineQueue
+                mqtt_client.set_offline_queue(OfflineQueue())
             print("MQTT: Клиентът е инициализиран")
         except ImportError as e:
             print("MQTT: Грешка при импортиране на модул:", e)
@@ -48,261 +63,554 @@ def format_time_ms(milliseconds):
     return "{:02d}:{:02d}:{:02d}.{:02d}".format(hours, minutes, secs, centiseconds)
 
 
-def main():
-    dht22 = DHT22Sensor()
-    mq2 = MQ2Sensor()
-    sds = SDS011Sensor()
-    sim = SIM7600()
-    wifi = WiFiManager()
-    speed_test = SpeedTest()
-    ota_updater = OTAUpdater()
-
-    print("Устройство:", config.DEVICE_NAME)
-    print("Стартиране на станцията...")
-    
-    # Проверка на MQTT конфигурация
-    if hasattr(config, 'MQTT_ENABLED'):
-        print("MQTT: Конфигурация - ENABLED =", config.MQTT_ENABLED)
-        if config.MQTT_ENABLED:
-            if hasattr(config, 'MQTT_BROKER_HOST'):
-                print("MQTT: Broker =", config.MQTT_BROKER_HOST, ":", getattr(config, 'MQTT_BROKER_PORT', 1883))
-            else:
-                print("MQTT: ВНИМАНИЕ - MQTT_BROKER_HOST не е дефиниран!")
-    else:
-        print("MQTT: ВНИМАНИЕ - MQTT_ENABLED не е дефиниран в config.py!")
-    
-    if config.TEST_ENABLED and config.TEST_RUN_ON_STARTUP:
-        print("Изпълняване на тестове...")
-        try:
-            sys.path.append("tests")
-            from run_all_tests import main as run_tests
-            tests_success = run_tests()
-            if not tests_success:
-                print("ВНИМАНИЕ: Някои тестове са провалени!")
-            time.sleep(2)
-        except Exception as e:
-            print("Грешка при изпълняване на тестове:", e)
-
-    sim.init()
-
-    lat = None
-    lon = None
-    last_gps = 0
-    sim_failure_count = 0
-    using_wifi = False
-    using_sim = True 
-    last_comm_check = -999
-    last_speed_test = 0
-    last_ota_check = 0
-    last_mqtt_publish = 0
-    sim_ok = False
-    sim_present = False
-    sim_rssi = None
-    internet_speed_kbps = None
-    internet_upload_kbps = None
-    internet_ping_ms = None
-    
-    print("SIM: Използване на SIM като основна комуникация")
+class Station:
 
-    sim_ok, sim_present, sim_rssi = sim.status()
-    sim_available = sim_ok and sim_present
-    if not sim_available:
-        print("SIM: Проблем детектиран при стартиране, проверяване WiFi...")
-        sim_failure_count = 1 
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.dht22 = DHT22Sensor()
+        self.mq2 = MQ2Sensor()
+        self.sds = SDS011Sensor()
+        self.sim = SIM7600()
+        # TCP/IP стекът на модема като мрежов слой за MQTT, OTA и теста на скоростта, когато активната връзка е SIM
+        self.sim_net = SIMNetwork(self.sim) if getattr(config, 'SIM_DATA_ENABLED', False) else None
+        self.wifi = WiFiManager()
+        self.speed_test = SpeedTest()
+        self.ota_updater = OTAUpdater()
 
-    start_time_ms = time.ticks_ms()
-    
-    while True:
-        current_time_ms = time.ticks_ms()
-        uptime_ms = time.ticks_diff(current_time_ms, start_time_ms)
-        uptime = uptime_ms // 1000
+        self.temp = None
+        self.humidity = None
+        self.mq = None
+        self.pm25 = None
+        self.pm10 = None
+        self.aggregator = WindowAggregator(
+            ("temperature", "humidity", "mq2_raw", "pm25", "pm10"),
+            getattr(config, 'MQTT_STATS_PERCENTILE', 0.95)
+        )
+        self.codec = PayloadCodec()
+        self.batch = None
+        if getattr(config, 'MQTT_BATCH_ENABLED', False):
+            self.batch = SampleBatch(self.codec.format)
+        self.deadband = None
+        if self.batch is None and getattr(config, 'MQTT_REPORT_BY_EXCEPTION', False):
+            self.deadband = DeadbandFilter()
+        self.alarms = AlarmEngine() if getattr(config, 'ALARM_ENABLED', False) else None
 
-        temp, humidity = dht22.read()
-        mq = mq2.read_avg()
-        pm25, pm10 = sds.read_once()
+        self.lat = None
+        self.lon = None
+        self.gps_policy = GPSPolicy()
+        # Опростен GPS трак, изпращан с всеки пакет (само в пакетен режим)
+        self.track = None
+        if self.batch is not None and getattr(config, 'TRACK_ENABLED', False):
+            self.track = TrackBuffer()
+        self.gps_power_save = getattr(config, 'GPS_POWER_SAVE', False)
+        self.links = LinkManager()
+        self.sampled = asyncio.Event()
+        self.using_sim = self.links.active == LINK_SIM
+        self.using_wifi = not self.using_sim
+        # Връзката, през която реално минават MQTT/HTTP; без SIM_DATA_ENABLED това винаги е WiFi
+        self.transport = LINK_WIFI
+        self.last_wifi_attempt = -999
+        self.last_mqtt_publish = 0
+        self.sim_ok = False
+        self.sim_present = False
+        self.sim_rssi = None
+        self.sim_available = False
+        self.wifi_connected = False
+        self.wifi_ip = None
+        self.wifi_rssi = None
+        self.wifi_ssid = None
+        self.internet_speed_kbps = None
+        self.internet_upload_kbps = None
+        self.internet_ping_ms = None
 
-        wifi_connected, wifi_ip, wifi_rssi, wifi_ssid = wifi.get_status()
-        
-        sim_ok, sim_present, sim_rssi = sim.status()
-        sim_available = sim_ok and sim_present
+        self.start_time_ms = time.ticks_ms()
+
+    def uptime_ms(self):
+        return time.ticks_diff(time.ticks_ms(), self.start_time_ms)
+
+    def uptime_s(self):
+        return self.uptime_ms() // 1000
+
+    def has_internet(self):
+        return (self.using_wifi and self.wifi_connected) or (self.using_sim and self.sim_available)
+
+    def startup(self):
+        print("Устройство:", config.DEVICE_NAME)
+        print("Стартиране на станцията...")
         
-        if sim_failure_count > 0:
-            check_interval = config.SIM_FAST_CHECK_INTERVAL_S
+        # Проверка на MQTT конфигурация
+        if hasattr(config, 'MQTT_ENABLED'):
+            print("MQTT: Конфигурация - ENABLED =", config.MQTT_ENABLED)
+            if config.MQTT_ENABLED:
+                if hasattr(config, 'MQTT_BROKER_HOST'):
+                    print("MQTT: Broker =", config.MQTT_BROKER_HOST, ":", getattr(config, 'MQTT_BROKER_PORT', 1883))
+                else:
+                    print("MQTT: ВНИМАНИЕ - MQTT_BROKER_HOST не е дефиниран!")
         else:
-            check_interval = config.WIFI_CHECK_INTERVAL_S
+            print("MQTT: ВНИМАНИЕ - MQTT_ENABLED не е дефиниран в config.py!")
         
-        if uptime - last_comm_check >= check_interval:
-            last_comm_check = uptime
-            
-            if using_sim and not using_wifi:
-                if not sim_available:
-                    sim_failure_count += 1
-                    print("SIM: Проблем детектиран (брой:", sim_failure_count, ")")
-                    
-                    if sim_failure_count >= config.SIM_FAILURE_THRESHOLD:
-                        print("SIM: Превключване към WiFi резервен режим...")
-                        if wifi.connect():
-                            wifi_connected, wifi_ip, wifi_rssi, wifi_ssid = wifi.get_status()
-                            if wifi_connected:
-                                using_wifi = True
-                                using_sim = False  
-                                sim_failure_count = 0
-                                print("WiFi: Активиран като резервен режим")
-                            else:
-                                print("WiFi: Неуспешно свързване, ще продължим да опитваме")
-                        else:
-                            print("WiFi: Неуспешно свързване, ще продължим да опитваме")
-                else:
-                    if sim_failure_count > 0:
-                        sim_failure_count = 0
-                        print("SIM: Статусът е възстановен")
-            elif using_wifi:
-                if sim_available:
-                    print("SIM: Работи отново, превключване обратно от WiFi към SIM...")
-                    wifi.disconnect()
-                    using_wifi = False
-                    using_sim = True
-                    sim_failure_count = 0
-                    print("SIM: Превключен обратно към основен режим")
-                else:
-                    if not wifi_connected:
-                        print("WiFi: Връзката е прекъсната, преподключване...")
-                        if wifi.connect():
-                            wifi_connected, wifi_ip, wifi_rssi, wifi_ssid = wifi.get_status()
-                            if wifi_connected:
-                                print("WiFi: Преподключен успешно")
-
-        if uptime - last_gps >= config.GPS_READ_EVERY_S:
-            last_gps = uptime
-            new_lat, new_lon = sim.gps_read()
-            if new_lat is not None and new_lon is not None:
-                lat, lon = new_lat, new_lon
+        if config.TEST_ENABLED and config.TEST_RUN_ON_STARTUP:
+            print("Изпълняване на тестове...")
+            try:
+                sys.path.append("tests")
+                from run_all_tests import main as run_tests
+                tests_success = run_tests()
+                if not tests_success:
+                    print("ВНИМАНИЕ: Някои тестове са провалени!")
+                time.sleep(2)
+            except Exception as e:
+                print("Грешка при изпълняване на тестове:", e)
+
+        self.sim.init()
+
+        print("ВРЪЗКА: Основна комуникация:", self.links.primary)
+
+        self.sim_ok, self.sim_present, self.sim_rssi = self.sim.status()
+        self.sim_available = self.sim_ok and self.sim_present
+        self.links.update(LINK_SIM, self.sim_available, csq_to_dbm(self.sim_rssi))
+        if not self.sim_available:
+            print("SIM: Проблем детектиран при стартиране, проверяване WiFi...")
+        self._apply_link()
+
+        self.start_time_ms = time.ticks_ms()
+
+    def _apply_transport(self):
+        # MQTT, OTA и тестът на скоростта минават през активната връзка
+        if self.sim_net is None:
+            self.transport = LINK_WIFI
+            return
+        self.transport = LINK_SIM if self.using_sim else LINK_WIFI
+        net = self.sim_net if self.using_sim else None
+        if mqtt_client is not None:
+            mqtt_client.set_network(net)
+        self.ota_updater.set_network(net)
+        self.speed_test.set_network(net)
+
+    async def sample(self):
+        prof = self.profiler
+        with prof.stage("dht22.read"):
+            self.temp, self.humidity = self.dht22.read()
+        with prof.stage("mq2.read_avg"):
+            self.mq = self.mq2.read_avg()
+        with prof.stage("sds.read_once"):
+            self.pm25, self.pm10 = self.sds.read_once()
+
+        if self.alarms is not None:
+            self._evaluate_alarm("pm25", self.pm25)
+            self._evaluate_alarm("pm10", self.pm10)
+
+        agg = self.aggregator
+        agg.add("temperature", self.temp)
+        agg.add("humidity", self.humidity)
+        agg.add("mq2_raw", self.mq)
+        agg.add("pm25", self.pm25)
+        agg.add("pm10", self.pm10)
+        self.sampled.set()
+
+        with prof.stage("wifi.get_status"):
+            self.wifi_connected, self.wifi_ip, self.wifi_rssi, self.wifi_ssid = self.wifi.get_status()
+
+        if self.batch is not None and mqtt_client:
+            self.batch.add(self._reading())
+            if self.batch.is_ready():
+                await self.publish_batch()
+        elif self.deadband is not None and mqtt_client:
+            if self.deadband.check(self._reading()):
+                print("MQTT: Промяна в", self.deadband.reason, "- публикуване")
+                await self.publish_mqtt()
+
+    async def check_comm(self):
+        links = self.links
+        # Статусът е кеширан; при съмнение за проблем се обновява изцяло, както преди
+        with self.profiler.stage("sim.status", wall=True):
+            self.sim_ok, self.sim_present, self.sim_rssi = await self.sim.status_async(force=links.failures(LINK_SIM) > 0)
+        self.sim_available = self.sim_ok and self.sim_present
+        self.wifi_connected, self.wifi_ip, self.wifi_rssi, self.wifi_ssid = self.wifi.get_status()
+
+        links.update(LINK_SIM, self.sim_available, csq_to_dbm(self.sim_rssi))
+        if not self.wifi.is_connecting():
+            links.update(LINK_WIFI, self.wifi_connected, self.wifi_rssi)
+        if links.evaluate() is not None:
+            self._apply_link()
+
+        # WiFi се държи свързан, когато е активен, горещ резерв или SIM има проблем
+        if links.wants(LINK_WIFI):
+            if not self.wifi_connected and not self.wifi.is_connecting():
+                uptime = self.uptime_s()
+                if uptime - self.last_wifi_attempt >= config.WIFI_CHECK_INTERVAL_S:
+                    self.last_wifi_attempt = uptime
+                    print("WiFi: Свързване като", "активна връзка" if links.active == LINK_WIFI else "резерв", "...")
+                    self._begin_wifi()
+        elif self.wifi_connected:
+            print("WiFi: Не е нужен, изключване")
+            self.wifi.disconnect()
+            self.wifi_connected = False
+
+    def _apply_link(self):
+        self.using_sim = self.links.active == LINK_SIM
+        self.using_wifi = not self.using_sim
+        self._apply_transport()
+
+    def _record_publish(self, ok):
+        # Успеваемостта и времето за отговор се отчитат на връзката, която е пренесла съобщението
+        link = self.transport
+        self.links.record_publish(link, ok)
+        if ok and mqtt_client.last_rtt_ms is not None:
+            self.links.record_rtt(link, mqtt_client.last_rtt_ms)
+
+    def _begin_wifi(self):
+        if self.wifi.begin() and self.wifi.state == WIFI_CONNECTED:
+            self._on_wifi_connected()
+
+    def _on_wifi_connected(self):
+        self.wifi_connected, self.wifi_ip, self.wifi_rssi, self.wifi_ssid = self.wifi.get_status()
+        if not self.wifi_connected:
+            return
+        # Превключването (ако е нужно) не чака следващата проверка на комуникацията
+        self.links.update(LINK_WIFI, True, self.wifi_rssi)
+        if self.links.evaluate() is not None:
+            self._apply_link()
+
+    async def _scan_window(self):
+        # Блокиращото WiFi сканиране (~2 s) започва веднага след проба, за да не я измести
+        self.sampled.clear()
+        await self.sampled.wait()
+
+    async def step_wifi(self):
+        # Един ход на свързването към WiFi; само стъпката със сканиране блокира
+        if not self.wifi.is_connecting():
+            return
+        if self.wifi.needs_scan():
+            await self._scan_window()
+            with self.profiler.stage("wifi.scan"):
+                connected = self.wifi.step()
+        else:
+            connected = self.wifi.step()
+        if connected:
+            self._on_wifi_connected()
+        elif self.wifi.state == WIFI_FAILED:
+            print("WiFi: Неуспешно свързване, ще продължим да опитваме")
+
+    async def scan_wifi(self):
+        # Опресняване на кеша от сканирането, докато сме свързани - при прекъсване изборът е готов
+        if not self.wifi_connected or self.wifi.is_connecting():
+            return
+        await self._scan_window()
+        with self.profiler.stage("wifi.scan"):
+            self.wifi.refresh_scan()
+        ap = self.wifi.better_ap()
+        if ap is not None:
+            self.wifi.roam(ap)
+            self.wifi_connected = False
+
+    async def read_gps(self):
+        # Неподвижна станция се проверява рядко; при движение или стар фикс - отново често
+        policy = self.gps_policy
+        if not policy.due():
+            if self.sim.gps_streaming():
+                self.sim.poll_urc()
+            if self.gps_power_save and not self.sim.gps_on and policy.remaining_ms() <= getattr(config, 'GPS_WARMUP_S', 30) * 1000:
+                # GNSS се включва малко преди четенето, за да има фикс
+                await self.sim.gps_power_async(True)
+            return
+
+        with self.profiler.stage("gps", wall=True):
+            new_lat, new_lon = await self.sim.gps_read_async()
+        if policy.update(new_lat, new_lon):
+            print("GPS: Интервал на четене", policy.interval_ms() // 1000, "s", "(неподвижна)" if policy.stationary else "(движение)")
+            if self.sim.gps_streaming():
+                report_s = policy.interval_ms() // 1000 if policy.stationary else getattr(config, 'GPS_REPORT_S', 1)
+                await self.sim.gps_report_async(report_s)
+        if policy.lat is not None:
+            self.lat, self.lon = policy.lat, policy.lon
+        if self.track is not None and new_lat is not None and new_lon is not None:
+            self.track.add(new_lat, new_lon, unix_time())
+        if self.gps_power_save and policy.stationary and self.sim.gps_on:
+            await self.sim.gps_power_async(False)
+
+    async def check_ota(self):
+        if self.has_internet():
+            with self.profiler.stage("ota", wall=True):
+                files_updated, needs_restart = await self.ota_updater.check_and_update_async()
+            if needs_restart:
+                print("OTA: Рестартиране за прилагане на обновленията...")
+                await asyncio.sleep(2)
+                import machine
+                machine.reset()
+
+    def _reading(self):
+        flags = 0
+        if self.using_sim:
+            flags |= FLAG_SIM
+        if self.sim_available:
+            flags |= FLAG_SIM_AVAILABLE
+        if self.wifi_connected:
+            flags |= FLAG_WIFI_CONNECTED
+        return {
+            "temperature": self.temp,
+            "humidity": self.humidity,
+            "mq2": self.mq,
+            "pm25": self.pm25,
+            "pm10": self.pm10,
+            "unix": unix_time(),
+            "flags": flags
+        }
+
+    def _json_payload(self, stats):
+        current_time = time.localtime()
+        time_str = None
+        date_str = None
         
-        if uptime - last_ota_check >= config.OTA_CHECK_INTERVAL_S:
-            last_ota_check = uptime
-            if (using_wifi and wifi_connected) or (using_sim and sim_available):
-                files_updated, needs_restart = ota_updater.check_and_update()
-                if needs_restart:
-                    print("OTA: Рестартиране за прилагане на обновленията...")
-                    time.sleep(2)
-                    import machine
-                    machine.reset()
+        if current_time and len(current_time) >= 6:
+            time_str = "{:02d}:{:02d}:{:02d}".format(
+                current_time[3],  # час
+                current_time[4],  # минута
+                current_time[5]  # секунда
+            )   
+            date_str = "{:02d}/{:02d}/{:04d}".format(
+                current_time[2],  # ден
+                current_time[1],  # месец
+                current_time[0]   # година
+            )
         
-        if mqtt_client and hasattr(config, 'MQTT_PUBLISH_INTERVAL_S'):
-            if uptime - last_mqtt_publish >= config.MQTT_PUBLISH_INTERVAL_S:
-                last_mqtt_publish = uptime
+        sensor_data = {
+            "device_id": config.DEVICE_NAME,
+            "timestamp": {
+                "time": time_str,
+                "date": date_str,
+                "unix": time.time() if hasattr(time, 'time') else None
+            },
+            "sensors": {
+                "dht22": {
+                    "temperature": self.temp,
+                    "humidity": self.humidity
+                },
+                "mq2": {
+                    "raw_value": self.mq
+                },
+                "sds011": {
+                    "pm25": self.pm25,
+                    "pm10": self.pm10
+                }
+            },
+            "communication": {
+                "type": "sim" if self.using_sim else "wifi",
+                "sim_available": self.sim_available,
+                "wifi_connected": self.wifi_connected
+            }
+        }
+        if stats:
+            sensor_data["stats"] = stats
+        return sensor_data
 
-                has_internet = (using_wifi and wifi_connected) or (using_sim and sim_available)
-                
-                if has_internet:
-                    print("MQTT: Започване на публикуване на данни...")
-                    try:
-                        current_time = time.localtime()
-                        time_str = None
-                        date_str = None
-                        
-                        if current_time and len(current_time) >= 6:
-                            time_str = "{:02d}:{:02d}:{:02d}".format(
-                                current_time[3],  # час
-                                current_time[4],  # минута
-                                current_time[5]  # секунда
-                            )   
-                            date_str = "{:02d}/{:02d}/{:04d}".format(
-                                current_time[2],  # ден
-                                current_time[1],  # месец
-                                current_time[0]   # година
-                            )
-                        
-                        sensor_data = {
-                            "device_id": config.DEVICE_NAME,
-                            "timestamp": {
-                                "time": time_str,
-                                "date": date_str,
-                                "unix": time.time() if hasattr(time, 'time') else None
-                            },
-                            "sensors": {
-                                "dht22": {
-                                    "temperature": temp if temp is not None else None,
-                                    "humidity": humidity if humidity is not None else None
-                                },
-                                "mq2": {
-                                    "raw_value": mq if mq is not None else None
-                                },
-                                "sds011": {
-                                    "pm25": pm25 if pm25 is not None else None,
-                                    "pm10": pm10 if pm10 is not None else None
-                                }
-                            },
-                            "communication": {
-                                "type": "sim" if using_sim else "wifi",
-                                "sim_available": sim_available,
-                                "wifi_connected": wifi_connected
-                            }
-                        }
-                        
-                        topic_prefix = getattr(config, 'MQTT_TOPIC_PREFIX', 'iot/sensors')
-                        topic = "{}/{}".format(topic_prefix, config.DEVICE_NAME)
-                        print("MQTT: Публикуване на данни в topic:", topic)
-                        success = mqtt_client.publish_sensor_data(
-                            topic_prefix,
-                            config.DEVICE_NAME,
-                            sensor_data
-                        )
-                        
-                        if success:
-                            print("MQTT: ✓ Данните са публикувани успешно в", topic)
-                        else:
-                            print("MQTT: ✗ Грешка при публикуване на данни в", topic)
-                            
-                    except Exception as e:
-                        print("MQTT: ✗ Грешка при подготовка/публикуване на данни:", e)
-                        import sys
-                        sys.print_exception(e)
-                else:
+    async def publish_mqtt(self):
+        self.last_mqtt_publish = self.uptime_s()
+
+        if self.has_internet():
+            print("MQTT: Започване на публикуване на данни...")
+        try:
+            stats = None
+            if getattr(config, 'MQTT_WINDOW_STATS', True):
+                # Статистика за всички проби от прозореца след последното публикуване
+                stats = self.aggregator.summary()
+            self.aggregator.reset()
+            
+            reading = self._reading()
+            if self.deadband is not None:
+                self.deadband.mark(reading)
+            
+            if self.codec.is_binary():
+                sensor_data = self.codec.encode(reading, stats)
+            else:
+                sensor_data = self._json_payload(stats)
+            
+            topic_prefix = getattr(config, 'MQTT_TOPIC_PREFIX', 'iot/sensors')
+            topic = "{}/{}".format(topic_prefix, config.DEVICE_NAME)
+            
+            if not self.has_internet():
+                if not mqtt_client.enqueue(topic, sensor_data):
                     print("MQTT: Няма интернет връзка, пропускане на публикуване")
-        
-        if uptime - last_speed_test >= config.SPEED_TEST_INTERVAL_S:
-            last_speed_test = uptime
-            if using_wifi and wifi_connected:
-                print("Тест на скорост: Тестване на WiFi връзка...")
-                result = speed_test.quick_test(include_upload=True)
-                internet_speed_kbps = result['download_kbps']
-                internet_upload_kbps = result['upload_kbps']
-                internet_ping_ms = result['ping_ms']
-                bytes_received = result['bytes_received']
-                bytes_sent = result.get('bytes_sent', 0)
-                if internet_speed_kbps:
-                    upload_str = "{} Kbps".format(internet_upload_kbps) if internet_upload_kbps else "Н/Д"
-                    print("Тест на скорост: Изтегляне:", internet_speed_kbps, "Kbps | Качване:", upload_str, "| Ping:", internet_ping_ms, "ms")
-                    if hasattr(wifi, 'update_traffic'):
-                        wifi.update_traffic(bytes_sent=bytes_sent, bytes_received=bytes_received)
-                else:
-                    print("Тест на скорост: Неуспешен")
-            elif using_sim and sim_available:
-                print("Тест на скорост: Тестване на SIM връзка...")
-                result = speed_test.quick_test(include_upload=True)
-                internet_speed_kbps = result['download_kbps']
-                internet_upload_kbps = result['upload_kbps']
-                internet_ping_ms = result['ping_ms']
-                bytes_received = result['bytes_received']
-                bytes_sent = result.get('bytes_sent', 0)
-                if internet_speed_kbps:
-                    upload_str = "{} Kbps".format(internet_upload_kbps) if internet_upload_kbps else "Н/Д"
-                    print("Тест на скорост: Изтегляне:", internet_speed_kbps, "Kbps | Качване:", upload_str, "| Ping:", internet_ping_ms, "ms")
-                    if hasattr(sim, 'update_traffic'):
-                        sim.update_traffic(bytes_sent=bytes_sent, bytes_received=bytes_received)
-                else:
-                    print("Тест на скорост: Неуспешен")
-        
+                return
+            
+            print("MQTT: Публикуване на данни в topic:", topic)
+            with self.profiler.stage("mqtt", wall=True):
+                success = await mqtt_client.publish_sensor_data_async(
+                    topic_prefix,
+                    config.DEVICE_NAME,
+                    sensor_data
+                )
+            
+            self._record_publish(success)
+            if success:
+                print("MQTT: ✓ Данните са публикувани успешно в", topic)
+            else:
+                print("MQTT: ✗ Грешка при публикуване на данни в", topic)
+                
+        except Exception as e:
+            print("MQTT: ✗ Грешка при подготовка/публикуване на данни:", e)
+            sys.print_exception(e)
+
+    def _evaluate_alarm(self, name, value):
+        alarm = self.alarms.evaluate(name, value)
+        if alarm is not None:
+            print("АЛАРМА:", name, alarm["event"], "стойност", value)
+
+    async def check_alarms(self):
+        # Бърз път: MQ2 се чете от фоновия буфер; PM каналите се оценяват при всяко ново четене в sample()
+        self.mq = self.mq2.read_avg()
+        self._evaluate_alarm("mq2", self.mq)
+
+        if self.alarms.pending and mqtt_client and self.has_internet():
+            await self.publish_alarms()
+
+    async def publish_alarms(self):
+        topic_prefix = getattr(config, 'MQTT_TOPIC_PREFIX', 'iot/sensors')
+        topic = "{}/{}/alarm".format(topic_prefix, config.DEVICE_NAME)
+        ack_timeout_ms = getattr(config, 'ALARM_ACK_TIMEOUT_MS', 3000)
+
+        # Алармите се изпращат преди данните от опашката и пакетите и могат да заемат запазените места в прозореца
+        while self.alarms.pending:
+            alarm = self.alarms.pending[0]
+            message = {
+                "device_id": config.DEVICE_NAME,
+                "channel": alarm["channel"],
+                "event": alarm["event"],
+                "value": alarm["value"],
+                "threshold": alarm["threshold"],
+                "rate": alarm["rate"],
+                "unix": unix_time()
+            }
+            if not await mqtt_client.publish_async(topic, message, qos=1, priority=True):
+                self._record_publish(False)
+                print("АЛАРМА: ✗ Грешка при публикуване, нов опит по-късно")
+                return
+            self._record_publish(True)
+            self.alarms.pending.pop(0)
+
+            # Латентност от откриването до PUBACK за точно това съобщение
+            if await mqtt_client.wait_ack_async(mqtt_client.last_msg_id, ack_timeout_ms):
+                latency = self.alarms.record_latency(alarm)
+                self.profiler.stage("alarm.latency").record(latency * 1000)
+                print("АЛАРМА: ✓ Публикувана в", topic, "за", latency, "ms")
+                # Измерената латентност се изпраща отделно в <topic>/latency; unix съвпада с този на алармата
+                await mqtt_client.publish_async(topic + "/latency", {
+                    "device_id": config.DEVICE_NAME,
+                    "channel": alarm["channel"],
+                    "event": alarm["event"],
+                    "unix": message["unix"],
+                    "latency_ms": latency
+                }, qos=0)
+            else:
+                print("АЛАРМА: Няма PUBACK до", ack_timeout_ms, "ms")
+
+    async def publish_heartbeat(self):
+        if not self.deadband.heartbeat_due() or not self.has_internet():
+            return
+        topic_prefix = getattr(config, 'MQTT_TOPIC_PREFIX', 'iot/sensors')
+        topic = "{}/{}/heartbeat".format(topic_prefix, config.DEVICE_NAME)
+        heartbeat = {
+            "device_id": config.DEVICE_NAME,
+            "uptime_s": self.uptime_s(),
+            "suppressed": self.deadband.suppressed
+        }
+        if await mqtt_client.publish_async(topic, heartbeat, qos=0):
+            self.deadband.mark_heartbeat()
+
+    async def publish_batch(self):
+        self.last_mqtt_publish = self.uptime_s()
+        try:
+            count = self.batch.count
+            track = self.track.take() if self.track is not None else None
+            stats = None
+            if getattr(config, 'MQTT_WINDOW_STATS', True):
+                # Статистиката обхваща пробите от пакета и се нулира с него
+                stats = self.aggregator.summary()
+            self.aggregator.reset()
+            payload = self.batch.encode(track, stats)
+            self.batch.reset()
+
+            topic_prefix = getattr(config, 'MQTT_TOPIC_PREFIX', 'iot/sensors')
+            topic = "{}/{}".format(topic_prefix, config.DEVICE_NAME)
+
+            if not self.has_internet():
+                mqtt_client.enqueue(topic, payload)
+                return
+
+            with self.profiler.stage("mqtt", wall=True):
+                success = await mqtt_client.publish_sensor_data_async(topic_prefix, config.DEVICE_NAME, payload)
+
+            self._record_publish(success)
+            if success:
+                print("MQTT: ✓ Пакет с {} проби ({} B) публикуван в {}".format(count, len(payload), topic))
+            else:
+                print("MQTT: ✗ Грешка при публикуване на пакет в", topic)
+
+        except Exception as e:
+            print("MQTT: ✗ Грешка при подготовка/публикуване на пакет:", e)
+            sys.print_exception(e)
+
+    async def run_speed_test(self):
+        if self.using_wifi and self.wifi_connected:
+            print("Тест на скорост: Тестване на WiFi връзка...")
+            await self._speed_test_link(self.wifi)
+        elif self.using_sim and self.sim_available:
+            print("Тест на скорост: Тестване на SIM връзка...")
+            await self._speed_test_link(self.sim)
+
+    async def _speed_test_link(self, link):
+        with self.profiler.stage("speed_test", wall=True):
+            result = await self.speed_test.quick_test_async(include_upload=True)
+        self.internet_speed_kbps = result['download_kbps']
+        self.internet_upload_kbps = result['upload_kbps']
+        self.internet_ping_ms = result['ping_ms']
+        bytes_received = result['bytes_received']
+        bytes_sent = result.get('bytes_sent', 0)
+        if self.internet_speed_kbps:
+            upload_str = "{} Kbps".format(self.internet_upload_kbps) if self.internet_upload_kbps else "Н/Д"
+            print("Тест на скорост: Изтегляне:", self.internet_speed_kbps, "Kbps | Качване:", upload_str, "| Ping:", self.internet_ping_ms, "ms")
+            if hasattr(link, 'update_traffic'):
+                link.update_traffic(bytes_sent=bytes_sent, bytes_received=bytes_received)
+        else:
+            print("Тест на скорост: Неуспешен")
+
+    async def render_console(self):
+        with self.profiler.stage("console"):
+            self._render_console()
+
+    async def publish_perf(self):
+        if not self.has_internet():
+            return
+
+        summary = self.profiler.summary()
+        summary["device_id"] = config.DEVICE_NAME
+        summary["links"] = self.links.summary()
+        topic_prefix = getattr(config, 'MQTT_TOPIC_PREFIX', 'iot/sensors')
+        topic = "{}/{}/perf".format(topic_prefix, config.DEVICE_NAME)
+        if await mqtt_client.publish_async(topic, summary, qos=0):
+            print("PERF: Обобщението е публикувано в", topic)
+            self.profiler.reset()
+        else:
+            print("PERF: ✗ Грешка при публикуване в", topic)
+
+    async def poll_mqtt(self):
+        if mqtt_client.is_connected():
+            mqtt_client.poll()
+
+    async def drain_offline_queue(self):
+        if self.has_internet() and mqtt_client.has_queued():
+            with self.profiler.stage("mqtt.drain", wall=True):
+                await mqtt_client.flush_offline_queue_async(getattr(config, 'OFFLINE_QUEUE_BATCH', 10))
+
+    def _render_console(self):
         try:
-            if using_wifi:
-                if hasattr(wifi, 'get_traffic_stats'):
-                    bytes_sent, bytes_received, total_bytes = wifi.get_traffic_stats()
+            if self.using_wifi:
+                if hasattr(self.wifi, 'get_traffic_stats'):
+                    bytes_sent, bytes_received, total_bytes = self.wifi.get_traffic_stats()
                 else:
                     bytes_sent, bytes_received, total_bytes = 0, 0, 0
-            elif using_sim:
-                if hasattr(sim, 'get_traffic_stats'):
-                    bytes_sent, bytes_received, total_bytes = sim.get_traffic_stats()
+            elif self.using_sim:
+                if hasattr(self.sim, 'get_traffic_stats'):
+                    bytes_sent, bytes_received, total_bytes = self.sim.get_traffic_stats()
                 else:
                     bytes_sent, bytes_received, total_bytes = 0, 0, 0
             else:
@@ -311,6 +619,8 @@ def main():
             print("Грешка при статистика за трафик:", e)
             bytes_sent, bytes_received, total_bytes = 0, 0, 0
 
+        uptime_ms = self.uptime_ms()
+        uptime = uptime_ms // 1000
         uptime_formatted = format_time_ms(uptime_ms)
 
         try:
@@ -326,48 +636,58 @@ def main():
         print("=" * 45)
         print("IoT Станция:", config.DEVICE_NAME, "|", time_str)
 
-        if temp is None or humidity is None:
+        if self.temp is None or self.humidity is None:
             print("DHT22: НЯМА ДАННИ")
         else:
-            print("DHT22:", temp, "°C |", humidity, "%")
+            print("DHT22:", self.temp, "°C |", self.humidity, "%")
 
-        print("MQ-2: сурово =", mq)
+        print("MQ-2: сурово =", self.mq)
 
-        if pm25 is None or pm10 is None:
+        if self.pm25 is None or self.pm10 is None:
             print("SDS011: изчакване на данни...")
         else:
-            print("SDS011: PM2.5 =", pm25, "ug/m3 | PM10 =", pm10, "ug/m3")
+            print("SDS011: PM2.5 =", self.pm25, "ug/m3 | PM10 =", self.pm10, "ug/m3")
 
         print(
             "SIM7600: UART =",
-            ("ОК" if sim_ok else "НЕ"),
+            ("ОК" if self.sim_ok else "НЕ"),
             "| SIM =",
-            ("ДА" if sim_present else "НЕ"),
+            ("ДА" if self.sim_present else "НЕ"),
             "| RSSI =",
-            sim_rssi
+            self.sim_rssi
         )
 
-        if lat is None or lon is None:
+        if self.lat is None or self.lon is None:
             print("GPS: все още няма фикс")
+        elif self.sim.gps_streaming():
+            gps = self.sim.gps
+            print("GPS:", self.lat, ",", self.lon, "| HDOP =", gps.hdop, "| Скорост =", gps.speed_kmh, "km/h | Възраст =", self.gps_policy.fix_age_ms(), "ms")
         else:
-            print("GPS:", lat, ",", lon)
+            print("GPS:", self.lat, ",", self.lon, "| Възраст =", self.gps_policy.fix_age_ms(), "ms")
         
-        if using_sim:
-            wifi_status = "Наличен" if wifi_connected else "Недостъпен"
-            print("КОМУНИКАЦИЯ: SIM ОСНОВЕН | WiFi:", wifi_status, "(резервен)")
-        elif using_wifi:
-            if wifi_connected:
-                sim_status = "НЕРАБОТИ" if not (sim_ok and sim_present) else "ОК"
-                print("КОМУНИКАЦИЯ: WiFi РЕЗЕРВЕН | IP:", wifi_ip if wifi_ip else "Н/Д", "| SIM:", sim_status, "(основен недостъпен)")
+        if self.using_sim:
+            wifi_status = "Наличен" if self.wifi_connected else "Недостъпен"
+            print("КОМУНИКАЦИЯ: SIM АКТИВЕН | WiFi:", wifi_status, "(резервен)")
+        elif self.using_wifi:
+            if self.wifi_connected:
+                sim_status = "НЕРАБОТИ" if not (self.sim_ok and self.sim_present) else "ОК"
+                print("КОМУНИКАЦИЯ: WiFi АКТИВЕН | IP:", self.wifi_ip if self.wifi_ip else "Н/Д", "| SIM:", sim_status)
             else:
                 print("КОМУНИКАЦИЯ: WiFi СВЪРЗВАНЕ...")
         else:
             print("КОМУНИКАЦИЯ: Няма налична връзка")
+        links = self.links
+        print(
+            "ВРЪЗКА: Оценки SIM =", links.score(LINK_SIM),
+            "| WiFi =", links.score(LINK_WIFI),
+            "| Превключвания:", links.switches,
+            "| Последно възстановяване:", "{} ms".format(links.last_failover_ms) if links.last_failover_ms is not None else "Н/Д"
+        )
         
-        if internet_speed_kbps is not None:
-            download_str = "{:.2f} Kbps".format(internet_speed_kbps)
-            upload_str = "{:.2f} Kbps".format(internet_upload_kbps) if internet_upload_kbps else "Н/Д"
-            ping_str = "{} ms".format(internet_ping_ms) if internet_ping_ms else "Н/Д"
+        if self.internet_speed_kbps is not None:
+            download_str = "{:.2f} Kbps".format(self.internet_speed_kbps)
+            upload_str = "{:.2f} Kbps".format(self.internet_upload_kbps) if self.internet_upload_kbps else "Н/Д"
+            ping_str = "{} ms".format(self.internet_ping_ms) if self.internet_ping_ms else "Н/Д"
             print("СКОРОСТ: Изтегляне:", download_str, "| Качване:", upload_str, "| Ping:", ping_str)
         else:
             print("СКОРОСТ: Все още не е тествана")
@@ -387,7 +707,7 @@ def main():
             print("ТРАФИК: Няма данни")
         
         if config.OTA_ENABLED:
-            ota_status = ota_updater.get_status()
+            ota_status = self.ota_updater.get_status()
             next_check = ota_status['next_check_in']
             next_check_str = "{} с".format(next_check)
             print("OTA: Активен | Следваща проверка след:", next_check_str)
@@ -396,7 +716,7 @@ def main():
         
         if mqtt_client and hasattr(config, 'MQTT_ENABLED') and config.MQTT_ENABLED:
             if mqtt_client.is_connected():
-                next_mqtt = config.MQTT_PUBLISH_INTERVAL_S - (uptime - last_mqtt_publish)
+                next_mqtt = config.MQTT_PUBLISH_INTERVAL_S - (uptime - self.last_mqtt_publish)
                 if next_mqtt < 0:
                     next_mqtt = 0
                 broker_info = "{}:{}".format(config.MQTT_BROKER_HOST, config.MQTT_BROKER_PORT)
@@ -405,8 +725,46 @@ def main():
                 broker_info = "{}:{}".format(config.MQTT_BROKER_HOST, config.MQTT_BROKER_PORT)
                 print("MQTT: ✗ Не е свързан към {}".format(broker_info))
 
-        time.sleep(config.MAIN_PERIOD_S)
+
+def main():
+    profiler = StageProfiler(getattr(config, 'PERF_ENABLED', False))
+    station = Station(profiler)
+    station.startup()
+
+    # Всяка задача има собствен период; мрежовите операции не спират отчитането на сензорите
+    scheduler = Scheduler()
+    scheduler.every("sample", config.MAIN_PERIOD_S, station.sample)
+    if station.alarms is not None:
+        scheduler.every("alarm", getattr(config, 'ALARM_CHECK_INTERVAL_S', 1), station.check_alarms)
+    scheduler.every("comm", config.MAIN_PERIOD_S, station.check_comm)
+    scheduler.every("wifi", getattr(config, 'WIFI_STEP_INTERVAL_MS', 100) / 1000, station.step_wifi)
+    wifi_scan_s = getattr(config, 'WIFI_SCAN_INTERVAL_S', 300)
+    scheduler.every("wifi_scan", wifi_scan_s, station.scan_wifi, delay_s=wifi_scan_s)
+    if station.sim.gps_streaming():
+        # Позицията идва сама от модема; задачата само изчита UART буфера
+        gps_interval = getattr(config, 'GPS_STREAM_POLL_S', 1)
+    else:
+        gps_interval = config.GPS_READ_EVERY_S
+    scheduler.every("gps", gps_interval, station.read_gps, delay_s=gps_interval)
+    scheduler.every("ota", config.OTA_CHECK_INTERVAL_S, station.check_ota, delay_s=config.OTA_CHECK_INTERVAL_S)
+    if mqtt_client and hasattr(config, 'MQTT_PUBLISH_INTERVAL_S'):
+        # При пакетен режим пробите се изпращат от задачата "sample"
+        if station.deadband is not None:
+            # Публикуване при промяна (от задачата "sample"); иначе само heartbeat
+            heartbeat_s = getattr(config, 'MQTT_HEARTBEAT_S', 900)
+            scheduler.every("heartbeat", heartbeat_s, station.publish_heartbeat, delay_s=heartbeat_s)
+        elif station.batch is None:
+            scheduler.every("mqtt", config.MQTT_PUBLISH_INTERVAL_S, station.publish_mqtt, delay_s=config.MQTT_PUBLISH_INTERVAL_S)
+        scheduler.every("mqtt_poll", getattr(config, 'MQTT_POLL_INTERVAL_S', 1), station.poll_mqtt)
+    if mqtt_client and getattr(config, 'OFFLINE_QUEUE_ENABLED', False):
+        scheduler.every("mqtt_drain", getattr(config, 'OFFLINE_QUEUE_DRAIN_INTERVAL_S', 10), station.drain_offline_queue)
+    scheduler.every("speed_test", config.SPEED_TEST_INTERVAL_S, station.run_speed_test, delay_s=config.SPEED_TEST_INTERVAL_S)
+    scheduler.every("console", config.MAIN_PERIOD_S, station.render_console)
+    if mqtt_client and profiler.is_enabled():
+        perf_interval = getattr(config, 'PERF_PUBLISH_INTERVAL_S', 900)
+        scheduler.every("perf", perf_interval, station.publish_perf, delay_s=perf_interval)
+    scheduler.run()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
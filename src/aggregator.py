@@ -0,0 +1,133 @@
+import math
+
+
+class ChannelStats:
+
+    def __init__(self, p=0.95):
+        self._p = p
+        # P² алгоритъм (Jain & Chlamtac): 5 маркера вместо да се пазят всички проби
+        self._dn = (0.0, p / 2.0, p, (1.0 + p) / 2.0, 1.0)
+        self._q = [0.0] * 5
+        self._n = [0] * 5
+        self._np = [0.0] * 5
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        if x is None:
+            return
+        x = float(x)
+
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+        self._add_quantile(x)
+
+    def _add_quantile(self, x):
+        q = self._q
+        n = self._n
+        np = self._np
+        c = self.count
+
+        if c <= 5:
+            q[c - 1] = x
+            if c == 5:
+                q.sort()
+                for i in range(5):
+                    n[i] = i
+                    np[i] = 4.0 * self._dn[i]
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            np[i] += self._dn[i]
+
+        for i in range(1, 4):
+            d = np[i] - n[i]
+            if (d >= 1.0 and n[i + 1] - n[i] > 1) or (d <= -1.0 and n[i - 1] - n[i] < -1):
+                s = 1 if d >= 0 else -1
+                qp = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < qp < q[i + 1]:
+                    q[i] = qp
+                else:
+                    q[i] += s * (q[i + s] - q[i]) / (n[i + s] - n[i])
+                n[i] += s
+
+    def percentile(self):
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            first = sorted(self._q[:self.count])
+            return first[int(round(self._p * (self.count - 1)))]
+        return self._q[2]
+
+    def stddev(self):
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.count - 1))
+
+    def summary(self, ndigits=2):
+        if self.count == 0:
+            return None
+        return {
+            'n': self.count,
+            'min': round(self.min, ndigits),
+            'max': round(self.max, ndigits),
+            'mean': round(self.mean, ndigits),
+            'std': round(self.stddev(), ndigits),
+            'p{}'.format(int(self._p * 100)): round(self.percentile(), ndigits)
+        }
+
+
+class WindowAggregator:
+
+    def __init__(self, channels, p=0.95):
+        self._channels = {}
+        for name in channels:
+            self._channels[name] = ChannelStats(p)
+
+    def add(self, name, value):
+        ch = self._channels.get(name)
+        if ch is not None:
+            ch.add(value)
+
+    def channel(self, name):
+        return self._channels.get(name)
+
+    def summary(self):
+        result = {}
+        for name, ch in self._channels.items():
+            result[name] = ch.summary()
+        return result
+
+    def reset(self):
+        for ch in self._channels.values():
+            ch.reset()
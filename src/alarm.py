@@ -0,0 +1,110 @@
+import time
+import config
+
+# канал: праг за аларма, праг за изчистване (хистерезис), максимална скорост на нарастване (единици/s)
+# Аларма по скорост се изчиства под "clear", при скорост под "rate_clear" (по подразбиране rate / 2)
+# и не по-рано от "hold_s" секунди след задействането
+_DEFAULT_RULES = {
+    "mq2": {"high": 2500, "clear": 2200, "rate": 400},
+    "pm25": {"high": 75.0, "clear": 55.0, "rate": 20.0},
+    "pm10": {"high": 150.0, "clear": 120.0, "rate": 40.0}
+}
+_MAX_PENDING = 8
+_DEFAULT_HOLD_S = 30
+
+
+class AlarmEngine:
+
+    def __init__(self, rules=None):
+        rules = rules or getattr(config, 'ALARM_RULES', _DEFAULT_RULES)
+        self._rules = rules
+        self._active = {}
+        self._trigger = {}
+        self._since_ms = {}
+        self._last = {}
+        self._last_ms = {}
+        for name in rules:
+            self._active[name] = False
+            self._trigger[name] = None
+            self._since_ms[name] = 0
+            self._last[name] = None
+            self._last_ms[name] = 0
+        self.pending = []
+        self.raised = 0
+        self.last_latency_ms = None
+        self.max_latency_ms = 0
+
+    def is_active(self, name):
+        return self._active.get(name, False)
+
+    def _can_clear(self, name, rule, value, rate, now):
+        # Хистерезис: алармата се изчиства само под по-ниския праг
+        if value > rule.get("clear", rule["high"]):
+            return False
+        if self._trigger[name] != "rate":
+            return True
+        # Аларма по скорост: при равномерно нарастване под прага не се изчиства и не се вдига отново
+        rate_clear = rule.get("rate_clear", rule["rate"] / 2)
+        if rate is not None and rate > rate_clear:
+            return False
+        hold_ms = int(rule.get("hold_s", _DEFAULT_HOLD_S) * 1000)
+        return time.ticks_diff(now, self._since_ms[name]) >= hold_ms
+
+    def evaluate(self, name, value, now=None):
+        rule = self._rules.get(name)
+        if rule is None or value is None:
+            return None
+
+        now = time.ticks_ms() if now is None else now
+        last = self._last[name]
+        last_ms = self._last_ms[name]
+        self._last[name] = value
+        self._last_ms[name] = now
+
+        rate = None
+        if last is not None:
+            dt_ms = time.ticks_diff(now, last_ms)
+            if dt_ms > 0:
+                rate = (value - last) * 1000.0 / dt_ms
+
+        event = None
+        if self._active[name]:
+            if self._can_clear(name, rule, value, rate, now):
+                self._active[name] = False
+                self._trigger[name] = None
+                event = "clear"
+            elif self._trigger[name] == "rate" and value >= rule["high"]:
+                # Нарастването е достигнало прага - едно събитие "high", после обикновен хистерезис
+                event = "high"
+        elif value >= rule["high"]:
+            event = "high"
+        elif rate is not None and "rate" in rule and rate >= rule["rate"]:
+            event = "rate"
+
+        if event is None:
+            return None
+        if event != "clear":
+            self._active[name] = True
+            self._trigger[name] = event
+            self._since_ms[name] = now
+            self.raised += 1
+
+        alarm = {
+            "channel": name,
+            "event": event,
+            "value": value,
+            "threshold": rule["high"],
+            "rate": round(rate, 2) if rate is not None else None,
+            "detected_ms": now
+        }
+        if len(self.pending) >= _MAX_PENDING:
+            self.pending.pop(0)
+        self.pending.append(alarm)
+        return alarm
+
+    def record_latency(self, alarm):
+        latency = time.ticks_diff(time.ticks_ms(), alarm["detected_ms"])
+        self.last_latency_ms = latency
+        if latency > self.max_latency_ms:
+            self.max_latency_ms = latency
+        return latency
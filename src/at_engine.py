@@ -0,0 +1,281 @@
+import time
+import uselect
+import uasyncio as asyncio
+
+_FINAL_OK = b"OK"
+_FINAL_ERRORS = (b"ERROR", b"NO CARRIER", b"BUSY", b"NO ANSWER", b"NO DIALTONE")
+_FINAL_PREFIXES = (b"+CME ERROR", b"+CMS ERROR")
+# Максимално време между проверките дали отговорът не е дочетен от poll() на друга задача
+_ASYNC_SLICE_MS = 20
+
+
+def _command_prefixes(cmd):
+    # "AT+CPIN?;+CSQ" -> (b"+CPIN", b"+CSQ"): редовете с тези префикси са отговор, а не URC
+    if isinstance(cmd, str):
+        cmd = cmd.encode()
+    body = cmd[2:] if cmd[:2].upper() == b"AT" else cmd
+    prefixes = []
+    for part in body.split(b";"):
+        for sep in (b"=", b"?"):
+            i = part.find(sep)
+            if i >= 0:
+                part = part[:i]
+        if part.startswith(b"+"):
+            prefixes.append(part)
+    return tuple(prefixes)
+
+
+class ATEngine:
+
+    def __init__(self, uart, buf_size=512, stream=True):
+        self._uart = uart
+        # stream=False: command_async проверява any() на кратки интервали вместо asyncio.StreamReader
+        self._stream = stream
+        self._buf = bytearray(buf_size)
+        self._mv = memoryview(self._buf)
+        self._len = 0
+        self._poller = None
+        self._reader = None
+        self._scratch = bytearray(64)
+        self._lock = asyncio.Lock()
+        self._urc = {}
+
+        self._cmd = None
+        self._prefixes = ()
+        self._lines = []
+        self._final = None
+        self._want_prompt = False
+        self._prompt = False
+        self._raw_need = 0
+        self._raw_sink = None
+
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.last_rx_ms = None
+        self.urc_unhandled = 0
+        self.overflows = 0
+
+    def on_urc(self, prefix, callback):
+        if isinstance(prefix, str):
+            prefix = prefix.encode()
+        self._urc[prefix] = callback
+
+    def is_busy(self):
+        return self._cmd is not None
+
+    def _is_final(self, line):
+        if line == _FINAL_OK or line in _FINAL_ERRORS:
+            return True
+        for prefix in _FINAL_PREFIXES:
+            if line.startswith(prefix):
+                return True
+        return False
+
+    def _dispatch_urc(self, line):
+        for prefix, callback in self._urc.items():
+            if line.startswith(prefix):
+                try:
+                    callback(line)
+                except Exception as e:
+                    print("AT: Грешка в URC обработчик:", e)
+                return True
+        return False
+
+    def _on_line(self, line):
+        if not line:
+            return
+        if self._cmd is not None:
+            if line == self._cmd:
+                return  # ехо на командата
+            if self._is_final(line):
+                self._final = line
+                return
+            for prefix in self._prefixes:
+                if line.startswith(prefix):
+                    self._lines.append(line)
+                    # Обработчикът на същия URC също вижда отговора, за да е актуално състоянието
+                    self._dispatch_urc(line)
+                    return
+        if self._dispatch_urc(line):
+            return
+        if self._cmd is not None:
+            self._lines.append(line)
+        else:
+            self.urc_unhandled += 1
+
+    def _process(self):
+        # Обработка на всички пълни редове; непълният остава в началото на буфера
+        buf = self._buf
+        mv = self._mv
+        start = 0
+        i = 0
+        while start < self._len:
+            if self._raw_need:
+                # Двоични данни след заглавен ред (напр. +CIPRXGET: 2,...) - без разделяне на редове
+                k = min(self._raw_need, self._len - start)
+                self._raw_sink(mv[start:start + k])
+                self._raw_need -= k
+                start += k
+                i = start
+                continue
+            if self._want_prompt and buf[start] == 0x3E:
+                # Покана "> " за данни след AT+CIPSEND и подобни
+                self._want_prompt = False
+                self._prompt = True
+                start += 1
+                i = start
+                continue
+            if i >= self._len:
+                break
+            if buf[i] == 0x0A:
+                self._on_line(bytes(mv[start:i]).strip())
+                start = i + 1
+            i += 1
+        if start:
+            remaining = self._len - start
+            mv[0:remaining] = mv[start:self._len]
+            self._len = remaining
+        elif self._len == len(buf):
+            # Ред по-дълъг от буфера - изхвърля се
+            self.overflows += 1
+            self._len = 0
+
+    def expect_raw(self, count, sink):
+        # Следващите count байта се подават на sink(memoryview) като двоични данни
+        self._raw_need = count
+        self._raw_sink = sink
+
+    def _received(self, n):
+        if n:
+            self._len += n
+            self.bytes_received += n
+            self.last_rx_ms = time.ticks_ms()
+            self._process()
+
+    def _feed(self, data):
+        # Прочетеното извън poll() се добавя в края на буфера към момента на получаване,
+        # а не на отместването отпреди изчакването - междувременно poll() може да е чел от UART
+        pos = 0
+        while pos < len(data):
+            k = min(len(data) - pos, len(self._buf) - self._len)
+            if not k:
+                self.overflows += 1
+                self._len = 0
+                continue
+            self._mv[self._len:self._len + k] = data[pos:pos + k]
+            pos += k
+            self._received(k)
+
+    def poll(self):
+        # Обработка на URC-тата, пристигнали между командите
+        while self._uart.any():
+            n = self._uart.readinto(self._mv[self._len:])
+            if not n:
+                break
+            self._received(n)
+
+    def _begin(self, cmd):
+        self._cmd = cmd.encode() if isinstance(cmd, str) else cmd
+        self._prefixes = _command_prefixes(self._cmd)
+        self._lines = []
+        self._final = None
+        data = self._cmd + b"\r\n"
+        self._uart.write(data)
+        self.bytes_sent += len(data)
+
+    def _finish(self):
+        lines = self._lines
+        if self._final is not None:
+            lines.append(self._final)
+        self._cmd = None
+        self._prefixes = ()
+        self._lines = []
+        self._final = None
+        return b"\r\n".join(lines)
+
+    def _wait_rx(self, timeout_ms):
+        if self._poller is None:
+            try:
+                self._poller = uselect.poll()
+                self._poller.register(self._uart, uselect.POLLIN)
+            except Exception:
+                # Потоци без поддръжка на poll (напр. заместител на модема в тестовете)
+                self._poller = False
+        # Събуждане веднага щом пристигнат данни, без фиксиран интервал на проверка
+        if self._poller:
+            self._poller.poll(timeout_ms)
+        elif not self._uart.any():
+            time.sleep_ms(1)
+        self.poll()
+
+    def wait(self, done, timeout_ms):
+        # Изчакване на условие, изпълнявано от URC обработчик (напр. +CIPOPEN: 0,0)
+        t0 = time.ticks_ms()
+        while not done():
+            remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), t0)
+            if remaining <= 0:
+                return False
+            self._wait_rx(remaining)
+        return True
+
+    async def wait_async(self, done, timeout_ms):
+        # Като wait(), но между проверките работят другите задачи (напр. NETOPEN до 30 s)
+        t0 = time.ticks_ms()
+        self.poll()
+        while not done():
+            if time.ticks_diff(time.ticks_ms(), t0) >= timeout_ms:
+                return False
+            await asyncio.sleep_ms(_ASYNC_SLICE_MS)
+            self.poll()
+        return True
+
+    def command(self, cmd, timeout_ms=400, data=None):
+        held = None
+        if self._cmd is not None:
+            # Асинхронна команда чака отговора си: той се дочита и се пази, докато тя продължи
+            if not self.wait(lambda: self._final is not None, timeout_ms):
+                print("AT: Командата", cmd, "е пропусната - модемът е зает")
+                return b""
+            held = (self._cmd, self._prefixes, self._lines, self._final)
+        self.poll()
+        self._begin(cmd)
+        if data is not None:
+            # Команда с данни: изчакване на "> ", после изпращане на данните
+            self._want_prompt = True
+            self._prompt = False
+            if self.wait(lambda: self._prompt or self._final is not None, timeout_ms) and self._prompt:
+                self._uart.write(data)
+                self.bytes_sent += len(data)
+            self._want_prompt = False
+        self.wait(lambda: self._final is not None, timeout_ms)
+        r = self._finish()
+        if held is not None:
+            self._cmd, self._prefixes, self._lines, self._final = held
+        return r
+
+    async def command_async(self, cmd, timeout_ms=400):
+        # Командите чакат реда си на lock-а, затова не се губят
+        async with self._lock:
+            if self._stream and self._reader is None:
+                self._reader = asyncio.StreamReader(self._uart)
+            self.poll()
+            self._begin(cmd)
+            t0 = time.ticks_ms()
+            scratch = self._scratch
+            while self._final is None:
+                remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), t0)
+                if remaining <= 0:
+                    break
+                if self._reader is None:
+                    # Без поток: данните се четат от poll(), между проверките работят другите задачи
+                    await asyncio.sleep_ms(min(remaining, _ASYNC_SLICE_MS))
+                    self.poll()
+                    continue
+                # Събуждане при данни; кратък интервал, ако отговора го е обработил синхронен poll()
+                try:
+                    n = await asyncio.wait_for_ms(self._reader.readinto(scratch), min(remaining, _ASYNC_SLICE_MS))
+                except asyncio.TimeoutError:
+                    continue
+                if n:
+                    self._feed(memoryview(scratch)[:n])
+            return self._finish()
@@ -0,0 +1,71 @@
+import time
+import config
+
+# канал: (мъртва зона, максимално мълчание в секунди)
+_DEFAULT_BANDS = {
+    "temperature": (0.3, 1800),
+    "humidity": (2.0, 1800),
+    "mq2": (50, 1800),
+    "pm25": (2.0, 600),
+    "pm10": (5.0, 600)
+}
+
+
+class DeadbandFilter:
+
+    def __init__(self, bands=None, min_interval_s=None, heartbeat_s=None):
+        bands = bands or getattr(config, 'MQTT_DEADBAND', _DEFAULT_BANDS)
+        self._names = list(bands.keys())
+        self._bands = [float(bands[name][0]) for name in self._names]
+        self._silence_ms = [int(bands[name][1]) * 1000 for name in self._names]
+        self._last = [None] * len(self._names)
+        self._published = False
+        self._last_publish_ms = 0
+        self._last_seen_ms = 0
+        self._min_interval_ms = (min_interval_s if min_interval_s is not None else getattr(config, 'MQTT_RBE_MIN_INTERVAL_S', 10)) * 1000
+        self._heartbeat_ms = (heartbeat_s or getattr(config, 'MQTT_HEARTBEAT_S', 900)) * 1000
+        self.suppressed = 0
+        self.reason = None
+
+    def check(self, reading):
+        # True ако някой канал е излязъл от мъртвата зона или е мълчал твърде дълго
+        now = time.ticks_ms()
+        if not self._published:
+            self.reason = "first"
+            return True
+        if time.ticks_diff(now, self._last_publish_ms) < self._min_interval_ms:
+            return False
+
+        for i in range(len(self._names)):
+            value = reading.get(self._names[i])
+            last = self._last[i]
+            if value is None:
+                continue
+            if last is None or abs(value - last) > self._bands[i]:
+                self.reason = self._names[i]
+                return True
+            if time.ticks_diff(now, self._last_publish_ms) >= self._silence_ms[i]:
+                self.reason = self._names[i] + ":silence"
+                return True
+
+        self.suppressed += 1
+        return False
+
+    def mark(self, reading):
+        now = time.ticks_ms()
+        for i in range(len(self._names)):
+            value = reading.get(self._names[i])
+            if value is not None:
+                self._last[i] = value
+        self._published = True
+        self._last_publish_ms = now
+        self._last_seen_ms = now
+
+    def heartbeat_due(self):
+        if not self._published:
+            return False
+        # Сигнал "жив съм", когато данните дълго не са се променяли
+        return time.ticks_diff(time.ticks_ms(), self._last_seen_ms) >= self._heartbeat_ms
+
+    def mark_heartbeat(self):
+        self._last_seen_ms = time.ticks_ms()
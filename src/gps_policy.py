@@ -0,0 +1,83 @@
+import math
+import time
+import config
+
+_EARTH_RADIUS_M = 6371000.0
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    # Равнинно приближение - достатъчно точно за разстояния от няколко километра
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return _EARTH_RADIUS_M * math.sqrt(x * x + y * y)
+
+
+class GPSPolicy:
+
+    def __init__(self, fast_s=None, slow_s=None, radius_m=None, stationary_fixes=None, max_age_s=None):
+        self._fast_ms = int((fast_s or config.GPS_READ_EVERY_S) * 1000)
+        self._slow_ms = int((slow_s or getattr(config, 'GPS_STATIONARY_READ_S', 300)) * 1000)
+        self._radius_m = radius_m or getattr(config, 'GPS_STATIONARY_RADIUS_M', 25)
+        self._stationary_fixes = stationary_fixes or getattr(config, 'GPS_STATIONARY_FIXES', 3)
+        self._max_age_ms = int((max_age_s or getattr(config, 'GPS_MAX_FIX_AGE_S', 1800)) * 1000)
+
+        # Котва: първият фикс от поредица в радиуса; движение се отчита спрямо нея
+        self._anchor_lat = None
+        self._anchor_lon = None
+        self._inside = 0
+        self._last_read_ms = None
+
+        # Последният добър фикс оцелява при загуба на сигнала
+        self.lat = None
+        self.lon = None
+        self.fix_ms = None
+        self.stationary = False
+        self.reads = 0
+        self.moves = 0
+
+    def fix_age_ms(self):
+        if self.fix_ms is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self.fix_ms)
+
+    def interval_ms(self):
+        age = self.fix_age_ms()
+        if self.stationary and age is not None and age < self._max_age_ms:
+            return self._slow_ms
+        return self._fast_ms
+
+    def remaining_ms(self):
+        if self._last_read_ms is None:
+            return 0
+        return max(0, self.interval_ms() - time.ticks_diff(time.ticks_ms(), self._last_read_ms))
+
+    def due(self):
+        return self.remaining_ms() == 0
+
+    def update(self, lat, lon):
+        # Връща True, ако интервалът на четене се е променил
+        before = self.interval_ms()
+        self._last_read_ms = time.ticks_ms()
+        self.reads += 1
+        if lat is None or lon is None:
+            return self.interval_ms() != before
+
+        self.lat = lat
+        self.lon = lon
+        self.fix_ms = self._last_read_ms
+        if self._anchor_lat is None:
+            self._anchor_lat, self._anchor_lon = lat, lon
+            self._inside = 1
+        elif distance_m(self._anchor_lat, self._anchor_lon, lat, lon) <= self._radius_m:
+            self._inside += 1
+        else:
+            # Движение: бързо четене отново, нова котва
+            if self.stationary:
+                self.moves += 1
+            self._anchor_lat, self._anchor_lon = lat, lon
+            self._inside = 1
+            self.stationary = False
+
+        if self._inside >= self._stationary_fixes:
+            self.stationary = True
+        return self.interval_ms() != before
@@ -0,0 +1,449 @@
+import socket
+import uasyncio as asyncio
+
+
+def parse_url(url):
+    is_https = url.startswith("https://")
+    if is_https:
+        url = url[8:]
+    elif url.startswith("http://"):
+        url = url[7:]
+
+    if "/" in url:
+        host, path = url.split("/", 1)
+        path = "/" + path
+    else:
+        host = url
+        path = "/"
+
+    if ":" in host:
+        host, port = host.split(":")
+        port = int(port)
+    else:
+        port = 443 if is_https else 80
+
+    return is_https, host, port, path
+
+
+def wrap_tls(sock, host):
+    import ussl
+
+    protocol = getattr(ussl, 'PROTOCOL_TLS_CLIENT', 0)
+    ssl_context = ussl.SSLContext(protocol)
+
+    cert_none = getattr(ussl, 'CERT_NONE', 0)
+    try:
+        ssl_context.verify_mode = cert_none
+    except:
+        try:
+            ssl_context.__dict__['verify_mode'] = cert_none
+        except:
+            try:
+                object.__setattr__(ssl_context, 'verify_mode', cert_none)
+            except:
+                pass
+
+    try:
+        return ssl_context.wrap_socket(sock, server_hostname=host)
+    except (TypeError, ValueError) as e:
+        error_msg = str(e).lower()
+        if "keyword" in error_msg or "argument" in error_msg:
+            return ssl_context.wrap_socket(sock)
+        raise
+
+
+class _SocketConn:
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def readline(self):
+        return self._sock.readline()
+
+    def readinto(self, buf):
+        return self._sock.readinto(buf)
+
+    def write(self, data):
+        self._sock.write(data)
+
+    def close(self):
+        try:
+            self._sock.close()
+        except Exception:
+            pass
+
+
+class _StreamConn:
+
+    def __init__(self, reader, writer, timeout_s):
+        self._reader = reader
+        self._writer = writer
+        self._timeout_s = timeout_s
+
+    async def readline(self):
+        return await asyncio.wait_for(self._reader.readline(), self._timeout_s)
+
+    async def readinto(self, buf):
+        return await asyncio.wait_for(self._reader.readinto(buf), self._timeout_s)
+
+    async def write(self, data):
+        self._writer.write(data)
+        await asyncio.wait_for(self._writer.drain(), self._timeout_s)
+
+    def close(self):
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+
+
+class _NetConn:
+    # Сокет от мрежов слой с асинхронно четене (SIMSocket)
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    async def readline(self):
+        return await self._sock.readline_async()
+
+    async def readinto(self, buf):
+        return await self._sock.readinto_async(buf)
+
+    async def write(self, data):
+        self._sock.write(data)
+
+    def close(self):
+        try:
+            self._sock.close()
+        except Exception:
+            pass
+
+
+class HTTPResponse:
+
+    def __init__(self, client, pool, key, conn, method):
+        self._client = client
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._head_only = (method == "HEAD")
+        self.status = 0
+        self.headers = {}
+        self.content_length = -1
+        self.complete = False
+        self._chunked = False
+        self._keep_alive = True
+        self._remaining = 0
+        self._done = False
+
+    def _parse_status(self, line):
+        parts = line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+            raise OSError("HTTP: Невалиден отговор")
+        try:
+            self.status = int(parts[1])
+        except ValueError:
+            raise OSError("HTTP: Невалиден статус")
+        if parts[0] == b"HTTP/1.0":
+            self._keep_alive = False
+
+    def _parse_header(self, line):
+        parts = line.split(b":", 1)
+        if len(parts) != 2:
+            return
+        # Грешка при разчитане се връща като OSError, за да се затвори връзката
+        try:
+            name = parts[0].strip().lower().decode()
+            value = parts[1].strip().decode()
+            length = int(value) if name == "content-length" else 0
+        except ValueError:
+            raise OSError("HTTP: Невалиден хедър")
+        self.headers[name] = value
+        if name == "content-length":
+            if length < 0:
+                raise OSError("HTTP: Невалиден хедър")
+            self.content_length = length
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            self._chunked = True
+        elif name == "connection":
+            v = value.lower()
+            if v == "close":
+                self._keep_alive = False
+            elif v == "keep-alive":
+                self._keep_alive = True
+
+    def _begin_body(self):
+        if self._head_only or self.status in (204, 304) or 100 <= self.status < 200:
+            self._finish()
+        elif self._chunked:
+            self._remaining = 0
+        elif self.content_length >= 0:
+            self._remaining = self.content_length
+            if self._remaining == 0:
+                self._finish()
+        else:
+            # Без Content-Length и chunked: тялото свършва със затваряне на връзката
+            self._remaining = -1
+            self._keep_alive = False
+
+    def _chunk_size(self, line):
+        return int(line.split(b";", 1)[0].strip(), 16)
+
+    def _finish(self):
+        self._done = True
+        self.complete = True
+        if self._keep_alive:
+            self._client._release(self._pool, self._key, self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+    def _abort(self):
+        self._done = True
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _limit(self, buf):
+        if self._remaining > 0 and self._remaining < len(buf):
+            if not isinstance(buf, memoryview):
+                buf = memoryview(buf)
+            return buf[:self._remaining]
+        return buf
+
+    def _consumed(self, n):
+        if not n:
+            if self._remaining < 0:
+                self._finish()
+            else:
+                self._abort()
+            return 0
+        if self._remaining > 0:
+            self._remaining -= n
+            if self._remaining == 0 and not self._chunked:
+                self._finish()
+        return n
+
+    def readinto(self, buf):
+        if self._done:
+            return 0
+        try:
+            if self._chunked and self._remaining == 0:
+                self._remaining = self._chunk_size(self._conn.readline())
+                if self._remaining == 0:
+                    while True:
+                        line = self._conn.readline()
+                        if not line or line == b"\r\n":
+                            break
+                    self._finish()
+                    return 0
+            n = self._consumed(self._conn.readinto(self._limit(buf)))
+            if self._chunked and self._remaining == 0 and not self._done:
+                self._conn.readline()
+            return n
+        except (OSError, ValueError):
+            self._abort()
+            return 0
+
+    async def readinto_async(self, buf):
+        if self._done:
+            return 0
+        try:
+            if self._chunked and self._remaining == 0:
+                self._remaining = self._chunk_size(await self._conn.readline())
+                if self._remaining == 0:
+                    while True:
+                        line = await self._conn.readline()
+                        if not line or line == b"\r\n":
+                            break
+                    self._finish()
+                    return 0
+            n = self._consumed(await self._conn.readinto(self._limit(buf)))
+            if self._chunked and self._remaining == 0 and not self._done:
+                await self._conn.readline()
+            return n
+        except (OSError, ValueError, asyncio.TimeoutError):
+            self._abort()
+            return 0
+
+    def iter_chunks(self, buf):
+        mv = memoryview(buf)
+        while True:
+            n = self.readinto(mv)
+            if not n:
+                break
+            yield mv[:n]
+
+    def read_all(self, chunk_size=512):
+        parts = []
+        for chunk in self.iter_chunks(bytearray(chunk_size)):
+            parts.append(bytes(chunk))
+        return b"".join(parts)
+
+    async def read_all_async(self, chunk_size=512):
+        buf = bytearray(chunk_size)
+        mv = memoryview(buf)
+        parts = []
+        while True:
+            n = await self.readinto_async(mv)
+            if not n:
+                break
+            parts.append(bytes(mv[:n]))
+        return b"".join(parts)
+
+    def close(self):
+        if not self._done:
+            self._abort()
+
+
+class HTTPClient:
+
+    def __init__(self, timeout_s=10, net=None):
+        self._timeout_s = timeout_s
+        # Мрежов слой със същия интерфейс като socket (напр. SIMNetwork); None = WiFi
+        self._net = net
+        self._pool = {}
+        self._async_pool = {}
+        self.connections_opened = 0
+
+    def set_network(self, net):
+        # Връзките в пула са през стария транспорт - затварят се
+        if net is self._net:
+            return
+        self.close_all()
+        self._net = net
+
+    def _build_request(self, method, host, path, headers, body_len):
+        lines = ["{} {} HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\n".format(method, path, host)]
+        if body_len is not None:
+            lines.append("Content-Length: {}\r\n".format(body_len))
+        if headers:
+            for name, value in headers.items():
+                lines.append("{}: {}\r\n".format(name, value))
+        lines.append("\r\n")
+        return "".join(lines).encode()
+
+    def _release(self, pool, key, conn):
+        if key in pool:
+            conn.close()
+        else:
+            pool[key] = conn
+
+    def _connect(self, is_https, host, port):
+        net = self._net or socket
+        if is_https and self._net is not None:
+            raise OSError("HTTP: HTTPS не е поддържан през SIM")
+        addr = net.getaddrinfo(host, port)[0][-1]
+        sock = net.socket(net.AF_INET, net.SOCK_STREAM)
+        sock.settimeout(self._timeout_s)
+        try:
+            sock.connect(addr)
+            if is_https:
+                sock = wrap_tls(sock, host)
+        except Exception:
+            sock.close()
+            raise
+        self.connections_opened += 1
+        return _SocketConn(sock)
+
+    async def _connect_async(self, is_https, host, port):
+        if self._net is not None:
+            return await self._connect_net_async(is_https, host, port)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=True if is_https else None),
+            self._timeout_s
+        )
+        self.connections_opened += 1
+        return _StreamConn(reader, writer, self._timeout_s)
+
+    async def _connect_net_async(self, is_https, host, port):
+        # През SIM отварянето на мрежата и връзката се чака без да спира останалите задачи
+        if is_https:
+            raise OSError("HTTP: HTTPS не е поддържан през SIM")
+        net = self._net
+        sock = net.socket(net.AF_INET, net.SOCK_STREAM)
+        sock.settimeout(self._timeout_s)
+        try:
+            await sock.connect_async(net.getaddrinfo(host, port)[0][-1])
+        except Exception:
+            sock.close()
+            raise
+        self.connections_opened += 1
+        return _NetConn(sock)
+
+    def request(self, method, url, body=None, headers=None):
+        is_https, host, port, path = parse_url(url)
+        key = (is_https, host, port)
+        req = self._build_request(method, host, path, headers, len(body) if body is not None else None)
+
+        while True:
+            conn = self._pool.pop(key, None)
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect(is_https, host, port)
+            try:
+                conn.write(req)
+                if body:
+                    conn.write(body)
+                line = conn.readline()
+                if not line:
+                    raise OSError("HTTP: Връзката е затворена")
+                resp = HTTPResponse(self, self._pool, key, conn, method)
+                resp._parse_status(line)
+                while True:
+                    line = conn.readline()
+                    if not line or line == b"\r\n":
+                        break
+                    resp._parse_header(line)
+                resp._begin_body()
+                return resp
+            except OSError:
+                conn.close()
+                # Сървърът може да е затворил неактивна keep-alive връзка - един опит с нова
+                if not reused:
+                    raise
+
+    async def request_async(self, method, url, body=None, headers=None):
+        is_https, host, port, path = parse_url(url)
+        key = (is_https, host, port)
+        req = self._build_request(method, host, path, headers, len(body) if body is not None else None)
+
+        while True:
+            conn = self._async_pool.pop(key, None)
+            reused = conn is not None
+            if conn is None:
+                conn = await self._connect_async(is_https, host, port)
+            try:
+                await conn.write(req)
+                if body:
+                    await conn.write(body)
+                line = await conn.readline()
+                if not line:
+                    raise OSError("HTTP: Връзката е затворена")
+                resp = HTTPResponse(self, self._async_pool, key, conn, method)
+                resp._parse_status(line)
+                while True:
+                    line = await conn.readline()
+                    if not line or line == b"\r\n":
+                        break
+                    resp._parse_header(line)
+                resp._begin_body()
+                return resp
+            except (OSError, asyncio.TimeoutError):
+                conn.close()
+                if not reused:
+                    raise
+
+    def get(self, url, headers=None):
+        return self.request("GET", url, headers=headers)
+
+    async def get_async(self, url, headers=None):
+        return await self.request_async("GET", url, headers=headers)
+
+    def close_all(self):
+        for conn in self._pool.values():
+            conn.close()
+        for conn in self._async_pool.values():
+            conn.close()
+        self._pool = {}
+        self._async_pool = {}
@@ -0,0 +1,169 @@
+import time
+import config
+
+LINK_SIM = "sim"
+LINK_WIFI = "wifi"
+
+# Обхват на сигнала в dBm: под долната граница - 0, над горната - 1
+_SIGNAL_RANGE = {
+    LINK_SIM: (-110, -70),
+    LINK_WIFI: (-90, -50)
+}
+
+
+def csq_to_dbm(csq):
+    # AT+CSQ: 0..31 -> -113..-51 dBm, 99 = неизвестно
+    if csq is None or csq == 99:
+        return None
+    return -113 + 2 * csq
+
+
+class _Link:
+
+    def __init__(self, name):
+        self.name = name
+        self.up = False
+        self.failures = 0
+        self.down_since_ms = None
+        self.dbm = None
+        self.rtt_ms = None
+        self.success = 1.0
+
+
+class LinkManager:
+
+    def __init__(self, primary=None, hysteresis=None, min_dwell_s=None, fail_threshold=None, hot_standby=None, now=None):
+        self._links = {LINK_SIM: _Link(LINK_SIM), LINK_WIFI: _Link(LINK_WIFI)}
+        self.primary = primary or getattr(config, 'LINK_PRIMARY', LINK_SIM)
+        self.active = self.primary
+        self._hysteresis = hysteresis if hysteresis is not None else getattr(config, 'LINK_HYSTERESIS', 15)
+        self._dwell_ms = int((min_dwell_s if min_dwell_s is not None else getattr(config, 'LINK_MIN_DWELL_S', 120)) * 1000)
+        self._fail_threshold = fail_threshold or getattr(config, 'SIM_FAILURE_THRESHOLD', 3)
+        self.hot_standby = getattr(config, 'LINK_WIFI_HOT_STANDBY', False) if hot_standby is None else hot_standby
+
+        # тегла на сигнала, времето за отговор и успеваемостта на публикуването
+        self._weights = getattr(config, 'LINK_WEIGHTS', (0.4, 0.2, 0.4))
+        self._primary_bonus = getattr(config, 'LINK_PRIMARY_BONUS', 10)
+        self._rtt_max_ms = getattr(config, 'LINK_RTT_MAX_MS', 3000)
+        self._alpha = 0.3
+
+        self._switched_ms = time.ticks_ms() if now is None else now
+        self._lost_ms = None
+        self.switches = 0
+        self.failovers = 0
+        self.last_failover_ms = None
+        self.max_failover_ms = 0
+
+    def _now(self, now):
+        return time.ticks_ms() if now is None else now
+
+    def other(self, name):
+        return LINK_WIFI if name == LINK_SIM else LINK_SIM
+
+    def is_up(self, name):
+        return self._links[name].up
+
+    def failures(self, name):
+        return self._links[name].failures
+
+    def update(self, name, available, dbm=None, now=None):
+        # Връзката се обявява за паднала след няколко поредни неуспешни проверки
+        now = self._now(now)
+        link = self._links[name]
+        link.dbm = dbm
+        if available:
+            link.failures = 0
+            link.down_since_ms = None
+            link.up = True
+            return
+        if link.failures == 0:
+            link.down_since_ms = now
+        link.failures += 1
+        if link.up and link.failures >= self._fail_threshold:
+            link.up = False
+            if name == self.active and self._lost_ms is None:
+                # Загубата се брои от първата неуспешна проверка
+                self._lost_ms = link.down_since_ms
+            print("ВРЪЗКА:", name, "е недостъпна")
+
+    def record_rtt(self, name, rtt_ms):
+        if rtt_ms is None:
+            return
+        link = self._links[name]
+        if link.rtt_ms is None:
+            link.rtt_ms = rtt_ms
+        else:
+            link.rtt_ms += self._alpha * (rtt_ms - link.rtt_ms)
+
+    def record_publish(self, name, ok, now=None):
+        link = self._links[name]
+        link.success += self._alpha * ((1.0 if ok else 0.0) - link.success)
+        if ok and name == self.active and self._lost_ms is not None:
+            # Време от загубата на връзката до първото успешно публикуване
+            latency = time.ticks_diff(self._now(now), self._lost_ms)
+            self._lost_ms = None
+            self.last_failover_ms = latency
+            if latency > self.max_failover_ms:
+                self.max_failover_ms = latency
+            print("ВРЪЗКА: Възстановено публикуване след", latency, "ms")
+
+    def score(self, name):
+        link = self._links[name]
+        if not link.up:
+            return 0
+        low, high = _SIGNAL_RANGE[name]
+        if link.dbm is None:
+            signal = 0.5
+        else:
+            signal = min(1.0, max(0.0, (link.dbm - low) / (high - low)))
+        rtt = 0.5 if link.rtt_ms is None else max(0.0, 1.0 - link.rtt_ms / self._rtt_max_ms)
+        w_signal, w_rtt, w_success = self._weights
+        score = 100 * (w_signal * signal + w_rtt * rtt + w_success * link.success)
+        if name == self.primary:
+            score += self._primary_bonus
+        return round(score, 1)
+
+    def evaluate(self, now=None):
+        # Връща новата активна връзка при превключване, иначе None
+        now = self._now(now)
+        other = self.other(self.active)
+        if not self._links[self.active].up:
+            if self._links[other].up:
+                self.failovers += 1
+                if self._lost_ms is None:
+                    # Активната връзка не е работила от стартирането
+                    self._lost_ms = self._links[self.active].down_since_ms
+                return self._switch(other, now)
+            return None
+        if not self._links[other].up:
+            return None
+        # Минимално време на активната връзка - без прескачане напред-назад
+        if time.ticks_diff(now, self._switched_ms) < self._dwell_ms:
+            return None
+        if self.score(other) > self.score(self.active) + self._hysteresis:
+            return self._switch(other, now)
+        return None
+
+    def _switch(self, name, now):
+        print("ВРЪЗКА: Превключване", self.active, "->", name, "| оценки:", self.score(self.active), "/", self.score(name))
+        self.active = name
+        self._switched_ms = now
+        self.switches += 1
+        return name
+
+    def wants(self, name):
+        # Дали интерфейсът да е свързан: активен, горещ резерв или нужен заради проблем с активния
+        if name == self.active or (name == LINK_WIFI and self.hot_standby):
+            return True
+        active = self._links[self.active]
+        return active.failures > 0 or not active.up
+
+    def summary(self):
+        return {
+            "active": self.active,
+            "scores": {LINK_SIM: self.score(LINK_SIM), LINK_WIFI: self.score(LINK_WIFI)},
+            "switches": self.switches,
+            "failovers": self.failovers,
+            "last_failover_ms": self.last_failover_ms,
+            "max_failover_ms": self.max_failover_ms
+        }
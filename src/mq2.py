@@ -1,15 +1,121 @@
-from machine import Pin, ADC
+import machine
+from array import array
+from machine import Pin, ADC, Timer
 import config
 
 
 class MQ2Sensor:
-    def __init__(self, adc_pin=config.MQ2_ADC_PIN, samples=config.MQ2_SAMPLES):
+    def __init__(self, adc_pin=config.MQ2_ADC_PIN, samples=config.MQ2_SAMPLES, sample_hz=None):
         self._samples = int(samples)
         self._adc = ADC(Pin(adc_pin))
         self._adc.atten(ADC.ATTN_11DB)
 
-    def read_avg(self):
+        self._timer = None
+        self._ring = None
+        self._size = 0
+        self._idx = 0
+        self._filled = 0
+        self._sum = 0
+        self._min = 0xFFFF
+        self._max = 0
+        self._ema_q8 = -1
+        self._ema_shift = getattr(config, 'MQ2_EMA_SHIFT', 3)
+
+        if sample_hz is None:
+            sample_hz = getattr(config, 'MQ2_SAMPLE_HZ', 0)
+        if sample_hz:
+            self.start_sampling(sample_hz)
+
+    def start_sampling(self, sample_hz, timer_id=None, ring_size=None):
+        if timer_id is None:
+            timer_id = getattr(config, 'MQ2_TIMER_ID', 0)
+        if ring_size is None:
+            ring_size = getattr(config, 'MQ2_RING_SIZE', 64)
+
+        self.stop_sampling()
+        self._ring = array('H', [0] * ring_size)
+        self._size = ring_size
+        self._idx = 0
+        self._filled = 0
+        self._sum = 0
+        self._min = 0xFFFF
+        self._max = 0
+        self._ema_q8 = -1
+
+        self._timer = Timer(timer_id)
+        self._timer.init(freq=sample_hz, mode=Timer.PERIODIC, callback=self._on_tick)
+
+    def stop_sampling(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+
+    def is_sampling(self):
+        return self._timer is not None
+
+    # Извиква се от таймера - без заделяне на памет, само цели числа и запис в предварително заделения буфер
+    def _on_tick(self, _timer):
+        v = self._adc.read()
+        i = self._idx
+        if self._filled == self._size:
+            self._sum -= self._ring[i]
+        else:
+            self._filled += 1
+        self._ring[i] = v
+        self._sum += v
+        i += 1
+        if i == self._size:
+            i = 0
+        self._idx = i
+
+        if v < self._min:
+            self._min = v
+        if v > self._max:
+            self._max = v
+
+        if self._ema_q8 < 0:
+            self._ema_q8 = v << 8
+        else:
+            self._ema_q8 += ((v << 8) - self._ema_q8) >> self._ema_shift
+
+    def _read_burst(self):
         s = 0
         for _ in range(self._samples):
             s += self._adc.read()
-        return int(s / self._samples)
\ No newline at end of file
+        return int(s / self._samples)
+
+    def read_avg(self):
+        if self._timer is None:
+            return self._read_burst()
+
+        state = machine.disable_irq()
+        s = self._sum
+        n = self._filled
+        machine.enable_irq(state)
+
+        if n == 0:
+            return self._read_burst()
+        return s // n
+
+    def read_stats(self):
+        # Средна стойност по буфера, min/max от последното извикване насам и EMA
+        if self._timer is None:
+            v = self._read_burst()
+            return v, v, v, v
+
+        state = machine.disable_irq()
+        s = self._sum
+        n = self._filled
+        lo = self._min
+        hi = self._max
+        ema_q8 = self._ema_q8
+        self._min = 0xFFFF
+        self._max = 0
+        machine.enable_irq(state)
+
+        if n == 0:
+            v = self._read_burst()
+            return v, v, v, v
+        if lo > hi:
+            lo = hi = s // n
+        return s // n, lo, hi, ema_q8 >> 8
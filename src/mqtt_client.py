@@ -1,8 +1,15 @@
 import time
 import socket
+import uselect
 import ujson
+import uasyncio as asyncio
+from array import array
 import config
 
+_PINGREQ = b"\xc0\x00"
+_DISCONNECT = b"\xe0\x00"
+_TOPIC_CACHE_SIZE = 8
+
 
 class MQTTClient:
 
@@ -14,7 +21,9 @@ class MQTTClient:
                  password=None,
                  keepalive=60,
                  ssl=False,
-                 ssl_params=None):
+                 ssl_params=None,
+                 offline_queue=None,
+                 net=None):
 
         self._client_id = client_id or config.DEVICE_NAME
         self._server = server or config.MQTT_BROKER_HOST
@@ -27,20 +36,63 @@ class MQTTClient:
         
         self._sock = None
         self._connected = False
+        self._connecting = False
         self._last_ping = 0
         self._msg_id = 1
         self._reconnect_attempts = 0
         self._max_reconnect_attempts = 5
         self._reconnect_delay = 5 
+        self._offline_queue = offline_queue
+        # Мрежов слой със същия интерфейс като socket/uselect (напр. SIMNetwork); None = WiFi
+        self._net = net
+        self._poller = None
+        self._callback = None
+        self._subscriptions = {}
+        self._connack = -1
+        self._suback_id = 0
+        self._suback_qos = 0
+        self._pingresp = False
+        self.last_rtt_ms = None
+        
+        # Предварително заделен буфер за входящите пакети; частично прочетен пакет остава в него
+        self._rx = bytearray(getattr(config, 'MQTT_RX_BUFFER', 512))
+        self._rx_mv = memoryview(self._rx)
+        self._rx_len = 0
+        self._rx_body = 0
+        self._rx_skip = 0
+        self._ack = bytearray(b"\x40\x02\x00\x00")
+        
+        # Изходящите PUBLISH пакети се сглобяват в един буфер; topic заглавките се кешират
+        self._tx = bytearray(getattr(config, 'MQTT_TX_BUFFER', 1024))
+        self._tx_mv = memoryview(self._tx)
+        self._topic_cache = {}
+        
+        # Таблица на изпратените, но непотвърдени QoS 1 съобщения (msg_id 0 = свободно място)
+        self._window = getattr(config, 'MQTT_INFLIGHT_WINDOW', 8)
+        self._retry_ms = getattr(config, 'MQTT_RETRY_MS', 5000)
+        self._inflight_ids = array('H', [0] * self._window)
+        self._inflight_sent = array('I', [0] * self._window)
+        self._inflight_retain = bytearray(self._window)
+        self._inflight_topics = [None] * self._window
+        self._inflight_payloads = [None] * self._window
+        self._inflight = 0
+        # Последните места в прозореца са запазени за приоритетни съобщения (аларми)
+        self._reserved = min(getattr(config, 'MQTT_PRIORITY_SLOTS', 1), self._window - 1)
+        self.last_msg_id = 0
+        self._watch_id = 0
+        self._watch_acked = False
         
     def _connect_socket(self):
         try:
-            addr = socket.getaddrinfo(self._server, self._port)[0][-1]
-            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            net = self._net or socket
+            addr = net.getaddrinfo(self._server, self._port)[0][-1]
+            self._sock = net.socket(net.AF_INET, net.SOCK_STREAM)
             self._sock.settimeout(10) 
             self._sock.connect(addr)
             
-            if self._ssl:
+            if self._ssl and self._net is not None:
+                print("MQTT: SSL не е поддържан през SIM, използване на TCP")
+            elif self._ssl:
                 try:
                     import ussl
                     protocol = getattr(ussl, 'PROTOCOL_TLS_CLIENT', 0)
@@ -87,6 +139,24 @@ class MQTTClient:
                 self._sock = None
             return False
     
+    async def _connect_socket_async(self):
+        net = self._net
+        sock = net.socket(net.AF_INET, net.SOCK_STREAM)
+        sock.settimeout(10)
+        try:
+            await sock.connect_async(net.getaddrinfo(self._server, self._port)[0][-1])
+        except Exception as e:
+            print("MQTT: Грешка при свързване на сокет:", e)
+            try:
+                sock.close()
+            except:
+                pass
+            return False
+        if self._ssl:
+            print("MQTT: SSL не е поддържан през SIM, използване на TCP")
+        self._sock = sock
+        return True
+    
     def _send_bytes(self, data):
         if not self._sock:
             return False
@@ -110,6 +180,17 @@ class MQTTClient:
             self._connected = False
             return None
     
+    def _encode_length(self, length):
+        encoded = bytearray()
+        while True:
+            encoded_byte = length % 128
+            length = length // 128
+            if length > 0:
+                encoded_byte |= 0x80
+            encoded.append(encoded_byte)
+            if length == 0:
+                return bytes(encoded)
+    
     def _pack_string(self, s):
         s_bytes = s.encode('utf-8') if isinstance(s, str) else s
         return bytes([len(s_bytes) >> 8, len(s_bytes) & 0xFF]) + s_bytes
@@ -117,15 +198,41 @@ class MQTTClient:
     def _unpack_string(self, data, offset):
         length = (data[offset] << 8) | data[offset + 1]
         offset += 2
-        return data[offset:offset + length].decode('utf-8'), offset + length
+        return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
     
     def connect(self, clean_session=True):
         if self._connected:
             return True
-        
         if not self._connect_socket():
             return False
-        
+        if not self._begin_connect(clean_session):
+            return False
+        return self._finish_connect(self._wait(lambda: self._connack >= 0))
+    
+    async def connect_async(self, clean_session=True):
+        # През WiFi DNS и TCP свързването остават блокиращи (до таймаута на сокета);
+        # през SIM се чакат NETOPEN/CIPOPEN без блокиране; CONNACK се чака без блокиране
+        if self._connected:
+            return True
+        if self._connecting:
+            # Друга задача вече се свързва - изчаква се нейният резултат
+            while self._connecting:
+                await asyncio.sleep_ms(20)
+            return self._connected
+        self._connecting = True
+        try:
+            if hasattr(self._net, 'open_async'):
+                if not await self._connect_socket_async():
+                    return False
+            elif not self._connect_socket():
+                return False
+            if not self._begin_connect(clean_session):
+                return False
+            return self._finish_connect(await self._wait_async(lambda: self._connack >= 0))
+        finally:
+            self._connecting = False
+    
+    def _begin_connect(self, clean_session):
         protocol_name = "MQTT"
         protocol_level = 4 
         
@@ -149,155 +256,494 @@ class MQTTClient:
             payload += self._pack_string(self._password)
         
         remaining_length = len(variable_header) + len(payload)
-        remaining_bytes = []
-        x = remaining_length
-        while x > 0:
-            encoded_byte = x % 128
-            x = x // 128
-            if x > 0:
-                encoded_byte |= 0x80
-            remaining_bytes.append(encoded_byte)
-        if not remaining_bytes:
-            remaining_bytes = [0]
 
         connect_packet = (
             bytes([0x10]) +  
-            bytes(remaining_bytes) +
+            self._encode_length(remaining_length) +
             variable_header +
             payload
         )
         
         if not self._send_bytes(connect_packet):
             return False
-
-        try:
-            response = self._recv_bytes(4)
-            if not response or len(response) < 4:
-                print("MQTT: Невалиден CONNACK отговор")
-                return False
-            
-            if response[0] != 0x20:  
-                print("MQTT: Очакван CONNACK, получен:", hex(response[0]))
-                return False
-            
-            return_code = response[3]
-            if return_code != 0:
-                print("MQTT: CONNACK грешка:", return_code)
-                return False
-            
-            self._connected = True
-            self._reconnect_attempts = 0
-            self._last_ping = time.ticks_ms()
-            print("MQTT: Свързан успешно към", self._server, ":", self._port)
-            return True
-            
-        except Exception as e:
-            print("MQTT: Грешка при четене на CONNACK:", e)
+        
+        self._rx_len = 0
+        self._rx_skip = 0
+        self._connack = -1
+        poll_net = self._net or uselect
+        self._poller = poll_net.poll()
+        self._poller.register(self._sock, poll_net.POLLIN)
+        return True
+    
+    def _finish_connect(self, acked):
+        if not acked:
+            print("MQTT: Няма CONNACK отговор")
+            self._close_socket()
+            return False
+        
+        if self._connack != 0:
+            print("MQTT: CONNACK грешка:", self._connack)
+            self._close_socket()
             return False
+        
+        self._connected = True
+        self._reconnect_attempts = 0
+        self._last_ping = time.ticks_ms()
+        print("MQTT: Свързан успешно към", self._server, ":", self._port)
+        
+        for topic, qos in self._subscriptions.items():
+            self._send_subscribe(topic, qos)
+        if self._inflight:
+            self._retransmit_all()
+        return True
     
-    def disconnect(self):
-        if self._connected and self._sock:
+    def _close_socket(self):
+        self._poller = None
+        if self._sock:
             try:
-                disconnect_packet = bytes([0xE0, 0x00])  
-                self._send_bytes(disconnect_packet)
+                self._sock.close()
             except:
                 pass
-        
-        self._connected = False
+            self._sock = None
+    
+    def set_network(self, net):
+        # Смяна на транспорта (WiFi <-> SIM); новата връзка се отваря при следващото свързване
+        if net is self._net:
+            return
         if self._sock:
+            self.disconnect()
+        self._net = net
+    
+    def disconnect(self):
+        if self._connected and self._sock:
             try:
-                self._sock.close()
+                self._send_bytes(_DISCONNECT)
             except:
                 pass
-            self._sock = None
+        
+        self._connected = False
+        self._close_socket()
         print("MQTT: Прекъсната връзка")
     
-    def publish(self, topic, payload, qos=0, retain=False):
-
-        if not self._connected:
-            if not self.connect():
-                return False
-        
+    def _encode_payload(self, payload):
         if isinstance(payload, (dict, list)):
             try:
                 payload = ujson.dumps(payload)
             except Exception as e:
                 print("MQTT: Грешка при JSON кодиране:", e)
-                return False
+                return None
         
         if isinstance(payload, str):
-            payload_bytes = payload.encode('utf-8')
-        else:
-            payload_bytes = payload
-        
+            return payload.encode('utf-8')
+        return payload
+    
+    def _topic_header(self, topic):
+        packed = self._topic_cache.get(topic)
+        if packed is None:
+            if len(self._topic_cache) >= _TOPIC_CACHE_SIZE:
+                self._topic_cache.clear()
+            packed = self._pack_string(topic)
+            self._topic_cache[topic] = packed
+        return packed
+    
+    def _send_publish(self, topic, payload_bytes, qos, retain, msg_id, dup=False):
+        tx = self._tx
         fixed_header = 0x30  
+        if dup:
+            fixed_header |= 0x08
         if qos > 0:
             fixed_header |= (qos << 1)
         if retain:
             fixed_header |= 0x01
         
-        variable_header = self._pack_string(topic)
+        topic_header = self._topic_header(topic)
+        remaining_length = len(topic_header) + len(payload_bytes)
         if qos > 0:
-            msg_id = self._msg_id
-            self._msg_id = (self._msg_id % 65535) + 1
-            variable_header += bytes([msg_id >> 8, msg_id & 0xFF])
+            remaining_length += 2
         
-        remaining_length = len(variable_header) + len(payload_bytes)
-        remaining_bytes = []
+        tx[0] = fixed_header
+        n = 1
         x = remaining_length
-        while x > 0:
-            encoded_byte = x % 128
-            x = x // 128
+        while True:
+            encoded_byte = x & 0x7F
+            x >>= 7
             if x > 0:
                 encoded_byte |= 0x80
-            remaining_bytes.append(encoded_byte)
-        if not remaining_bytes:
-            remaining_bytes = [0]
+            tx[n] = encoded_byte
+            n += 1
+            if x == 0:
+                break
         
-        publish_packet = (
-            bytes([fixed_header]) +
-            bytes(remaining_bytes) +
-            variable_header +
-            payload_bytes
+        mv = self._tx_mv
+        mv[n:n + len(topic_header)] = topic_header
+        n += len(topic_header)
+        if qos > 0:
+            tx[n] = msg_id >> 8
+            tx[n + 1] = msg_id & 0xFF
+            n += 2
+        
+        if n + len(payload_bytes) <= len(tx):
+            mv[n:n + len(payload_bytes)] = payload_bytes
+            return self._send_bytes(mv[:n + len(payload_bytes)])
+        
+        # Payload-ът не се събира в буфера - заглавката и данните се изпращат поотделно
+        return self._send_bytes(mv[:n]) and self._send_bytes(payload_bytes)
+    
+    def _next_msg_id(self):
+        while True:
+            msg_id = self._msg_id
+            self._msg_id = (self._msg_id % 65535) + 1
+            if self._find_inflight(msg_id) < 0:
+                return msg_id
+    
+    def _find_inflight(self, msg_id):
+        ids = self._inflight_ids
+        for i in range(len(ids)):
+            if ids[i] == msg_id:
+                return i
+        return -1
+    
+    def _clear_slot(self, slot):
+        self._inflight_ids[slot] = 0
+        self._inflight_topics[slot] = None
+        self._inflight_payloads[slot] = None
+        self._inflight -= 1
+    
+    def inflight_count(self):
+        return self._inflight
+    
+    def _has_slot(self, priority=False):
+        return self._window - self._inflight > (0 if priority else self._reserved)
+    
+    def _on_puback(self, msg_id):
+        slot = self._find_inflight(msg_id)
+        if slot >= 0:
+            # Време от (последното) изпращане до потвърждението
+            self.last_rtt_ms = time.ticks_diff(time.ticks_ms(), self._inflight_sent[slot])
+            self._clear_slot(slot)
+            if msg_id == self._watch_id:
+                self._watch_acked = True
+    
+    def _retransmit(self, slot):
+        self._inflight_sent[slot] = time.ticks_ms()
+        return self._send_publish(
+            self._inflight_topics[slot],
+            self._inflight_payloads[slot],
+            1,
+            self._inflight_retain[slot],
+            self._inflight_ids[slot],
+            dup=True
         )
+    
+    def _retransmit_expired(self):
+        now = time.ticks_ms()
+        ids = self._inflight_ids
+        for slot in range(len(ids)):
+            if ids[slot] and time.ticks_diff(now, self._inflight_sent[slot]) >= self._retry_ms:
+                if not self._retransmit(slot):
+                    return False
+        return True
+    
+    def _retransmit_all(self):
+        ids = self._inflight_ids
+        for slot in range(len(ids)):
+            if ids[slot]:
+                if not self._retransmit(slot):
+                    return False
+        return True
+    
+    def _spill_inflight(self):
+        # Непотвърдените съобщения се прехвърлят в офлайн опашката, за да не се загубят
+        ids = self._inflight_ids
+        for slot in range(len(ids)):
+            if ids[slot]:
+                if self._offline_queue is not None:
+                    self._offline_queue.put(self._inflight_topics[slot], self._inflight_payloads[slot])
+                self._clear_slot(slot)
+    
+    def _handle_publish(self, flags, body):
+        topic, offset = self._unpack_string(body, 0)
+        qos = (flags >> 1) & 0x03
+        if qos:
+            self._ack[2] = body[offset]
+            self._ack[3] = body[offset + 1]
+            offset += 2
+            if qos == 1:
+                self._send_bytes(self._ack)
+        if self._callback is not None:
+            self._callback(topic, bytes(body[offset:]))
+    
+    def _handle_packet(self, header, body):
+        packet_type = header & 0xF0
+        if packet_type == 0x40 and len(body) >= 2:
+            self._on_puback((body[0] << 8) | body[1])
+        elif packet_type == 0x30:
+            self._handle_publish(header & 0x0F, body)
+        elif packet_type == 0xD0:
+            self._pingresp = True
+            self._last_ping = time.ticks_ms()
+        elif packet_type == 0x20 and len(body) >= 2:
+            self._connack = body[1]
+        elif packet_type == 0x90 and len(body) >= 3:
+            self._suback_id = (body[0] << 8) | body[1]
+            self._suback_qos = body[2]
+        else:
+            print("MQTT: Неочакван пакет:", hex(header))
+    
+    def _packet_length(self):
+        # Обща дължина на пакета от фиксираната заглавка (varint), -1 ако заглавката не е пълна
+        rx = self._rx
+        multiplier = 1
+        length = 0
+        for i in range(1, self._rx_len):
+            length += (rx[i] & 0x7F) * multiplier
+            if not rx[i] & 0x80:
+                self._rx_body = i + 1
+                return i + 1 + length
+            multiplier *= 128
+            if i == 4:
+                raise ValueError("MQTT: Невалидна дължина на пакет")
+        return -1
+    
+    def _read_available(self):
+        if self._rx_skip:
+            # Пакет, по-голям от буфера - прочита се и се изхвърля
+            data = self._recv_bytes(min(self._rx_skip, len(self._rx)))
+            if not data:
+                return False
+            self._rx_skip -= len(data)
+            return True
         
-        if not self._send_bytes(publish_packet):
-            self._connected = False
+        total = self._packet_length() if self._rx_len >= 2 else -1
+        if total < 0:
+            need = 2 - self._rx_len if self._rx_len < 2 else 1
+        elif total > len(self._rx):
+            print("MQTT: Пакетът е по-голям от буфера, пропускане:", total)
+            self._rx_skip = total - self._rx_len
+            self._rx_len = 0
+            return True
+        else:
+            need = total - self._rx_len
+        
+        data = self._recv_bytes(need)
+        if not data:
             return False
+        self._rx_mv[self._rx_len:self._rx_len + len(data)] = data
+        self._rx_len += len(data)
         
-        if qos == 1:
+        if total < 0 and self._rx_len >= 2:
+            total = self._packet_length()
+        if total >= 0 and self._rx_len == total:
+            self._rx_len = 0
+            self._handle_packet(self._rx[0], self._rx_mv[self._rx_body:total])
+        return True
+    
+    def _service(self, timeout_ms=0):
+        # Обработка на всички вече пристигнали байтове; блокира най-много timeout_ms
+        while self._sock is not None and self._poller is not None and self._poller.poll(timeout_ms):
+            timeout_ms = 0
             try:
-                response = self._recv_bytes(4)
-                if response and len(response) >= 4 and response[0] == 0x40:  
-                    return True
-                else:
-                    print("MQTT: Неочакван отговор при QoS 1")
+                ok = self._read_available()
+            except ValueError as e:
+                print(e)
+                ok = False
+            if not ok:
+                self._connected = False
+                return False
+        
+        if self._sock is None:
+            return False
+        if self._connected and self._inflight:
+            return self._retransmit_expired()
+        return True
+    
+    def _wait(self, done, timeout_ms=10000):
+        start = time.ticks_ms()
+        while not done():
+            remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), start)
+            if remaining <= 0 or not self._service(min(remaining, 100)):
+                return False
+        return True
+    
+    async def _wait_async(self, done, timeout_ms=10000):
+        # Като _wait, но между проверките управлението се връща на планировчика
+        start = time.ticks_ms()
+        while not done():
+            if time.ticks_diff(time.ticks_ms(), start) >= timeout_ms or not self._service(0):
+                return False
+            await asyncio.sleep_ms(20)
+        return True
+    
+    def poll(self):
+        if not self._connected:
+            return False
+        return self._service(0)
+    
+    def flush(self, timeout_ms=10000):
+        start = time.ticks_ms()
+        while self._inflight and self._connected:
+            remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), start)
+            if remaining <= 0:
+                return False
+            self._service(min(remaining, 100))
+        return self._inflight == 0
+    
+    async def flush_async(self, timeout_ms=10000):
+        await self._wait_async(lambda: not self._inflight or not self._connected, timeout_ms)
+        return self._inflight == 0
+    
+    async def publish_async(self, topic, payload, qos=0, retain=False, priority=False):
+        # priority=True може да заеме и запазените места в прозореца (MQTT_PRIORITY_SLOTS)
+        if not self._connected:
+            if not await self.connect_async():
+                return False
+        if qos == 1 and not self._has_slot(priority):
+            # Пълен прозорец: изчакване на PUBACK без да се спират останалите задачи
+            done = lambda: self._has_slot(priority) or not self._connected
+            if not await self._wait_async(done, self._retry_ms * 2) and self._connected:
+                print("MQTT: Прозорецът за QoS 1 е пълен")
+                return False
+        # Връзката може да е паднала по време на изчакването - повторно свързване без блокиране
+        if not self._connected:
+            if not await self.connect_async():
+                return False
+        return self._publish(topic, payload, qos, retain, priority)
+    
+    def publish(self, topic, payload, qos=0, retain=False):
+
+        if not self._connected:
+            if not self.connect():
+                return False
+        
+        if qos == 1 and self._find_inflight(0) < 0:
+            start = time.ticks_ms()
+            while self._find_inflight(0) < 0:
+                if not self._connected or time.ticks_diff(time.ticks_ms(), start) >= self._retry_ms * 2:
+                    print("MQTT: Прозорецът за QoS 1 е пълен")
                     return False
-            except:
+                self._service(100)
+        
+        return self._publish(topic, payload, qos, retain)
+    
+    def _publish(self, topic, payload, qos, retain, watch=False):
+        # Без свързване и без чакане: при липса на връзка или място в прозореца - веднага False
+        if not self._connected:
+            return False
+        
+        payload_bytes = self._encode_payload(payload)
+        if payload_bytes is None:
+            return False
+        
+        if qos == 0:
+            if not self._send_publish(topic, payload_bytes, 0, retain, 0):
+                self._connected = False
                 return False
+            return True
         
+        # QoS 1: съобщението се изпраща веднага, а PUBACK се обработва асинхронно
+        slot = self._find_inflight(0)
+        if slot < 0:
+            print("MQTT: Прозорецът за QoS 1 е пълен")
+            return False
+        
+        msg_id = self._next_msg_id()
+        if not self._send_publish(topic, payload_bytes, 1, retain, msg_id):
+            self._connected = False
+            return False
+        
+        self._inflight_ids[slot] = msg_id
+        self._inflight_sent[slot] = time.ticks_ms()
+        self._inflight_topics[slot] = topic
+        self._inflight_payloads[slot] = payload_bytes
+        self._inflight_retain[slot] = 1 if retain else 0
+        self._inflight += 1
+        self.last_msg_id = msg_id
+        if watch:
+            # PUBACK-ът може да пристигне още при следващото обслужване - следи се от сега
+            self._watch_id = msg_id
+            self._watch_acked = False
+        
+        self._service(0)
         return True
     
+    async def wait_ack_async(self, msg_id, timeout_ms=10000):
+        # PUBACK за приоритетно съобщение, без да се чакат останалите в прозореца
+        if msg_id != self._watch_id:
+            return False
+        try:
+            await self._wait_async(lambda: self._watch_acked or self._find_inflight(msg_id) < 0, timeout_ms)
+            return self._watch_acked
+        finally:
+            self._watch_id = 0
+    
     def ping(self):
         if not self._connected:
             return False
         
-        ping_packet = bytes([0xC0, 0x00])  
-        if not self._send_bytes(ping_packet):
+        self._pingresp = False
+        sent_ms = time.ticks_ms()
+        if not self._send_bytes(_PINGREQ):
             self._connected = False
             return False
 
-        try:
-            response = self._recv_bytes(2)
-            if response and len(response) >= 2 and response[0] == 0xD0:  
-                self._last_ping = time.ticks_ms()
-                return True
-            else:
-                self._connected = False
-                return False
-        except:
+        if not self._wait(lambda: self._pingresp):
+            self._connected = False
+            return False
+        self.last_rtt_ms = time.ticks_diff(time.ticks_ms(), sent_ms)
+        return True
+    
+    async def ping_async(self):
+        if not self._connected:
+            return False
+        
+        self._pingresp = False
+        sent_ms = time.ticks_ms()
+        if not self._send_bytes(_PINGREQ):
+            self._connected = False
+            return False
+
+        if not await self._wait_async(lambda: self._pingresp):
             self._connected = False
             return False
+        self.last_rtt_ms = time.ticks_diff(time.ticks_ms(), sent_ms)
+        return True
+    
+    def set_callback(self, callback):
+        self._callback = callback
+    
+    def _send_subscribe(self, topic, qos):
+        msg_id = self._next_msg_id()
+        topic_bytes = self._pack_string(topic)
+        packet = (
+            bytes([0x82]) +
+            self._encode_length(len(topic_bytes) + 3) +
+            bytes([msg_id >> 8, msg_id & 0xFF]) +
+            topic_bytes +
+            bytes([qos])
+        )
+        if not self._send_bytes(packet):
+            return 0
+        return msg_id
+    
+    def subscribe(self, topic, qos=0):
+        if not self._connected:
+            if not self.connect():
+                return False
+        
+        msg_id = self._send_subscribe(topic, qos)
+        if not msg_id:
+            return False
+        
+        if not self._wait(lambda: self._suback_id == msg_id):
+            print("MQTT: Няма SUBACK за", topic)
+            return False
+        if self._suback_qos == 0x80:
+            print("MQTT: Абонаментът е отказан:", topic)
+            return False
+        
+        # Абонаментите се възстановяват автоматично след преподключване
+        self._subscriptions[topic] = qos
+        return True
     
     def check_connection(self):
         if not self._connected:
@@ -314,6 +760,19 @@ class MQTTClient:
         
         return True
     
+    async def check_connection_async(self):
+        if not self._connected:
+            return False
+        
+        ping_interval_ms = (self._keepalive * 1000) // 2
+        if time.ticks_diff(time.ticks_ms(), self._last_ping) >= ping_interval_ms:
+            if not await self.ping_async():
+                print("MQTT: Ping неуспешен, опит за преподключване...")
+                self._connected = False
+                return False
+        
+        return True
+    
     def reconnect(self):
         self.disconnect()
         
@@ -327,16 +786,106 @@ class MQTTClient:
         
         return self.connect()
     
+    async def reconnect_async(self):
+        self.disconnect()
+        
+        if self._reconnect_attempts >= self._max_reconnect_attempts:
+            print("MQTT: Достигнат максимален брой опити за преподключване")
+            return False
+        
+        self._reconnect_attempts += 1
+        print("MQTT: Опит за преподключване", self._reconnect_attempts, "/", self._max_reconnect_attempts)
+        await asyncio.sleep(self._reconnect_delay)
+        
+        return await self.connect_async()
+    
     def is_connected(self):
         return self._connected and self._sock is not None
     
+    def set_offline_queue(self, offline_queue):
+        self._offline_queue = offline_queue
+    
+    def enqueue(self, topic, payload):
+        if self._offline_queue is None:
+            return False
+        
+        if isinstance(payload, (dict, list)):
+            try:
+                payload = ujson.dumps(payload)
+            except Exception as e:
+                print("MQTT: Грешка при JSON кодиране:", e)
+                return False
+        
+        if self._offline_queue.put(topic, payload):
+            print("MQTT: Данните са запазени в офлайн опашката")
+            return True
+        return False
+    
+    def has_queued(self):
+        return self._offline_queue is not None and not self._offline_queue.is_empty()
+    
+    def flush_offline_queue(self, max_messages=10):
+        if not self.has_queued():
+            return 0
+        
+        if not self._connected:
+            if not self.connect():
+                return 0
+        
+        sent = self._offline_queue.drain(
+            lambda topic, payload: self.publish(topic, payload, qos=1),
+            max_messages
+        )
+        if sent:
+            print("MQTT: Изпратени", sent, "съобщения от офлайн опашката")
+        return sent
+    
+    async def flush_offline_queue_async(self, max_messages=10):
+        if not self.has_queued():
+            return 0
+        
+        if not self._connected:
+            if not await self.connect_async():
+                return 0
+        
+        # Изпращане само докато има място в прозореца; останалото - при следващото изпразване
+        sent = self._offline_queue.drain(
+            lambda topic, payload: self._has_slot() and self._publish(topic, payload, 1, False),
+            max_messages
+        )
+        if sent:
+            print("MQTT: Изпратени", sent, "съобщения от офлайн опашката")
+        return sent
+    
+    async def publish_sensor_data_async(self, topic_prefix, device_id, sensors_data):
+        
+        topic = "{}/{}".format(topic_prefix, device_id)
+        
+        if not await self.check_connection_async():
+            if not await self.reconnect_async():
+                self._spill_inflight()
+                self.enqueue(topic, sensors_data)
+                return False
+        
+        if await self.publish_async(topic, sensors_data, qos=1, retain=False):
+            return True
+        
+        self.enqueue(topic, sensors_data)
+        return False
+    
     def publish_sensor_data(self, topic_prefix, device_id, sensors_data):
         
+        topic = "{}/{}".format(topic_prefix, device_id)
+        
         if not self.check_connection():
             if not self.reconnect():
+                self._spill_inflight()
+                self.enqueue(topic, sensors_data)
                 return False
         
-        topic = "{}/{}".format(topic_prefix, device_id)
+        if self.publish(topic, sensors_data, qos=1, retain=False):
+            return True
         
-        return self.publish(topic, sensors_data, qos=1, retain=False)
+        self.enqueue(topic, sensors_data)
+        return False
 
@@ -0,0 +1,161 @@
+import time
+from array import array
+
+_MAX_FIELDS = 20
+_KNOTS_TO_KMH = 1.852
+
+
+def _hex_digit(c):
+    if 0x30 <= c <= 0x39:
+        return c - 0x30
+    if 0x41 <= c <= 0x46:
+        return c - 0x37
+    if 0x61 <= c <= 0x66:
+        return c - 0x57
+    return -1
+
+
+def _number(line, start, end):
+    # Число от полето без междинни низове; празно поле -> None
+    if start >= end:
+        return None
+    value = 0
+    scale = 0
+    sign = 1
+    i = start
+    if line[i] == 0x2D:
+        sign = -1
+        i += 1
+    while i < end:
+        c = line[i]
+        if c == 0x2E:
+            scale = 1
+        elif 0x30 <= c <= 0x39:
+            value = value * 10 + (c - 0x30)
+            if scale:
+                scale *= 10
+        else:
+            return None
+        i += 1
+    if scale:
+        return sign * value / scale
+    return sign * value
+
+
+def _coordinate(value, hemisphere):
+    # ddmm.mmmm -> градуси
+    if value is None:
+        return None
+    degrees = int(value // 100)
+    result = degrees + (value - degrees * 100) / 60.0
+    if hemisphere in (0x53, 0x57):  # S, W
+        result = -result
+    return round(result, 6)
+
+
+class NMEAParser:
+
+    def __init__(self):
+        self._fields = array('H', [0] * (_MAX_FIELDS + 1))
+        self._count = 0
+
+        self.lat = None
+        self.lon = None
+        self.hdop = None
+        self.speed_kmh = None
+        self.course = None
+        self.satellites = 0
+        self.valid = False
+        self.fix_ms = None
+        self.sentences = 0
+        self.checksum_errors = 0
+
+    def _split(self, line):
+        # Начало на всяко поле и проверка на контролната сума с едно минаване
+        end = len(line)
+        if end < 9 or line[0] != 0x24 or line[end - 3] != 0x2A:
+            return False
+        star = end - 3
+        fields = self._fields
+        count = 0
+        fields[0] = 1
+        checksum = 0
+        for i in range(1, star):
+            c = line[i]
+            checksum ^= c
+            if c == 0x2C and count < _MAX_FIELDS - 1:
+                count += 1
+                fields[count] = i + 1
+        fields[count + 1] = star + 1
+        self._count = count + 1
+
+        hi = _hex_digit(line[star + 1])
+        lo = _hex_digit(line[star + 2])
+        if hi < 0 or lo < 0 or checksum != (hi << 4) | lo:
+            self.checksum_errors += 1
+            return False
+        return True
+
+    def _field(self, line, n):
+        if n >= self._count:
+            return None
+        return _number(line, self._fields[n], self._fields[n + 1] - 1)
+
+    def _char(self, line, n):
+        if n >= self._count:
+            return 0
+        start = self._fields[n]
+        return line[start] if start < self._fields[n + 1] - 1 else 0
+
+    def _is(self, line, tag):
+        # $GPRMC, $GNRMC, ... - важен е само типът след източника
+        return line[3] == tag[0] and line[4] == tag[1] and line[5] == tag[2]
+
+    def feed(self, line):
+        if not self._split(line):
+            return False
+        self.sentences += 1
+        if self._is(line, b"RMC"):
+            if self._char(line, 2) != 0x41:  # A = валидни данни
+                self.valid = False
+                return True
+            self._set_position(line, 3)
+            speed = self._field(line, 7)
+            self.speed_kmh = round(speed * _KNOTS_TO_KMH, 1) if speed is not None else None
+            self.course = self._field(line, 8)
+        elif self._is(line, b"GGA"):
+            satellites = self._field(line, 7)
+            self.satellites = int(satellites) if satellites is not None else 0
+            if not self._field(line, 6):  # 0 = без фикс
+                self.valid = False
+                return True
+            self._set_position(line, 2)
+            self.hdop = self._field(line, 8)
+        return True
+
+    def _set_position(self, line, n):
+        lat = _coordinate(self._field(line, n), self._char(line, n + 1))
+        lon = _coordinate(self._field(line, n + 2), self._char(line, n + 3))
+        if lat is None or lon is None:
+            return
+        self.lat = lat
+        self.lon = lon
+        self.valid = True
+        self.fix_ms = time.ticks_ms()
+
+    def set_fix(self, lat, lon, speed_kmh=None):
+        # Позиция от друг източник (напр. +CGPSINFO)
+        self.lat = lat
+        self.lon = lon
+        if speed_kmh is not None:
+            self.speed_kmh = speed_kmh
+        self.valid = True
+        self.fix_ms = time.ticks_ms()
+
+    def position(self):
+        return self.lat, self.lon
+
+    def fix_age_ms(self):
+        if self.fix_ms is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self.fix_ms)
@@ -0,0 +1,185 @@
+import ustruct
+import uos
+import config
+
+# Запис: magic (1) | резервиран (1) | дължина на topic (2) | дължина на payload (2) | topic | payload
+_MAGIC = 0xA5
+_HDR_FMT = "<BBHH"
+_HDR_LEN = 6
+_HEAD_FMT = "<II"
+
+
+class OfflineQueue:
+
+    def __init__(self, directory=None, segment_size=None, max_bytes=None):
+        self._dir = directory or getattr(config, 'OFFLINE_QUEUE_DIR', 'mqtt_queue')
+        self._segment_size = segment_size or getattr(config, 'OFFLINE_QUEUE_SEGMENT_BYTES', 16 * 1024)
+        self._max_bytes = max_bytes or getattr(config, 'OFFLINE_QUEUE_MAX_BYTES', 256 * 1024)
+        self._hdr = bytearray(_HDR_LEN)
+        self._head_path = self._dir + "/head"
+        self.dropped = 0
+
+        try:
+            uos.mkdir(self._dir)
+        except OSError:
+            pass
+
+        self._segments = []
+        for name in uos.listdir(self._dir):
+            if name.endswith(".log"):
+                try:
+                    self._segments.append(int(name[:-4]))
+                except ValueError:
+                    pass
+        self._segments.sort()
+
+        self._read_seg, self._read_off = self._load_head()
+        if self._segments and self._read_seg not in self._segments:
+            self._read_seg = self._segments[0]
+            self._read_off = 0
+
+        # След рестарт се започва нов сегмент, за да не се дописва след евентуално прекъснат запис
+        self._write_seg = (self._segments[-1] + 1) if self._segments else 1
+        if not self._segments:
+            self._read_seg = self._write_seg
+            self._read_off = 0
+        self._write_size = 0
+
+    def _seg_path(self, seg):
+        return "{}/{:08d}.log".format(self._dir, seg)
+
+    def _seg_size(self, seg):
+        try:
+            return uos.stat(self._seg_path(seg))[6]
+        except OSError:
+            return 0
+
+    def _load_head(self):
+        try:
+            with open(self._head_path, 'rb') as f:
+                data = f.read()
+            if len(data) == 8:
+                return ustruct.unpack(_HEAD_FMT, data)
+        except OSError:
+            pass
+        return 0, 0
+
+    def _save_head(self):
+        try:
+            with open(self._head_path, 'wb') as f:
+                f.write(ustruct.pack(_HEAD_FMT, self._read_seg, self._read_off))
+        except OSError as e:
+            print("Опашка: Грешка при запис на позицията:", e)
+
+    def _remove_segment(self, seg):
+        try:
+            uos.remove(self._seg_path(seg))
+        except OSError:
+            pass
+        if seg in self._segments:
+            self._segments.remove(seg)
+
+    def pending_bytes(self):
+        total = 0
+        for seg in self._segments:
+            total += self._seg_size(seg)
+        return total - self._read_off
+
+    def is_empty(self):
+        if not self._segments:
+            return True
+        return self._read_seg == self._segments[-1] and self._read_off >= self._seg_size(self._read_seg)
+
+    def put(self, topic, payload):
+        topic_b = topic.encode('utf-8') if isinstance(topic, str) else topic
+        payload_b = payload.encode('utf-8') if isinstance(payload, str) else payload
+        rec_len = _HDR_LEN + len(topic_b) + len(payload_b)
+
+        if self._write_seg not in self._segments:
+            self._segments.append(self._write_seg)
+            self._write_size = 0
+        elif self._write_size > 0 and self._write_size + rec_len > self._segment_size:
+            self._write_seg += 1
+            self._segments.append(self._write_seg)
+            self._write_size = 0
+
+        ustruct.pack_into(_HDR_FMT, self._hdr, 0, _MAGIC, 0, len(topic_b), len(payload_b))
+        try:
+            with open(self._seg_path(self._write_seg), 'ab') as f:
+                f.write(self._hdr)
+                f.write(topic_b)
+                f.write(payload_b)
+            self._write_size += rec_len
+        except OSError as e:
+            print("Опашка: Грешка при запис:", e)
+            return False
+
+        self._enforce_limit()
+        return True
+
+    def _enforce_limit(self):
+        # Ограничен размер: при препълване се изтрива най-старият сегмент
+        while len(self._segments) > 1 and self.pending_bytes() > self._max_bytes:
+            oldest = self._segments[0]
+            self._remove_segment(oldest)
+            self.dropped += 1
+            print("Опашка: Препълване, изтрит най-стар сегмент", oldest)
+            if self._read_seg == oldest:
+                self._read_seg = self._segments[0]
+                self._read_off = 0
+                self._save_head()
+
+    def _advance_segment(self):
+        if self._read_seg == self._write_seg or len(self._segments) < 2:
+            return False
+        self._remove_segment(self._read_seg)
+        self._read_seg = self._segments[0]
+        self._read_off = 0
+        return True
+
+    def drain(self, send_fn, max_count):
+        sent = 0
+        while sent < max_count and self._segments:
+            try:
+                f = open(self._seg_path(self._read_seg), 'rb')
+            except OSError:
+                if not self._advance_segment():
+                    break
+                continue
+
+            try:
+                f.seek(self._read_off)
+                while sent < max_count:
+                    n = f.readinto(self._hdr)
+                    if n != _HDR_LEN:
+                        break
+                    magic, _, topic_len, payload_len = ustruct.unpack(_HDR_FMT, self._hdr)
+                    if magic != _MAGIC:
+                        print("Опашка: Повреден запис, пропускане на сегмент", self._read_seg)
+                        self._read_off = self._seg_size(self._read_seg)
+                        break
+                    topic = f.read(topic_len)
+                    payload = f.read(payload_len)
+                    if len(topic) != topic_len or len(payload) != payload_len:
+                        break
+                    if not send_fn(topic.decode('utf-8'), payload):
+                        self._save_head()
+                        return sent
+                    self._read_off += _HDR_LEN + topic_len + payload_len
+                    sent += 1
+            finally:
+                f.close()
+
+            if sent >= max_count:
+                break
+            if not self._advance_segment():
+                break
+
+        if self._read_seg == self._write_seg and self._read_off >= self._write_size:
+            # Всичко е изпратено - освобождаване на флаш паметта
+            self._remove_segment(self._write_seg)
+            self._read_off = 0
+            self._write_size = 0
+
+        self._save_head()
+        return sent
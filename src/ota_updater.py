@@ -1,16 +1,28 @@
-import socket
 import time
 import uhashlib
+import ujson
 import uos
 import config
+from http_client import HTTPClient
 
 
 class OTAUpdater:
-    def __init__(self, base_url=config.OTA_BASE_URL, files_to_update=config.OTA_FILES_TO_UPDATE):
+    def __init__(self, base_url=config.OTA_BASE_URL, files_to_update=config.OTA_FILES_TO_UPDATE, net=None):
         self._base_url = base_url
         self._files_to_update = files_to_update
         self._last_check = 0
         self._update_info_file = "ota_versions.txt"
+        self._use_manifest = getattr(config, 'OTA_USE_MANIFEST', False)
+        self._manifest_path = getattr(config, 'OTA_MANIFEST_PATH', "ota_manifest.json")
+        self._manifest_key = getattr(config, 'OTA_MANIFEST_KEY', None)
+        self._rx_buf = bytearray(getattr(config, 'OTA_CHUNK_SIZE', 1024))
+        self._rx_mv = memoryview(self._rx_buf)
+        # Обща keep-alive връзка за целия OTA цикъл - едно TCP/TLS свързване за всички файлове
+        self._http = HTTPClient(timeout_s=10, net=net)
+
+    def set_network(self, net):
+        # Смяна на транспорта (WiFi <-> SIM) за следващата проверка
+        self._http.set_network(net)
     
     def _get_file_hash(self, filepath):
         try:
@@ -25,181 +37,332 @@ class OTAUpdater:
         except Exception:
             return None
     
-    def _download_file(self, url, timeout_s=10):
+    def _download_file(self, url):
         try:
-            is_https = url.startswith("https://")
-            if is_https:
-                url = url[8:]
-            elif url.startswith("http://"):
-                url = url[7:]
-            
-            if "/" in url:
-                host, path = url.split("/", 1)
-                path = "/" + path
-            else:
-                host = url
-                path = "/"
-            
-            port = 443 if is_https else 80
-            
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(timeout_s)
-            
-            sock.connect((host, port))
-            
-            if is_https:
-                try:
-                    import ussl
-
-                    protocol = getattr(ussl, 'PROTOCOL_TLS_CLIENT', 0)
-                    ssl_context = ussl.SSLContext(protocol)
-                    
-                    cert_none = 0
-                    try:
-                        cert_none = getattr(ussl, 'CERT_NONE', 0)
-                    except:
-                        pass
-                    
-                    try:
-                        ssl_context.__dict__['verify_mode'] = cert_none
-                    except:
-                        try:
-                            object.__setattr__(ssl_context, 'verify_mode', cert_none)
-                        except:
-                            try:
-                                ssl_context.verify_mode = cert_none
-                            except:
-                                pass
-                                    
-                    try:
-                        sock = ssl_context.wrap_socket(sock, host)
-                    except (TypeError, ValueError) as e:
-                        error_msg = str(e).lower()
-                        if "keyword" in error_msg or "argument" in error_msg:
-                            try:
-                                sock = ssl_context.wrap_socket(sock)
-                            except ValueError as ve:
-                                if "server_hostname" in str(ve):
-                                    try:
-                                        ssl_context.__dict__['verify_mode'] = cert_none
-                                    except:
-                                        try:
-                                            object.__setattr__(ssl_context, 'verify_mode', cert_none)
-                                        except:
-                                            try:
-                                                ssl_context.verify_mode = cert_none
-                                            except:
-                                                pass
-                                    sock = ssl_context.wrap_socket(sock)
-                                else:
-                                    raise
-                        else:
-                            raise
-                except ImportError:
-                    print("OTA: SSL не е поддържан, използване на HTTP")
-                    return None
-                except Exception as e:
-                    print("OTA: SSL грешка:", e)
-                    sock.close()
-                    return None
-            
-            request = "GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(path, host)
-            sock.send(request.encode())
-
-            all_data = b""
-            
-            while True:
-                try:
-                    chunk = sock.recv(4096)
-                    if not chunk:
-                        break
-                    all_data += chunk
-                except OSError:
-                    break
-                except Exception:
-                    break
-            
-            sock.close()
-            
-            if b"\r\n\r\n" not in all_data:
+            resp = self._http.get(url)
+            if resp.status != 200:
+                resp.close()
                 return None
-            
-            header_data, body_data = all_data.split(b"\r\n\r\n", 1)
-            
-            if b"200 OK" not in header_data:
+            data = resp.read_all()
+            return data if resp.complete else None
+        except Exception as e:
+            print("OTA: Грешка при изтегляне:", e)
+            return None
+    
+    async def _download_file_async(self, url):
+        try:
+            resp = await self._http.get_async(url)
+            if resp.status != 200:
+                resp.close()
                 return None
-            
-            return body_data
-                
+            data = await resp.read_all_async()
+            return data if resp.complete else None
         except Exception as e:
             print("OTA: Грешка при изтегляне:", e)
             return None
     
-    def _get_remote_file_hash(self, filepath):
-        url = "{}/{}".format(self._base_url, filepath)
-        content = self._download_file(url)
+    def _stream_to_file(self, resp, tmp_path):
+        # Тялото се записва на части през предварително заделен буфер; hash се смята в движение
+        sha256 = uhashlib.sha256()
+        mv = self._rx_mv
+        received = 0
+        with open(tmp_path, 'wb') as f:
+            while True:
+                n = resp.readinto(mv)
+                if not n:
+                    break
+                chunk = mv[:n]
+                f.write(chunk)
+                sha256.update(chunk)
+                received += n
+        
+        if not resp.complete:
+            return None, received
+        return sha256.digest().hex(), received
+    
+    async def _stream_to_file_async(self, resp, tmp_path):
+        sha256 = uhashlib.sha256()
+        mv = self._rx_mv
+        received = 0
+        with open(tmp_path, 'wb') as f:
+            while True:
+                n = await resp.readinto_async(mv)
+                if not n:
+                    break
+                chunk = mv[:n]
+                f.write(chunk)
+                sha256.update(chunk)
+                received += n
         
-        if content:
-            sha256 = uhashlib.sha256()
-            sha256.update(content)
-            return sha256.digest().hex()
-        return None
+        if not resp.complete:
+            return None, received
+        return sha256.digest().hex(), received
+    
+    def _download_to_file(self, url, tmp_path):
+        try:
+            resp = self._http.get(url)
+            if resp.status != 200:
+                resp.close()
+                return None, 0
+            return self._stream_to_file(resp, tmp_path)
+        except Exception as e:
+            print("OTA: Грешка при изтегляне:", e)
+            return None, 0
+    
+    async def _download_to_file_async(self, url, tmp_path):
+        try:
+            resp = await self._http.get_async(url)
+            if resp.status != 200:
+                resp.close()
+                return None, 0
+            return await self._stream_to_file_async(resp, tmp_path)
+        except Exception as e:
+            print("OTA: Грешка при изтегляне:", e)
+            return None, 0
+    
+    def _discard(self, tmp_path):
+        try:
+            uos.remove(tmp_path)
+        except OSError:
+            pass
+    
+    def _swap_file(self, tmp_path, filepath):
+        # Целевият файл се заменя едва след успешна проверка на hash, чрез преименуване
+        try:
+            try:
+                uos.rename(tmp_path, filepath)
+            except OSError:
+                uos.remove(filepath)
+                uos.rename(tmp_path, filepath)
+            print("OTA: Успешно обновен", filepath)
+            return True
+        except Exception as e:
+            print("OTA: Грешка при запис на", filepath, ":", e)
+            self._discard(tmp_path)
+            return False
+    
+    def _apply_download(self, filepath, tmp_path, remote_hash, local_hash):
+        if remote_hash is None:
+            print("OTA: Не може да се изтегли", filepath)
+            self._discard(tmp_path)
+            return False
+        
+        if local_hash == remote_hash:
+            self._discard(tmp_path)
+            return False
+        
+        print("OTA: Обновяване на", filepath, "...")
+        return self._swap_file(tmp_path, filepath)
     
     def _update_file(self, filepath):
         try:
             local_hash = self._get_file_hash(filepath)
-            remote_hash = self._get_remote_file_hash(filepath)
-            
-            if remote_hash is None:
-                print("OTA: Не може да се изтегли", filepath)
-                return False
-            
-            if local_hash == remote_hash:
-                return False
-            
-            print("OTA: Обновяване на", filepath, "...")
+            tmp_path = filepath + ".tmp"
             url = "{}/{}".format(self._base_url, filepath)
-            content = self._download_file(url)
-            
-            if content is None:
-                print("OTA: Неуспешно изтегляне на", filepath)
-                return False
-            
-            try:
-                with open(filepath, 'wb') as f:
-                    f.write(content)
-                print("OTA: Успешно обновен", filepath)
-                return True
-            except Exception as e:
-                print("OTA: Грешка при запис на", filepath, ":", e)
-                return False
+            remote_hash, _ = self._download_to_file(url, tmp_path)
+            return self._apply_download(filepath, tmp_path, remote_hash, local_hash)
                 
         except Exception as e:
             print("OTA: Грешка при обновяване на", filepath, ":", e)
             return False
     
-    def check_and_update(self, force_check=False):
+    async def _update_file_async(self, filepath):
+        try:
+            local_hash = self._get_file_hash(filepath)
+            tmp_path = filepath + ".tmp"
+            url = "{}/{}".format(self._base_url, filepath)
+            remote_hash, _ = await self._download_to_file_async(url, tmp_path)
+            return self._apply_download(filepath, tmp_path, remote_hash, local_hash)
+                
+        except Exception as e:
+            print("OTA: Грешка при обновяване на", filepath, ":", e)
+            return False
+    
+    def _hmac_sha256(self, key, msg):
+        if isinstance(key, str):
+            key = key.encode()
+        if len(key) > 64:
+            key = uhashlib.sha256(key).digest()
+        key = key + b"\x00" * (64 - len(key))
+        inner = uhashlib.sha256(bytes(b ^ 0x36 for b in key))
+        inner.update(msg)
+        outer = uhashlib.sha256(bytes(b ^ 0x5C for b in key))
+        outer.update(inner.digest())
+        return outer.digest().hex()
+    
+    def _parse_manifest(self, content):
+        # Формат: първи ред - HMAC-SHA256 (hex) на останалата част, след него JSON
+        if not content or b"\n" not in content:
+            print("OTA: Невалиден манифест")
+            return None
+        
+        signature, body = content.split(b"\n", 1)
+        if not self._manifest_key:
+            print("OTA: OTA_MANIFEST_KEY не е конфигуриран")
+            return None
+        
+        if self._hmac_sha256(self._manifest_key, body) != signature.strip().decode().lower():
+            print("OTA: Невалиден подпис на манифеста")
+            return None
+        
+        try:
+            manifest = ujson.loads(body)
+        except Exception as e:
+            print("OTA: Грешка при четене на манифеста:", e)
+            return None
+        
+        if not isinstance(manifest, dict) or not isinstance(manifest.get('files'), dict):
+            print("OTA: Невалиден манифест")
+            return None
+        return manifest
+    
+    def _load_version(self):
+        try:
+            with open(self._update_info_file, 'r') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+    
+    def _save_version(self, version):
+        try:
+            with open(self._update_info_file, 'w') as f:
+                f.write(str(version))
+        except OSError as e:
+            print("OTA: Грешка при запис на версията:", e)
+    
+    def _pending_files(self, manifest):
+        version = manifest.get('version')
+        if version is not None and str(version) == self._load_version():
+            return []
+        
+        pending = []
+        for filepath, entry in manifest['files'].items():
+            if self._get_file_hash(filepath) != entry.get('sha256'):
+                pending.append((filepath, entry))
+        return pending
+    
+    def _install_manifest_file(self, filepath, entry, tmp_path, digest, size):
+        if digest is None:
+            print("OTA: Неуспешно изтегляне на", filepath)
+            self._discard(tmp_path)
+            return False
+        
+        expected_size = entry.get('size')
+        if expected_size is not None and size != expected_size:
+            print("OTA: Неочакван размер на", filepath)
+            self._discard(tmp_path)
+            return False
+        
+        if digest != entry.get('sha256'):
+            print("OTA: Hash не съвпада с манифеста за", filepath)
+            self._discard(tmp_path)
+            return False
+        
+        return self._swap_file(tmp_path, filepath)
+    
+    def _manifest_url(self):
+        return "{}/{}".format(self._base_url, self._manifest_path)
+    
+    def _update_from_manifest(self):
+        manifest = self._parse_manifest(self._download_file(self._manifest_url()))
+        if manifest is None:
+            return 0
+        
+        files_updated = 0
+        failed = False
+        for filepath, entry in self._pending_files(manifest):
+            print("OTA: Обновяване на", filepath, "...")
+            url = "{}/{}".format(self._base_url, filepath)
+            tmp_path = filepath + ".tmp"
+            digest, size = self._download_to_file(url, tmp_path)
+            if self._install_manifest_file(filepath, entry, tmp_path, digest, size):
+                files_updated += 1
+            else:
+                failed = True
+        
+        if not failed and manifest.get('version') is not None:
+            self._save_version(manifest['version'])
+        return files_updated
+    
+    async def _update_from_manifest_async(self):
+        manifest = self._parse_manifest(await self._download_file_async(self._manifest_url()))
+        if manifest is None:
+            return 0
+        
+        files_updated = 0
+        failed = False
+        for filepath, entry in self._pending_files(manifest):
+            print("OTA: Обновяване на", filepath, "...")
+            url = "{}/{}".format(self._base_url, filepath)
+            tmp_path = filepath + ".tmp"
+            digest, size = await self._download_to_file_async(url, tmp_path)
+            if self._install_manifest_file(filepath, entry, tmp_path, digest, size):
+                files_updated += 1
+            else:
+                failed = True
+        
+        if not failed and manifest.get('version') is not None:
+            self._save_version(manifest['version'])
+        return files_updated
+    
+    def _should_check(self, force_check):
         current_time = time.ticks_ms() // 1000
         
         if not force_check:
             if current_time - self._last_check < config.OTA_CHECK_INTERVAL_S:
-                return 0, False
+                return False
         
         self._last_check = current_time
         
         if not config.OTA_ENABLED:
-            return 0, False
+            return False
         
         print("OTA: Проверка за обновления...")
+        return True
+    
+    def check_and_update(self, force_check=False):
+        if not self._should_check(force_check):
+            return 0, False
         
-        files_updated = 0
-        needs_restart = False
-        
-        for filepath in self._files_to_update:
-            if self._update_file(filepath):
-                files_updated += 1
-                needs_restart = True
+        try:
+            if self._use_manifest:
+                files_updated = self._update_from_manifest()
+                return self._report(files_updated, files_updated > 0)
+            
+            files_updated = 0
+            needs_restart = False
+            
+            for filepath in self._files_to_update:
+                if self._update_file(filepath):
+                    files_updated += 1
+                    needs_restart = True
+            
+            return self._report(files_updated, needs_restart)
+        finally:
+            self._http.close_all()
+    
+    async def check_and_update_async(self, force_check=False):
+        if not self._should_check(force_check):
+            return 0, False
         
+        try:
+            if self._use_manifest:
+                files_updated = await self._update_from_manifest_async()
+                return self._report(files_updated, files_updated > 0)
+            
+            files_updated = 0
+            needs_restart = False
+            
+            for filepath in self._files_to_update:
+                if await self._update_file_async(filepath):
+                    files_updated += 1
+                    needs_restart = True
+            
+            return self._report(files_updated, needs_restart)
+        finally:
+            self._http.close_all()
+    
+    def _report(self, files_updated, needs_restart):
         if files_updated > 0:
             print("OTA: Обновени", files_updated, "файла")
             print("OTA: Необходим е рестарт за да се приложат промените")
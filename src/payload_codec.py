@@ -0,0 +1,142 @@
+import time
+import ustruct
+import config
+
+# Първият байт определя формата: '{' = JSON, 0xA0-0xBF = CBOR map, иначе версия на struct схемата
+STRUCT_VERSION = 1
+# версия | unix време | темп. x100 | влажност x100 | MQ2 | PM2.5 x10 | PM10 x10 | флагове
+_STRUCT_FMT = "<BIhHHHHB"
+_STRUCT_LEN = 16
+
+NO_INT16 = -32768
+NO_UINT16 = 0xFFFF
+
+FLAG_SIM = 0x01
+FLAG_SIM_AVAILABLE = 0x02
+FLAG_WIFI_CONNECTED = 0x04
+
+# MicroPython на ESP32 брои секундите от 2000-01-01
+_EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+
+
+def unix_time():
+    try:
+        return int(time.time()) + _EPOCH_OFFSET
+    except Exception:
+        return 0
+
+
+def scale_value(value, scale, low, high, missing):
+    if value is None:
+        return missing
+    v = int(round(value * scale))
+    if v < low:
+        return low
+    if v > high:
+        return high
+    return v
+
+
+class PayloadCodec:
+
+    def __init__(self, fmt=None):
+        self.format = fmt or getattr(config, 'MQTT_PAYLOAD_FORMAT', 'json')
+        if self.format not in ('json', 'cbor', 'struct'):
+            print("Кодиране: Непознат формат", self.format, "- използва се json")
+            self.format = 'json'
+        self._buf = bytearray(_STRUCT_LEN)
+
+    def is_binary(self):
+        return self.format != 'json'
+
+    def encode(self, reading, stats=None):
+        # reading: плосък речник с temperature, humidity, mq2, pm25, pm10, unix, flags
+        if self.format == 'cbor':
+            record = {
+                't': reading.get('temperature'),
+                'h': reading.get('humidity'),
+                'mq': reading.get('mq2'),
+                'p25': reading.get('pm25'),
+                'p10': reading.get('pm10'),
+                'ts': reading.get('unix', 0),
+                'f': reading.get('flags', 0)
+            }
+            if stats:
+                record['s'] = stats
+            return encode_cbor(record)
+        # Фиксираната схема няма място за статистиката на прозореца
+        return self.encode_struct(reading)
+
+    def encode_struct(self, reading):
+        ustruct.pack_into(
+            _STRUCT_FMT, self._buf, 0,
+            STRUCT_VERSION,
+            reading.get('unix', 0) & 0xFFFFFFFF,
+            scale_value(reading.get('temperature'), 100, -32767, 32767, NO_INT16),
+            scale_value(reading.get('humidity'), 100, 0, 10000, NO_UINT16),
+            scale_value(reading.get('mq2'), 1, 0, 0xFFFE, NO_UINT16),
+            scale_value(reading.get('pm25'), 10, 0, 0xFFFE, NO_UINT16),
+            scale_value(reading.get('pm10'), 10, 0, 0xFFFE, NO_UINT16),
+            reading.get('flags', 0) & 0xFF
+        )
+        return bytes(self._buf)
+
+
+def _cbor_head(out, major, value):
+    major <<= 5
+    if value < 24:
+        out.append(major | value)
+    elif value < 0x100:
+        out.append(major | 24)
+        out.append(value)
+    elif value < 0x10000:
+        out.append(major | 25)
+        out.extend(ustruct.pack(">H", value))
+    elif value < 0x100000000:
+        out.append(major | 26)
+        out.extend(ustruct.pack(">I", value))
+    else:
+        out.append(major | 27)
+        out.extend(ustruct.pack(">Q", value))
+
+
+def _cbor_item(out, value):
+    if value is None:
+        out.append(0xF6)
+    elif value is True:
+        out.append(0xF5)
+    elif value is False:
+        out.append(0xF4)
+    elif isinstance(value, int):
+        if value >= 0:
+            _cbor_head(out, 0, value)
+        else:
+            _cbor_head(out, 1, -1 - value)
+    elif isinstance(value, float):
+        # float32 е достатъчен за точността на сензорите
+        out.append(0xFA)
+        out.extend(ustruct.pack(">f", value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        _cbor_head(out, 3, len(data))
+        out.extend(data)
+    elif isinstance(value, (bytes, bytearray)):
+        _cbor_head(out, 2, len(value))
+        out.extend(value)
+    elif isinstance(value, (list, tuple)):
+        _cbor_head(out, 4, len(value))
+        for item in value:
+            _cbor_item(out, item)
+    elif isinstance(value, dict):
+        _cbor_head(out, 5, len(value))
+        for key, item in value.items():
+            _cbor_item(out, key)
+            _cbor_item(out, item)
+    else:
+        raise TypeError("CBOR: неподдържан тип")
+
+
+def encode_cbor(value):
+    out = bytearray()
+    _cbor_item(out, value)
+    return bytes(out)
@@ -0,0 +1,150 @@
+import gc
+import time
+from array import array
+
+# Горни граници на кофите на хистограмата в микросекунди; последната кофа е за всичко над тях
+_BUCKET_EDGES_US = (
+    250, 500, 1000, 2000, 5000, 10000, 20000, 50000,
+    100000, 200000, 500000, 1000000, 2000000, 5000000, 10000000
+)
+
+
+class _Stage:
+
+    def __init__(self, name, wall=False):
+        self.name = name
+        # wall = етапът съдържа await и времето включва другите задачи
+        self.wall = wall
+        self._counts = array('I', [0] * (len(_BUCKET_EDGES_US) + 1))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.mem_total = 0
+        self.mem_max = 0
+
+    def record(self, duration_us, mem_delta=0):
+        i = 0
+        edges = _BUCKET_EDGES_US
+        n = len(edges)
+        while i < n and duration_us > edges[i]:
+            i += 1
+        self._counts[i] += 1
+        self.count += 1
+        self.total_us += duration_us
+        if duration_us > self.max_us:
+            self.max_us = duration_us
+        self.mem_total += mem_delta
+        if mem_delta > self.mem_max:
+            self.mem_max = mem_delta
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        target = (self.count * p + 99) // 100
+        seen = 0
+        for i in range(len(self._counts)):
+            seen += self._counts[i]
+            if seen >= target:
+                if i < len(_BUCKET_EDGES_US):
+                    return min(_BUCKET_EDGES_US[i], self.max_us)
+                return self.max_us
+        return self.max_us
+
+    def summary(self):
+        if self.count == 0:
+            return {'n': 0}
+        result = {
+            'n': self.count,
+            'avg_us': self.total_us // self.count,
+            'p50_us': self.percentile(50),
+            'p95_us': self.percentile(95),
+            'max_us': self.max_us
+        }
+        if self.wall:
+            result['wall'] = True
+        else:
+            result['mem_avg'] = self.mem_total // self.count
+            result['mem_max'] = self.mem_max
+        return result
+
+
+class _Span:
+    # Едно влизане в етап: началото се пази тук, за да могат няколко задачи да са в един етап едновременно
+
+    def __init__(self, stage):
+        self._stage = stage
+        self._t0 = 0
+        self._m0 = 0
+
+    def __enter__(self):
+        if not self._stage.wall:
+            self._m0 = gc.mem_free()
+        self._t0 = time.ticks_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_us = time.ticks_diff(time.ticks_us(), self._t0)
+        if self._stage.wall:
+            # Паметта междувременно е заделяна и от други задачи - не се отчита
+            self._stage.record(duration_us)
+        else:
+            # Положителна стойност = заделена памет; отрицателна, ако междувременно е минал gc
+            self._stage.record(duration_us, self._m0 - gc.mem_free())
+        return False
+
+    def record(self, duration_us, mem_delta=0):
+        self._stage.record(duration_us, mem_delta)
+
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def record(self, duration_us, mem_delta=0):
+        pass
+
+
+class StageProfiler:
+
+    def __init__(self, enabled=True):
+        self._enabled = enabled
+        self._stages = {}
+        self._null_stage = _NullStage()
+        self._window_start = time.ticks_ms()
+
+    def is_enabled(self):
+        return self._enabled
+
+    def stage(self, name, wall=False):
+        # wall=True за етапи с await: измерва се времето до резултата, не собственото време на задачата
+        if not self._enabled:
+            return self._null_stage
+        st = self._stages.get(name)
+        if st is None:
+            st = _Stage(name, wall)
+            self._stages[name] = st
+        return _Span(st)
+
+    def summary(self):
+        stages = {}
+        for name, st in self._stages.items():
+            stages[name] = st.summary()
+        return {
+            'window_s': time.ticks_diff(time.ticks_ms(), self._window_start) // 1000,
+            'mem_free': gc.mem_free(),
+            'stages': stages
+        }
+
+    def reset(self):
+        for st in self._stages.values():
+            st.reset()
+        self._window_start = time.ticks_ms()
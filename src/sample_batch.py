@@ -0,0 +1,165 @@
+import time
+import ustruct
+import ujson
+from array import array
+import config
+from payload_codec import encode_cbor, unix_time, scale_value, NO_INT16, NO_UINT16
+from track import encode_varint, encode_polyline
+
+# Пакет с няколко проби: версия 2 на struct схемата
+BATCH_STRUCT_VERSION = 2
+# Версия 3: като версия 2, следвана от GPS сегмент (zig-zag varint разлики спрямо t0)
+BATCH_TRACK_STRUCT_VERSION = 3
+# версия | unix време на първата проба | брой проби
+_HDR_FMT = "<BIH"
+_HDR_LEN = 7
+# Δt (s) | темп. x100 | влажност x100 | MQ2 | PM2.5 x10 | PM10 x10 | флагове
+_SAMPLE_FMT = "<HhHHHHB"
+_SAMPLE_LEN = 13
+
+
+def _unscaled(values, scale, missing):
+    result = []
+    for v in values:
+        result.append(None if v == missing else (v / scale if scale != 1 else v))
+    return result
+
+
+def deflate_bytes(data):
+    # zlib формат: първият байт (0x78) не съвпада с JSON, CBOR map или версия на struct схемата
+    try:
+        import deflate
+        import io
+    except ImportError:
+        return None
+    try:
+        out = io.BytesIO()
+        with deflate.DeflateIO(out, deflate.ZLIB) as d:
+            d.write(data)
+        return out.getvalue()
+    except Exception as e:
+        print("Пакет: Грешка при компресия:", e)
+        return None
+
+
+class SampleBatch:
+
+    def __init__(self, fmt='json', max_samples=None, max_age_s=None, use_deflate=None):
+        self.format = fmt
+        self._max = max_samples or getattr(config, 'MQTT_BATCH_SIZE', 30)
+        self._max_age_ms = (max_age_s or getattr(config, 'MQTT_BATCH_MAX_AGE_S', 60)) * 1000
+        self._deflate = getattr(config, 'MQTT_BATCH_DEFLATE', True) if use_deflate is None else use_deflate
+
+        # Колоните са предварително заделени масиви с мащабирани цели числа
+        self._dt = array('H', [0] * self._max)
+        self._temp = array('h', [0] * self._max)
+        self._hum = array('H', [0] * self._max)
+        self._mq = array('H', [0] * self._max)
+        self._pm25 = array('H', [0] * self._max)
+        self._pm10 = array('H', [0] * self._max)
+        self._flags = bytearray(self._max)
+        self.count = 0
+        self._t0 = 0
+        self._t0_ms = 0
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+
+    def add(self, reading):
+        if self.count >= self._max:
+            return False
+        now_ms = time.ticks_ms()
+        i = self.count
+        if i == 0:
+            self._t0 = reading.get('unix') or unix_time()
+            self._t0_ms = now_ms
+        # Времената са отмествания в секунди от първата проба (по монотонния часовник)
+        dt = time.ticks_diff(now_ms, self._t0_ms) // 1000
+        self._dt[i] = dt if dt < 0xFFFF else 0xFFFF
+        self._temp[i] = scale_value(reading.get('temperature'), 100, -32767, 32767, NO_INT16)
+        self._hum[i] = scale_value(reading.get('humidity'), 100, 0, 10000, NO_UINT16)
+        self._mq[i] = scale_value(reading.get('mq2'), 1, 0, 0xFFFE, NO_UINT16)
+        self._pm25[i] = scale_value(reading.get('pm25'), 10, 0, 0xFFFE, NO_UINT16)
+        self._pm10[i] = scale_value(reading.get('pm10'), 10, 0, 0xFFFE, NO_UINT16)
+        self._flags[i] = reading.get('flags', 0) & 0xFF
+        self.count += 1
+        return True
+
+    def is_ready(self):
+        if self.count == 0:
+            return False
+        if self.count >= self._max:
+            return True
+        return time.ticks_diff(time.ticks_ms(), self._t0_ms) >= self._max_age_ms
+
+    def reset(self):
+        self.count = 0
+
+    def _columns(self):
+        n = self.count
+        return {
+            't0': self._t0,
+            'dt': list(self._dt[:n]),
+            'temperature': _unscaled(self._temp[:n], 100, NO_INT16),
+            'humidity': _unscaled(self._hum[:n], 100, NO_UINT16),
+            'mq2': _unscaled(self._mq[:n], 1, NO_UINT16),
+            'pm25': _unscaled(self._pm25[:n], 10, NO_UINT16),
+            'pm10': _unscaled(self._pm10[:n], 10, NO_UINT16),
+            'flags': list(self._flags[:n])
+        }
+
+    def _encode_struct(self, track):
+        n = self.count
+        buf = bytearray(_HDR_LEN + n * _SAMPLE_LEN)
+        version = BATCH_TRACK_STRUCT_VERSION if track else BATCH_STRUCT_VERSION
+        ustruct.pack_into(_HDR_FMT, buf, 0, version, self._t0 & 0xFFFFFFFF, n)
+        offset = _HDR_LEN
+        for i in range(n):
+            ustruct.pack_into(
+                _SAMPLE_FMT, buf, offset,
+                self._dt[i], self._temp[i], self._hum[i], self._mq[i],
+                self._pm25[i], self._pm10[i], self._flags[i]
+            )
+            offset += _SAMPLE_LEN
+        if track:
+            buf.extend(encode_varint(track, self._t0))
+        return bytes(buf)
+
+    def encode(self, track=None, stats=None):
+        # track: върхове (lat x1e5, lon x1e5, unix) от TrackBuffer.take(), изпращани с пакета
+        # stats: WindowAggregator.summary() за пробите в пакета; struct схемата няма място за нея
+        if self.format == 'struct':
+            payload = self._encode_struct(track)
+        elif self.format == 'cbor':
+            columns = self._columns()
+            record = {
+                't0': columns['t0'],
+                'dt': columns['dt'],
+                't': columns['temperature'],
+                'h': columns['humidity'],
+                'mq': columns['mq2'],
+                'p25': columns['pm25'],
+                'p10': columns['pm10'],
+                'f': columns['flags']
+            }
+            if track:
+                record['trk'] = encode_varint(track, self._t0)
+            if stats:
+                record['s'] = stats
+            payload = encode_cbor(record)
+        else:
+            columns = self._columns()
+            columns['device_id'] = config.DEVICE_NAME
+            if track:
+                columns['trk'] = encode_polyline(track, self._t0)
+            if stats:
+                columns['stats'] = stats
+            payload = ujson.dumps(columns).encode('utf-8')
+
+        self.bytes_raw += len(payload)
+        if self._deflate:
+            packed = deflate_bytes(payload)
+            # Компресираният вариант се изпраща само ако наистина е по-малък
+            if packed is not None and len(packed) < len(payload):
+                payload = packed
+        self.bytes_sent += len(payload)
+        return payload
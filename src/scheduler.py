@@ -0,0 +1,61 @@
+import sys
+import time
+import uasyncio as asyncio
+
+
+class Scheduler:
+
+    def __init__(self):
+        self._periodic = []
+        self._background = []
+
+    def every(self, name, period_s, coro_fn, delay_s=0):
+        self._periodic.append((name, int(period_s * 1000), coro_fn, int(delay_s * 1000)))
+
+    def spawn(self, name, coro_fn):
+        self._background.append((name, coro_fn))
+
+    async def _run_periodic(self, name, period_ms, coro_fn, delay_ms):
+        if delay_ms > 0:
+            await asyncio.sleep_ms(delay_ms)
+
+        next_run = time.ticks_ms()
+        while True:
+            try:
+                await coro_fn()
+            except Exception as e:
+                print("Планировчик: Грешка в задача", name, ":", e)
+                sys.print_exception(e)
+
+            # Следващото изпълнение се планира спрямо предишния срок, а не спрямо края на задачата
+            next_run = time.ticks_add(next_run, period_ms)
+            delay = time.ticks_diff(next_run, time.ticks_ms())
+            if delay < 0:
+                next_run = time.ticks_ms()
+                delay = 0
+            await asyncio.sleep_ms(delay)
+
+    async def _run_background(self, name, coro_fn):
+        while True:
+            try:
+                await coro_fn()
+                return
+            except Exception as e:
+                print("Планировчик: Грешка във фонова задача", name, ":", e)
+                sys.print_exception(e)
+                await asyncio.sleep_ms(1000)
+
+    async def _main(self):
+        for name, period_ms, coro_fn, delay_ms in self._periodic:
+            asyncio.create_task(self._run_periodic(name, period_ms, coro_fn, delay_ms))
+        for name, coro_fn in self._background:
+            asyncio.create_task(self._run_background(name, coro_fn))
+
+        while True:
+            await asyncio.sleep(3600)
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        finally:
+            asyncio.new_event_loop()
@@ -1,25 +1,79 @@
 from machine import Pin, UART
 import config
 
+_FRAME_LEN = 10
+_BUF_SIZE = 128
+
 
 class SDS011Sensor:
     def __init__(self, uart_id=config.SDS_UART_ID, rx_pin=config.SDS_RX_PIN, baud=config.SDS_BAUD):
         self._uart = UART(uart_id, baudrate=baud, rx=Pin(rx_pin), timeout=50)
-        self._buf = b""
+        self._buf = bytearray(_BUF_SIZE)
+        self._mv = memoryview(self._buf)
+        self._len = 0
+        self.frames_ok = 0
+        self.frames_bad = 0
+        self.bytes_dropped = 0
+
+    def _parse(self):
+        buf = self._buf
+        n = self._len
+        i = 0
+        pm25_raw = -1
+        pm10_raw = -1
+
+        while n - i >= _FRAME_LEN:
+            if buf[i] != 0xAA or buf[i + 1] != 0xC0:
+                i += 1
+                self.bytes_dropped += 1
+                continue
+
+            checksum = (buf[i + 2] + buf[i + 3] + buf[i + 4] + buf[i + 5] + buf[i + 6] + buf[i + 7]) & 0xFF
+            if buf[i + 9] != 0xAB or buf[i + 8] != checksum:
+                # Повредена рамка - ресинхронизация от следващия байт
+                self.frames_bad += 1
+                i += 1
+                continue
+
+            pm25_raw = buf[i + 2] | (buf[i + 3] << 8)
+            pm10_raw = buf[i + 4] | (buf[i + 5] << 8)
+            self.frames_ok += 1
+            i += _FRAME_LEN
+
+        if i:
+            self._mv[0:n - i] = self._mv[i:n]
+            self._len = n - i
+
+        if pm25_raw < 0:
+            return None, None
+        return round(pm25_raw / 10.0, 1), round(pm10_raw / 10.0, 1)
 
     def read_once(self):
-        if self._uart.any():
-            self._buf += self._uart.read()
-            if len(self._buf) > 128:
-                self._buf = self._buf[-128:]
-
-        i = self._buf.find(b"\xAA\xC0")
-        if i != -1 and len(self._buf) >= i + 10:
-            frame = self._buf[i:i + 10]
-            self._buf = self._buf[i + 10:]
-            if frame[9] == 0xAB:
-                pm25 = round((frame[2] + frame[3] * 256) / 10.0, 1)
-                pm10 = round((frame[4] + frame[5] * 256) / 10.0, 1)
-                return pm25, pm10
-
-        return None, None
+        pm25 = None
+        pm10 = None
+
+        while True:
+            available = self._uart.any()
+            if not available:
+                break
+
+            # След _parse() в буфера остава най-много една непълна рамка
+            space = _BUF_SIZE - self._len
+            want = available if available < space else space
+            got = self._uart.readinto(self._mv[self._len:self._len + want])
+            if not got:
+                break
+            self._len += got
+
+            p25, p10 = self._parse()
+            if p25 is not None:
+                pm25, pm10 = p25, p10
+
+        return pm25, pm10
+
+    def get_stats(self):
+        return {
+            'frames_ok': self.frames_ok,
+            'frames_bad': self.frames_bad,
+            'bytes_dropped': self.bytes_dropped
+        }
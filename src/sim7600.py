@@ -1,36 +1,162 @@
 import time
 from machine import Pin, UART
 import config
+from at_engine import ATEngine
+from nmea import NMEAParser
 
 
 class SIM7600:
     def __init__(self, uart_id=config.SIM_UART_ID, rx_pin=config.SIM_RX_PIN, tx_pin=config.SIM_TX_PIN, baud=config.SIM_BAUD):
-        self._uart = UART(uart_id, baudrate=baud, rx=Pin(rx_pin), tx=Pin(tx_pin), timeout=50)
+        self._uart = UART(uart_id, baudrate=baud, rx=Pin(rx_pin), tx=Pin(tx_pin), timeout=50,
+                          rxbuf=getattr(config, 'SIM_UART_RXBUF', 1024))
         self._bytes_sent = 0
         self._bytes_received = 0
+        self._engine = ATEngine(self._uart, getattr(config, 'SIM_AT_BUFFER', 512), getattr(config, 'SIM_AT_STREAM', True))
+
+        # Последните непоискани съобщения (URC) от модема
+        self.creg_stat = None
+        self.cpin_state = None
+        self.ring_count = 0
+        self.last_gpsinfo = None
+        self._engine.on_urc("+CREG:", self._on_creg)
+        self._engine.on_urc("+CPIN:", self._on_cpin)
+        self._engine.on_urc("+CSQ:", self._on_csq)
+        self._engine.on_urc("+SIMCARD:", self._on_simcard)
+        self._engine.on_urc("+CGPSINFO:", self._on_gpsinfo)
+        self._engine.on_urc("RING", self._on_ring)
+
+        # "poll" = AT+CGPSINFO при всяко четене, "report" = периодичен +CGPSINFO, "nmea" = RMC/GGA изречения
+        self._gps_mode = getattr(config, 'GPS_MODE', "poll")
+        self._gps_report_s = getattr(config, 'GPS_REPORT_S', 1)
+        self.gps_on = False
+        self.gps = NMEAParser()
+        self._engine.on_urc("$G", self.gps.feed)
+
+        # Кеш на статуса: всяко поле има собствен срок на валидност
+        self._ok_ttl_ms = getattr(config, 'SIM_STATUS_OK_TTL_S', config.MAIN_PERIOD_S) * 1000
+        self._present_ttl_ms = getattr(config, 'SIM_STATUS_PRESENT_TTL_S', 5) * 1000
+        self._rssi_ttl_ms = getattr(config, 'SIM_STATUS_RSSI_TTL_S', 30) * 1000
+        self._present = None
+        self._present_ms = None
+        self._rssi = None
+        self._rssi_ms = None
+        self.status_changed = False
+
+    def _fresh(self, stamp, ttl_ms):
+        return stamp is not None and time.ticks_diff(time.ticks_ms(), stamp) < ttl_ms
+
+    def _set_present(self, present):
+        if present is None:
+            return
+        if present != self._present and self._present is not None:
+            self.status_changed = True
+        self._present = present
+        self._present_ms = time.ticks_ms()
+
+    def _on_creg(self, line):
+        try:
+            parts = line.split(b":", 1)[1].split(b",")
+            # URC: +CREG: <stat>; отговор на AT+CREG?: +CREG: <n>,<stat>
+            stat = int(parts[1] if len(parts) > 1 else parts[0])
+        except (IndexError, ValueError):
+            return
+        if self.creg_stat is not None and stat != self.creg_stat:
+            self.status_changed = True
+        self.creg_stat = stat
+
+    def is_registered(self):
+        # 1 = домашна мрежа, 5 = роуминг
+        return self.creg_stat in (1, 5)
+
+    def _registered(self):
+        # Неизвестна регистрация (модемът не е отговорил на AT+CREG?) не се брои за проблем
+        return self.creg_stat is None or self.is_registered()
+
+    def _on_cpin(self, line):
+        self.cpin_state = line.split(b":", 1)[1].strip()
+        self._set_present(self._parse_cpin(line))
+
+    def _on_csq(self, line):
+        rssi = self._parse_csq(line)
+        if rssi is not None:
+            self._rssi = rssi
+            self._rssi_ms = time.ticks_ms()
+
+    def _on_simcard(self, line):
+        # SIM7600 при изваждане на картата: +SIMCARD: NOT AVAILABLE
+        if b"NOT AVAILABLE" in line.upper():
+            self._set_present(False)
+
+    def _on_gpsinfo(self, line):
+        self.last_gpsinfo = line
+        lat, lon = self._parse_gpsinfo(line)
+        if lat is not None and lon is not None:
+            self.gps.set_fix(lat, lon)
+
+    def _on_ring(self, line):
+        self.ring_count += 1
+
+    def engine(self):
+        # Общ AT канал за модулите над модема (напр. sim_socket)
+        return self._engine
+
+    def poll_urc(self):
+        self._engine.poll()
 
     def at(self, cmd, timeout_ms=400):
-        if self._uart.any():
-            try:
-                self._uart.read()
-            except Exception:
-                pass
-
-        self._uart.write((cmd + "\r\n").encode())
-
-        t0 = time.ticks_ms()
-        resp = b""
-        while time.ticks_diff(time.ticks_ms(), t0) < timeout_ms:
-            if self._uart.any():
-                resp += self._uart.read()
-                if b"OK" in resp or b"ERROR" in resp:
-                    break
-            time.sleep_ms(20)
-        return resp
+        return self._engine.command(cmd, timeout_ms)
+
+    async def at_async(self, cmd, timeout_ms=400):
+        return await self._engine.command_async(cmd, timeout_ms)
 
     def init(self):
         self.at("ATE0", timeout_ms=400)
-        self.at("AT+CGPS=1", timeout_ms=700)
+        self.gps_on = self.at("AT+CGPS=1", timeout_ms=700).endswith(b"OK")
+        # Промените в регистрацията и сигнала се изпращат от модема като URC
+        self.at("AT+CREG=1", timeout_ms=400)
+        self.at("AT+CREG?", timeout_ms=400)
+        self.at("AT+AUTOCSQ=1,1", timeout_ms=400)
+        # Изваждането на картата се съобщава веднага с +SIMCARD: NOT AVAILABLE;
+        # нивото на пина за наличие зависи от държача на картата
+        hotswap_level = getattr(config, 'SIM_HOTSWAP_LEVEL', 1)
+        if hotswap_level is not None:
+            self.at("AT+UIMHOTSWAPLEVEL={}".format(hotswap_level), timeout_ms=400)
+            self.at("AT+UIMHOTSWAPON=1", timeout_ms=400)
+        self._start_gps_report()
+
+    def _gps_report_command(self):
+        if self._gps_mode == "report":
+            return "AT+CGPSINFO={}".format(self._gps_report_s)
+        if self._gps_mode == "nmea":
+            # Маска 3 = GGA + RMC, изведени по AT порта
+            return "AT+CGPSINFOCFG={},3".format(self._gps_report_s)
+        return None
+
+    def _start_gps_report(self):
+        # Модемът сам изпраща позицията; четенето ѝ е само от кеша
+        cmd = self._gps_report_command()
+        if cmd:
+            self.at(cmd, timeout_ms=400)
+
+    async def gps_report_async(self, interval_s):
+        # Модемът приема период до 255 s
+        self._gps_report_s = max(1, min(255, int(interval_s)))
+        cmd = self._gps_report_command()
+        if cmd:
+            await self.at_async(cmd, timeout_ms=400)
+
+    async def gps_power_async(self, on):
+        r = await self.at_async("AT+CGPS={}".format(1 if on else 0), timeout_ms=700)
+        if r.endswith(b"OK"):
+            self.gps_on = on
+            if on:
+                cmd = self._gps_report_command()
+                if cmd:
+                    await self.at_async(cmd, timeout_ms=400)
+        return self.gps_on
+
+    def gps_streaming(self):
+        return self._gps_mode in ("report", "nmea")
 
     def _parse_csq(self, resp):
         try:
@@ -43,26 +169,80 @@ class SIM7600:
             pass
         return None
 
-    def status(self):
-        r = self.at("AT", timeout_ms=400)
-        ok = (b"OK" in r)
+    def _parse_cpin(self, cpin):
+        cpin = cpin.upper()
+        if b"SIM NOT INSERTED" in cpin or b"NOT INSERTED" in cpin:
+            return False
+        elif b"+CPIN:" in cpin:
+            return True
+        return None
+
+    def _status_command(self, force):
+        # Само полетата с изтекъл срок се обновяват, в една комбинирана команда
+        parts = []
+        if force or not self._fresh(self._present_ms, self._present_ttl_ms):
+            parts.append("+CPIN?")
+        if force or not self._fresh(self._rssi_ms, self._rssi_ttl_ms):
+            parts.append("+CSQ")
+        if parts:
+            return "AT" + ";".join(parts)
+        if not self._fresh(self._engine.last_rx_ms, self._ok_ttl_ms):
+            return "AT"
+        return None
 
-        present = None
-        rssi = None
+    def _apply_status(self, cmd, r):
+        if cmd is None:
+            # Модемът е изпратил данни наскоро - UART работи
+            return True
+        if not r:
+            return False
+        # +CPIN и +CSQ редовете вече са обработени от URC обработчиците; тук остава грешката без карта
+        if "+CPIN" in cmd and self._parse_cpin(r) is False:
+            self._set_present(False)
+        return True
 
-        if ok:
-            cpin = self.at("AT+CPIN?", timeout_ms=600).upper()
-            if b"SIM NOT INSERTED" in cpin or b"NOT INSERTED" in cpin:
-                present = False
-            elif b"+CPIN:" in cpin:
-                present = True
+    def _take_changed(self, force):
+        # Промяна, съобщена с URC (карта, регистрация), обновява целия статус веднага
+        if self.status_changed:
+            self.status_changed = False
+            return True
+        return force
 
-            rssi = self._parse_csq(self.at("AT+CSQ", timeout_ms=600))
+    def status(self, force=False):
+        self._engine.poll()
+        cmd = self._status_command(self._take_changed(force))
+        ok = self._apply_status(cmd, self.at(cmd, timeout_ms=900) if cmd else None)
+        if not ok:
+            return False, None, None
+        return self._registered(), self._present, self._rssi
 
-        return ok, present, rssi
+    async def status_async(self, force=False):
+        self._engine.poll()
+        cmd = self._status_command(self._take_changed(force))
+        ok = self._apply_status(cmd, await self.at_async(cmd, timeout_ms=900) if cmd else None)
+        if not ok:
+            return False, None, None
+        return self._registered(), self._present, self._rssi
+
+    def _gps_cached(self):
+        self._engine.poll()
+        # Фикс, по-стар от два периода на докладване, не е текущ (модемът е спрял да праща)
+        age = self.gps.fix_age_ms()
+        if not self.gps.valid or age is None or age > 2000 * self._gps_report_s:
+            return None, None
+        return self.gps.position()
 
     def gps_read(self):
-        r = self.at("AT+CGPSINFO", timeout_ms=900)
+        if self.gps_streaming():
+            return self._gps_cached()
+        return self._parse_gpsinfo(self.at("AT+CGPSINFO", timeout_ms=900))
+
+    async def gps_read_async(self):
+        if self.gps_streaming():
+            return self._gps_cached()
+        return self._parse_gpsinfo(await self.at_async("AT+CGPSINFO", timeout_ms=900))
+
+    def _parse_gpsinfo(self, r):
         try:
             s = r.decode("utf-8", "ignore")
             for ln in s.splitlines():
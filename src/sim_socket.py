@@ -0,0 +1,371 @@
+import time
+import config
+
+_MAX_LINKS = 10
+_RX_SIZE = 1024
+
+
+def _args(line):
+    # b"+CIPOPEN: 0,0" -> [b"0", b"0"]
+    return line.split(b":", 1)[1].strip().split(b",")
+
+
+class SIMSocket:
+
+    def __init__(self, net):
+        self._net = net
+        self._engine = net.engine
+        self._link = None
+        self._timeout_ms = getattr(config, 'SIM_SOCKET_TIMEOUT_S', 10) * 1000
+        self._rx = bytearray(getattr(config, 'SIM_SOCKET_RX_BUFFER', _RX_SIZE))
+        self._rx_mv = memoryview(self._rx)
+        self._rx_start = 0
+        self._rx_len = 0
+        self.rx_pending = False
+        self.connect_result = None
+        self.closed = False
+
+    def settimeout(self, timeout_s):
+        # None = блокиращ режим, 0 = неблокиращ
+        self._timeout_ms = 3600000 if timeout_s is None else int(timeout_s * 1000)
+
+    def setblocking(self, flag):
+        self.settimeout(None if flag else 0)
+
+    def _begin_connect(self, host, port):
+        self._link = self._net._allocate(self)
+        if self._link is None:
+            raise OSError("SIM: Няма свободна връзка")
+        self.connect_result = None
+        self.closed = False
+        return 'AT+CIPOPEN={},"TCP","{}",{}'.format(self._link, host, port)
+
+    def _end_connect(self, opened, host, port):
+        if not opened:
+            self._release()
+            raise OSError("SIM: Неуспешно свързване към {}:{}".format(host, port))
+        if self.connect_result != 0:
+            err = self.connect_result
+            self._release()
+            raise OSError("SIM: CIPOPEN грешка {}".format(err))
+
+    def connect(self, addr):
+        host, port = addr[0], addr[1]
+        if not self._net.open():
+            raise OSError("SIM: Мрежата не е отворена")
+        r = self._engine.command(self._begin_connect(host, port), timeout_ms=2000)
+        opened = b"ERROR" not in r and self._engine.wait(lambda: self.connect_result is not None, self._timeout_ms)
+        self._end_connect(opened, host, port)
+
+    async def connect_async(self, addr):
+        # Като connect(), но NETOPEN и +CIPOPEN се чакат без да спират останалите задачи
+        host, port = addr[0], addr[1]
+        if not await self._net.open_async():
+            raise OSError("SIM: Мрежата не е отворена")
+        r = await self._engine.command_async(self._begin_connect(host, port), timeout_ms=2000)
+        opened = b"ERROR" not in r and await self._engine.wait_async(lambda: self.connect_result is not None, self._timeout_ms)
+        self._end_connect(opened, host, port)
+
+    def _release(self):
+        if self._link is not None:
+            self._net._free(self._link)
+            self._link = None
+        self.closed = True
+
+    def send(self, data):
+        if self._link is None or self.closed:
+            raise OSError("SIM: Връзката е затворена")
+        mv = memoryview(data)
+        chunk = self._net.chunk_size
+        sent = 0
+        while sent < len(mv):
+            n = min(chunk, len(mv) - sent)
+            r = self._engine.command("AT+CIPSEND={},{}".format(self._link, n), timeout_ms=self._net.send_timeout_ms, data=mv[sent:sent + n])
+            if not r.endswith(b"OK"):
+                if sent:
+                    return sent
+                raise OSError("SIM: Грешка при изпращане")
+            sent += n
+        return sent
+
+    def write(self, data):
+        return self.send(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def _on_data(self, chunk):
+        end = self._rx_start + self._rx_len
+        self._rx_mv[end:end + len(chunk)] = chunk
+        self._rx_len += len(chunk)
+
+    def _fill(self):
+        # Данните остават в модема, докато не бъдат поискани с AT+CIPRXGET=2
+        if self._rx_len:
+            return True
+        self._rx_start = 0
+        if not self.rx_pending and not self.closed:
+            self._engine.wait(lambda: self.rx_pending or self.closed, self._timeout_ms)
+        if not self.rx_pending:
+            return False
+        self._engine.command("AT+CIPRXGET=2,{},{}".format(self._link, len(self._rx)), timeout_ms=2000)
+        return self._rx_len > 0
+
+    async def _fill_async(self):
+        if self._rx_len:
+            return True
+        self._rx_start = 0
+        if not self.rx_pending and not self.closed:
+            await self._engine.wait_async(lambda: self.rx_pending or self.closed, self._timeout_ms)
+        if not self.rx_pending:
+            return False
+        await self._engine.command_async("AT+CIPRXGET=2,{},{}".format(self._link, len(self._rx)), timeout_ms=2000)
+        return self._rx_len > 0
+
+    def _take(self, buf, n):
+        n = min(n, self._rx_len)
+        buf[0:n] = self._rx_mv[self._rx_start:self._rx_start + n]
+        self._rx_start += n
+        self._rx_len -= n
+        return n
+
+    def readinto(self, buf, nbytes=None):
+        if not self._fill():
+            return 0 if self.closed else None
+        return self._take(buf, len(buf) if nbytes is None else nbytes)
+
+    async def readinto_async(self, buf):
+        if not await self._fill_async():
+            return 0 if self.closed else None
+        return self._take(buf, len(buf))
+
+    def recv(self, n):
+        if not self._fill():
+            if self.closed:
+                return b""
+            raise OSError(110)
+        n = min(n, self._rx_len)
+        data = bytes(self._rx_mv[self._rx_start:self._rx_start + n])
+        self._rx_start += n
+        self._rx_len -= n
+        return data
+
+    def read(self, n):
+        return self.recv(n)
+
+    def _take_line(self, line):
+        # Добавя буферираните байтове до края на реда; True, ако редът е завършен
+        end = self._rx_start + self._rx_len
+        i = self._rx_start
+        while i < end and self._rx[i] != 0x0A:
+            i += 1
+        if i < end:
+            i += 1
+        line.extend(self._rx_mv[self._rx_start:i])
+        self._rx_len -= i - self._rx_start
+        self._rx_start = i
+        return line and line[-1] == 0x0A
+
+    def readline(self):
+        line = bytearray()
+        while self._fill():
+            if self._take_line(line):
+                break
+        return bytes(line)
+
+    async def readline_async(self):
+        line = bytearray()
+        while await self._fill_async():
+            if self._take_line(line):
+                break
+        return bytes(line)
+
+    def readable(self):
+        return self._rx_len > 0 or self.rx_pending or self.closed
+
+    def close(self):
+        if self._link is not None and not self.closed:
+            self._engine.command("AT+CIPCLOSE={}".format(self._link), timeout_ms=2000)
+        self._release()
+
+
+class _SIMPoll:
+
+    def __init__(self, net):
+        self._net = net
+        self._socks = []
+
+    def register(self, sock, eventmask=1):
+        if sock not in self._socks:
+            self._socks.append(sock)
+
+    def unregister(self, sock):
+        if sock in self._socks:
+            self._socks.remove(sock)
+
+    def poll(self, timeout_ms=-1):
+        engine = self._net.engine
+        t0 = time.ticks_ms()
+        while True:
+            engine.poll()
+            ready = [(s, SIMNetwork.POLLIN) for s in self._socks if s.readable()]
+            if ready:
+                return ready
+            remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), t0)
+            if timeout_ms >= 0 and remaining <= 0:
+                return ready
+            engine._wait_rx(remaining if timeout_ms >= 0 else 1000)
+
+
+class SIMNetwork:
+    # Интерфейс като модулите socket/uselect, за да се подава на съществуващите клиенти
+    AF_INET = 2
+    SOCK_STREAM = 1
+    POLLIN = 1
+
+    def __init__(self, sim):
+        self.engine = sim.engine()
+        self.chunk_size = getattr(config, 'SIM_SOCKET_CHUNK', 1024)
+        self.send_timeout_ms = getattr(config, 'SIM_SOCKET_SEND_TIMEOUT_MS', 5000)
+        self._links = [None] * _MAX_LINKS
+        self._opened = False
+        self._opening = False
+        self._netopen_result = None
+
+        self.engine.on_urc("+NETOPEN:", self._on_netopen)
+        self.engine.on_urc("+CIPOPEN:", self._on_cipopen)
+        self.engine.on_urc("+CIPRXGET:", self._on_ciprxget)
+        self.engine.on_urc("+IPCLOSE:", self._on_ipclose)
+        self.engine.on_urc("+CIPCLOSE:", self._on_ipclose)
+        self.engine.on_urc("+CIPEVENT:", self._on_cipevent)
+
+    def _link_socket(self, args):
+        try:
+            link = int(args[0])
+        except (IndexError, ValueError):
+            return None
+        if 0 <= link < _MAX_LINKS:
+            return self._links[link]
+        return None
+
+    def _on_netopen(self, line):
+        try:
+            self._netopen_result = int(_args(line)[0])
+        except ValueError:
+            pass
+
+    def _on_cipopen(self, line):
+        args = _args(line)
+        sock = self._link_socket(args)
+        if sock is not None and len(args) > 1:
+            sock.connect_result = int(args[1])
+
+    def _on_ciprxget(self, line):
+        args = _args(line)
+        mode = args[0]
+        sock = self._link_socket(args[1:])
+        if sock is None:
+            return
+        if mode == b"1":
+            sock.rx_pending = True
+        elif mode == b"2" and len(args) >= 4:
+            # +CIPRXGET: 2,<link>,<прочетени>,<оставащи>, следват двоичните данни
+            count = int(args[2])
+            sock.rx_pending = int(args[3]) > 0
+            if count:
+                self.engine.expect_raw(count, sock._on_data)
+
+    def _on_ipclose(self, line):
+        sock = self._link_socket(_args(line))
+        if sock is not None:
+            sock.closed = True
+
+    def _on_cipevent(self, line):
+        # +CIPEVENT: NETWORK CLOSED UNEXPECTEDLY
+        self._opened = False
+        for sock in self._links:
+            if sock is not None:
+                sock.closed = True
+
+    def _allocate(self, sock):
+        for i in range(_MAX_LINKS):
+            if self._links[i] is None:
+                self._links[i] = sock
+                return i
+        return None
+
+    def _free(self, link):
+        self._links[link] = None
+
+    def _open_commands(self):
+        apn = getattr(config, 'SIM_APN', "")
+        if apn:
+            yield 'AT+CGDCONT=1,"IP","{}"'.format(apn)
+        # Ръчно четене: входящите данни чакат в модема до AT+CIPRXGET=2
+        yield "AT+CIPRXGET=1"
+
+    def _netopen_reply(self, r):
+        # None = чака се +NETOPEN URC
+        if b"already opened" in r:
+            self._opened = True
+            return True
+        if not r.endswith(b"OK"):
+            return self._netopen_finish()
+        return None
+
+    def _netopen_finish(self):
+        self._opened = self._netopen_result == 0
+        if not self._opened:
+            print("SIM: NETOPEN неуспешен:", self._netopen_result)
+        return self._opened
+
+    def open(self, timeout_ms=30000):
+        if self._opened:
+            return True
+        for cmd in self._open_commands():
+            self.engine.command(cmd, timeout_ms=1000)
+        self._netopen_result = None
+        done = self._netopen_reply(self.engine.command("AT+NETOPEN", timeout_ms=2000))
+        if done is not None:
+            return done
+        self.engine.wait(lambda: self._netopen_result is not None, timeout_ms)
+        return self._netopen_finish()
+
+    async def open_async(self, timeout_ms=30000):
+        # Като open(), без да спира останалите задачи, докато модемът активира PDP контекста
+        if self._opened:
+            return True
+        if self._opening:
+            # Друга задача вече отваря мрежата - изчаква се нейният резултат
+            await self.engine.wait_async(lambda: not self._opening, timeout_ms)
+            return self._opened
+        self._opening = True
+        try:
+            for cmd in self._open_commands():
+                await self.engine.command_async(cmd, timeout_ms=1000)
+            self._netopen_result = None
+            done = self._netopen_reply(await self.engine.command_async("AT+NETOPEN", timeout_ms=2000))
+            if done is not None:
+                return done
+            await self.engine.wait_async(lambda: self._netopen_result is not None, timeout_ms)
+            return self._netopen_finish()
+        finally:
+            self._opening = False
+
+    def close(self):
+        for sock in self._links:
+            if sock is not None:
+                sock.close()
+        if self._opened:
+            self.engine.command("AT+NETCLOSE", timeout_ms=2000)
+        self._opened = False
+
+    def getaddrinfo(self, host, port, af=0, type=0, proto=0, flags=0):
+        # Имената се разрешават от модема при AT+CIPOPEN
+        return [(self.AF_INET, self.SOCK_STREAM, 0, "", (host, port))]
+
+    def socket(self, af=AF_INET, type=SOCK_STREAM, proto=0):
+        return SIMSocket(self)
+
+    def poll(self):
+        return _SIMPoll(self)
@@ -1,137 +1,110 @@
 import socket
 import time
+import uasyncio as asyncio
 import config
+from http_client import HTTPClient, parse_url
 
 
 class SpeedTest:
-    
-    def __init__(self, test_url=config.SPEED_TEST_URL, timeout_s=config.SPEED_TEST_TIMEOUT_S):
+
+    def __init__(self, test_url=config.SPEED_TEST_URL, timeout_s=config.SPEED_TEST_TIMEOUT_S, net=None):
         self._test_url = test_url
         self._timeout_s = timeout_s
-    
+        # Мрежов слой (напр. SIMNetwork); None = WiFi
+        self._net = net
+        self._http = HTTPClient(timeout_s=timeout_s, net=net)
+        self._rx_buf = bytearray(1024)
+        self._rx_mv = memoryview(self._rx_buf)
+
+    def set_network(self, net):
+        self._net = net
+        self._http.set_network(net)
+
     def _parse_url(self, url):
-        if url.startswith("http://"):
-            url = url[7:]
-        elif url.startswith("https://"):
-            url = url[8:]
-        
-        if "/" in url:
-            host, path = url.split("/", 1)
-            path = "/" + path
-        else:
-            host = url
-            path = "/"
-        
-        if ":" in host:
-            host, port = host.split(":")
-            port = int(port)
-        else:
-            port = 80
-        
+        _, host, port, path = parse_url(url)
         return host, path, port
-    
+
+    def _speed_kbps(self, byte_count, duration_ms):
+        # Изчисляване на скоростта в Kbps
+        return round((byte_count * 8) / (duration_ms / 1000.0) / 1024.0, 2)
+
+    def _drain(self, resp):
+        total = 0
+        while True:
+            n = resp.readinto(self._rx_mv)
+            if not n:
+                break
+            total += n
+        return total
+
+    async def _drain_async(self, resp):
+        total = 0
+        while True:
+            n = await resp.readinto_async(self._rx_mv)
+            if not n:
+                break
+            total += n
+        return total
+
     def test_download_speed(self):
         try:
-            host, path, port = self._parse_url(self._test_url)
-            
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self._timeout_s)
-            
             start_time = time.ticks_ms()
-            sock.connect((host, port))
-            
-            request = "GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(path, host)
-            sock.send(request.encode())
-            
-            bytes_received = 0
-            chunk_size = 1024
-            
-            while True:
-                try:
-                    chunk = sock.recv(chunk_size)
-                    if not chunk:
-                        break
-                    bytes_received += len(chunk)
-                except socket.timeout:
-                    break
-                except Exception:
-                    break
-            
+            resp = self._http.get(self._test_url)
+            bytes_received = self._drain(resp)
             end_time = time.ticks_ms()
             duration_ms = time.ticks_diff(end_time, start_time)
-            sock.close()
-            
+
             if bytes_received > 0 and duration_ms > 0:
-                # Изчисляване на скоростта в Kbps
-                speed_kbps = (bytes_received * 8) / (duration_ms / 1000.0) / 1024.0
-                return round(speed_kbps, 2), bytes_received, duration_ms
+                return self._speed_kbps(bytes_received, duration_ms), bytes_received, duration_ms
             else:
                 return None, 0, 0
-                
+
         except Exception as e:
             return None, 0, 0
-    
+
     def test_upload_speed(self, data_size_kb=10):
         try:
-            host, path, port = self._parse_url(self._test_url)
-            
             test_data = b"X" * (data_size_kb * 1024)
             bytes_sent = len(test_data)
-            
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self._timeout_s)
-            
+
             start_time = time.ticks_ms()
-            sock.connect((host, port))
-            
-            content_length = len(test_data)
-            request = "POST {} HTTP/1.1\r\nHost: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
-                path, host, content_length
-            )
-            sock.send(request.encode())
-            sock.send(test_data)
-            
-            try:
-                response = sock.recv(1024)
-            except:
-                pass
-            
+            resp = self._http.request("POST", self._test_url, body=test_data)
+            self._drain(resp)
             end_time = time.ticks_ms()
             duration_ms = time.ticks_diff(end_time, start_time)
-            sock.close()
-            
+
             if bytes_sent > 0 and duration_ms > 0:
-                # Изчисляване на скоростта в Kbps
-                speed_kbps = (bytes_sent * 8) / (duration_ms / 1000.0) / 1024.0
-                return round(speed_kbps, 2), bytes_sent, duration_ms
+                return self._speed_kbps(bytes_sent, duration_ms), bytes_sent, duration_ms
             else:
                 return None, 0, 0
-                
+
         except Exception as e:
             return None, 0, 0
-    
+
     def test_ping(self, host=None):
         try:
             if host is None:
                 host, _, port = self._parse_url(self._test_url)
             else:
                 _, _, port = self._parse_url(self._test_url)
-            
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+            net = self._net or socket
+            addr = net.getaddrinfo(host, port)[0][-1]
+            sock = net.socket(net.AF_INET, net.SOCK_STREAM)
             sock.settimeout(self._timeout_s)
-            
+
             start_time = time.ticks_ms()
-            sock.connect((host, port))
+            sock.connect(addr)
             end_time = time.ticks_ms()
-            
+
             latency = time.ticks_diff(end_time, start_time)
             sock.close()
-            
+
             return latency
-            
+
         except Exception:
             return None
-    
+
     def quick_test(self, include_upload=True):
         result = {
             'ping_ms': None,
@@ -141,18 +114,119 @@ class SpeedTest:
             'bytes_sent': 0,
             'duration_ms': 0
         }
-        
+
         ping = self.test_ping()
         result['ping_ms'] = ping
-        
-        speed, bytes_received, duration = self.test_download_speed()
-        result['download_kbps'] = speed
-        result['bytes_received'] = bytes_received
-        result['duration_ms'] = duration
-        
-        if include_upload:
-            upload_speed, bytes_sent, upload_duration = self.test_upload_speed(data_size_kb=5)
-            result['upload_kbps'] = upload_speed
-            result['bytes_sent'] = bytes_sent
-        
-        return result
\ No newline at end of file
+
+        try:
+            speed, bytes_received, duration = self.test_download_speed()
+            result['download_kbps'] = speed
+            result['bytes_received'] = bytes_received
+            result['duration_ms'] = duration
+
+            if include_upload:
+                upload_speed, bytes_sent, upload_duration = self.test_upload_speed(data_size_kb=5)
+                result['upload_kbps'] = upload_speed
+                result['bytes_sent'] = bytes_sent
+        finally:
+            self._http.close_all()
+
+        return result
+
+    async def test_download_speed_async(self):
+        try:
+            start_time = time.ticks_ms()
+            resp = await self._http.get_async(self._test_url)
+            bytes_received = await self._drain_async(resp)
+            end_time = time.ticks_ms()
+            duration_ms = time.ticks_diff(end_time, start_time)
+
+            if bytes_received > 0 and duration_ms > 0:
+                return self._speed_kbps(bytes_received, duration_ms), bytes_received, duration_ms
+            else:
+                return None, 0, 0
+
+        except Exception as e:
+            return None, 0, 0
+
+    async def test_upload_speed_async(self, data_size_kb=10):
+        try:
+            test_data = b"X" * (data_size_kb * 1024)
+            bytes_sent = len(test_data)
+
+            start_time = time.ticks_ms()
+            resp = await self._http.request_async("POST", self._test_url, body=test_data)
+            await self._drain_async(resp)
+            end_time = time.ticks_ms()
+            duration_ms = time.ticks_diff(end_time, start_time)
+
+            if bytes_sent > 0 and duration_ms > 0:
+                return self._speed_kbps(bytes_sent, duration_ms), bytes_sent, duration_ms
+            else:
+                return None, 0, 0
+
+        except Exception as e:
+            return None, 0, 0
+
+    async def test_ping_async(self, host=None):
+        try:
+            if host is None:
+                host, _, port = self._parse_url(self._test_url)
+            else:
+                _, _, port = self._parse_url(self._test_url)
+
+            if self._net is not None:
+                net = self._net
+                sock = net.socket(net.AF_INET, net.SOCK_STREAM)
+                sock.settimeout(self._timeout_s)
+                # NETOPEN не влиза във времето за отговор
+                await net.open_async()
+                start_time = time.ticks_ms()
+                try:
+                    await sock.connect_async(net.getaddrinfo(host, port)[0][-1])
+                    return time.ticks_diff(time.ticks_ms(), start_time)
+                finally:
+                    sock.close()
+
+            start_time = time.ticks_ms()
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self._timeout_s)
+            end_time = time.ticks_ms()
+
+            latency = time.ticks_diff(end_time, start_time)
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+            return latency
+
+        except Exception:
+            return None
+
+    async def quick_test_async(self, include_upload=True):
+        result = {
+            'ping_ms': None,
+            'download_kbps': None,
+            'upload_kbps': None,
+            'bytes_received': 0,
+            'bytes_sent': 0,
+            'duration_ms': 0
+        }
+
+        result['ping_ms'] = await self.test_ping_async()
+
+        try:
+            speed, bytes_received, duration = await self.test_download_speed_async()
+            result['download_kbps'] = speed
+            result['bytes_received'] = bytes_received
+            result['duration_ms'] = duration
+
+            if include_upload:
+                upload_speed, bytes_sent, upload_duration = await self.test_upload_speed_async(data_size_kb=5)
+                result['upload_kbps'] = upload_speed
+                result['bytes_sent'] = bytes_sent
+        finally:
+            self._http.close_all()
+
+        return result
@@ -0,0 +1,152 @@
+import math
+from array import array
+import config
+
+# Координатите се пазят като цели числа x1e5 (~1.1 m), както при encoded polyline
+_SCALE = 100000
+_METERS_PER_UNIT = 1.11319  # метра на 1e-5 градуса по меридиана
+_WINDOW = 16
+
+
+def zigzag(value):
+    # Малките по модул отрицателни числа стават малки положителни: 0, -1, 1, -2 -> 0, 1, 2, 3
+    return (value << 1) if value >= 0 else ((-value) << 1) - 1
+
+
+def unzigzag(value):
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+
+def _append_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_varint(points, t0):
+    # брой точки, после за всяка точка Δlat, Δlon, Δt като zig-zag varint
+    out = bytearray()
+    _append_varint(out, len(points))
+    last_lat = last_lon = 0
+    last_t = t0
+    for lat, lon, t in points:
+        _append_varint(out, zigzag(lat - last_lat))
+        _append_varint(out, zigzag(lon - last_lon))
+        _append_varint(out, zigzag(t - last_t))
+        last_lat, last_lon, last_t = lat, lon, t
+    return bytes(out)
+
+
+def encode_polyline(points, t0):
+    # Текстов вариант за JSON: същите разлики по 5 бита в ASCII символи (Google encoded polyline + Δt)
+    out = bytearray()
+    last_lat = last_lon = 0
+    last_t = t0
+    for lat, lon, t in points:
+        for value in (lat - last_lat, lon - last_lon, t - last_t):
+            value = zigzag(value)
+            while value >= 0x20:
+                out.append((0x20 | (value & 0x1F)) + 63)
+                value >>= 5
+            out.append(value + 63)
+        last_lat, last_lon, last_t = lat, lon, t
+    return out.decode()
+
+
+class TrackBuffer:
+
+    def __init__(self, tolerance_m=None, max_points=None):
+        self._tolerance_m = tolerance_m or getattr(config, 'TRACK_TOLERANCE_M', 15)
+        self._max = max_points or getattr(config, 'TRACK_MAX_POINTS', 64)
+
+        # Запазени върхове на текущия сегмент
+        self._lat = array('i', [0] * self._max)
+        self._lon = array('i', [0] * self._max)
+        self._t = array('I', [0] * self._max)
+        self.count = 0
+
+        # Прозорец от точките след последния връх (опростяване в реално време - "opening window")
+        self._wlat = array('i', [0] * _WINDOW)
+        self._wlon = array('i', [0] * _WINDOW)
+        self._wt = array('I', [0] * _WINDOW)
+        self._wn = 0
+
+        self._has_anchor = False
+        self._alat = 0
+        self._alon = 0
+        self._kx = _METERS_PER_UNIT
+
+        self.received = 0
+        self.dropped = 0
+
+    def _keep(self, lat, lon, t):
+        if self.count >= self._max:
+            self.dropped += 1
+            return
+        self._lat[self.count] = lat
+        self._lon[self.count] = lon
+        self._t[self.count] = t
+        self.count += 1
+        self._has_anchor = True
+        self._alat = lat
+        self._alon = lon
+        # Мащаб по паралела за текущата ширина - разстоянията се смятат в равнина около котвата
+        self._kx = _METERS_PER_UNIT * math.cos(math.radians(lat / _SCALE))
+
+    def _offset_m(self, lat, lon):
+        return (lon - self._alon) * self._kx, (lat - self._alat) * _METERS_PER_UNIT
+
+    def _within(self, lat, lon):
+        # Всички точки от прозореца са в коридора около отсечката котва -> (lat, lon)
+        ex, ey = self._offset_m(lat, lon)
+        length_sq = ex * ex + ey * ey
+        tolerance_sq = self._tolerance_m * self._tolerance_m
+        for i in range(self._wn):
+            px, py = self._offset_m(self._wlat[i], self._wlon[i])
+            if length_sq > 0:
+                k = (px * ex + py * ey) / length_sq
+                k = 0.0 if k < 0 else (1.0 if k > 1 else k)
+                px -= k * ex
+                py -= k * ey
+            if px * px + py * py > tolerance_sq:
+                return False
+        return True
+
+    def _promote_last(self):
+        # Последната точка от прозореца става връх и нова котва
+        last = self._wn - 1
+        self._keep(self._wlat[last], self._wlon[last], self._wt[last])
+        self._wn = 0
+
+    def add(self, lat, lon, t):
+        if lat is None or lon is None:
+            return
+        self.received += 1
+        ilat = int(round(lat * _SCALE))
+        ilon = int(round(lon * _SCALE))
+        if not self._has_anchor:
+            self._keep(ilat, ilon, t)
+            return
+
+        if self._wn == 0:
+            # Мъртва зона: трептене около последния връх не се записва
+            dx, dy = self._offset_m(ilat, ilon)
+            if dx * dx + dy * dy <= self._tolerance_m * self._tolerance_m:
+                return
+        elif not self._within(ilat, ilon) or self._wn >= _WINDOW:
+            self._promote_last()
+
+        i = self._wn
+        self._wlat[i] = ilat
+        self._wlon[i] = ilon
+        self._wt[i] = t
+        self._wn += 1
+
+    def take(self):
+        # Върховете на сегмента; последната видяна точка винаги се включва
+        if self._wn:
+            self._promote_last()
+        points = [(self._lat[i], self._lon[i], self._t[i]) for i in range(self.count)]
+        self.count = 0
+        return points
@@ -1,13 +1,32 @@
 import time
 import network
+import ujson
+import ubinascii
+import uasyncio as asyncio
 import config
 
+# Състояния на свързването
+WIFI_IDLE = 0
+WIFI_CONNECTING = 1
+WIFI_CONNECTED = 2
+WIFI_FAILED = 3
+WIFI_SCANNING = 4
+
+_STAT_GOT_IP = getattr(network, 'STAT_GOT_IP', 1010)
+_STAT_CONNECTING = getattr(network, 'STAT_CONNECTING', 1001)
+_STAT_IDLE = getattr(network, 'STAT_IDLE', 1000)
+
 
 class WiFiManager:
     
-    def __init__(self, ssid=config.WIFI_SSID, password=config.WIFI_PASSWORD):
-        self._ssid = ssid
-        self._password = password
+    def __init__(self, ssid=None, password=None, networks=None):
+        # Известни мрежи по приоритет; един SSID/парола от аргументите или старата конфигурация
+        if ssid is not None:
+            networks = [(ssid, password)]
+        elif networks is None:
+            networks = getattr(config, 'WIFI_NETWORKS', None) or [(config.WIFI_SSID, config.WIFI_PASSWORD)]
+        self._networks = [(n[0], n[1]) for n in networks]
+        self._ssid, self._password = self._networks[0] if self._networks else (None, None)
         self._wifi = None
         self._connected = False
         self._last_connect_attempt = 0
@@ -17,53 +36,305 @@ class WiFiManager:
         self._last_bytes_sent = 0
         self._last_bytes_received = 0
         
+        # Неблокиращо свързване: begin() стартира опита, step() го придвижва от планировчика
+        self.state = WIFI_IDLE
+        self._fast_timeout_ms = getattr(config, 'WIFI_FAST_JOIN_TIMEOUT_MS', 1500)
+        self._fast = False
+        self._join_ms = 0
+        
+        # Последната точка за достъп - директно свързване без пълно сканиране
+        self._cache_file = getattr(config, 'WIFI_CACHE_FILE', 'wifi_cache.json')
+        self._bssid = None
+        self._channel = None
+        self._load_cache()
+        
+        # Видените известни точки за достъп от последното сканиране, най-добрата първа
+        self._scan = []
+        self._scan_ms = None
+        self._scan_ttl_ms = int(getattr(config, 'WIFI_SCAN_CACHE_S', 600) * 1000)
+        self._priority_db = getattr(config, 'WIFI_PRIORITY_STEP_DB', 6)
+        self._roam_margin_db = getattr(config, 'WIFI_ROAM_MARGIN_DB', 12)
+        
+        self.attempts = 0
+        self.fast_joins = 0
+        self.failures = 0
+        self.scans = 0
+        self.roams = 0
+        # От началото на опита до получен IP; на ESP32 асоциирането не се вижда отделно (status() и
+        # isconnected() се променят едва след DHCP), затова няма отделна метрика за него
+        self.last_ip_ms = None
+        
     def _get_wifi_interface(self):
 
         if self._wifi is None:
             self._wifi = network.WLAN(network.STA_IF)
         return self._wifi
     
-    def connect(self, timeout_s=None):
-
-        if timeout_s is None:
-            timeout_s = self._connect_timeout
-            
+    def _password_for(self, ssid):
+        for known, password in self._networks:
+            if known == ssid:
+                return password
+        return None
+    
+    def _rank(self, ssid):
+        for i in range(len(self._networks)):
+            if self._networks[i][0] == ssid:
+                return i
+        return None
+    
+    def _score(self, ssid, rssi):
+        # По-ниският приоритет струва няколко dB - по-далечна предпочитана мрежа все още печели
+        return rssi - self._rank(ssid) * self._priority_db
+    
+    def _load_cache(self):
+        try:
+            with open(self._cache_file, 'r') as f:
+                cache = ujson.load(f)
+            ssid = cache.get("ssid")
+            if self._rank(ssid) is not None:
+                self._ssid = ssid
+                self._password = self._password_for(ssid)
+                self._bssid = ubinascii.unhexlify(cache["bssid"]) if cache.get("bssid") else None
+                self._channel = cache.get("channel")
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    def _save_cache(self):
+        try:
+            with open(self._cache_file, 'w') as f:
+                ujson.dump({
+                    "ssid": self._ssid,
+                    "bssid": ubinascii.hexlify(self._bssid).decode() if self._bssid else None,
+                    "channel": self._channel
+                }, f)
+        except OSError as e:
+            print("WiFi: Грешка при запис на кеша:", e)
+    
+    def _forget_ap(self):
+        if self._bssid is not None:
+            # Неработещата точка за достъп излиза и от резултатите от сканирането
+            self._scan = [ap for ap in self._scan if ap[1] != self._bssid]
+            self._bssid = None
+            self._channel = None
+            self._save_cache()
+    
+    def scan_age_ms(self):
+        if self._scan_ms is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self._scan_ms)
+    
+    def scan_fresh(self):
+        age = self.scan_age_ms()
+        return age is not None and age < self._scan_ttl_ms
+    
+    def refresh_scan(self):
+        # Сканиране (блокира ~2 s); пазят се само известните мрежи, подредени по оценка
+        wifi = self._get_wifi_interface()
+        if not wifi.active():
+            wifi.active(True)
+        try:
+            results = wifi.scan()
+        except Exception as e:
+            print("WiFi: Грешка при сканиране:", e)
+            return False
+        found = []
+        for entry in results:
+            ssid = entry[0].decode() if isinstance(entry[0], bytes) else entry[0]
+            if self._rank(ssid) is not None:
+                found.append((ssid, bytes(entry[1]), entry[2], entry[3]))
+        found.sort(key=lambda ap: self._score(ap[0], ap[3]), reverse=True)
+        self._scan = found
+        self._scan_ms = time.ticks_ms()
+        self.scans += 1
+        return True
+    
+    def _select(self, ap):
+        self._ssid = ap[0]
+        self._password = self._password_for(ap[0])
+        self._bssid = ap[1]
+        self._channel = ap[2]
+        self._save_cache()
+    
+    def better_ap(self):
+        # По-добра известна точка за достъп от текущата с поне WIFI_ROAM_MARGIN_DB
+        if not self._scan or self._bssid is None or self._roam_margin_db <= 0:
+            return None
+        best = self._scan[0]
+        if best[1] == self._bssid:
+            return None
+        current = None
+        for ap in self._scan:
+            if ap[1] == self._bssid:
+                current = ap
+        rssi = None
+        try:
+            rssi = self._get_wifi_interface().status('rssi')
+        except Exception:
+            pass
+        if rssi is None:
+            if current is None:
+                return None
+            rssi = current[3]
+        if self._score(best[0], best[3]) >= self._score(self._ssid, rssi) + self._roam_margin_db:
+            return best
+        return None
+    
+    def roam(self, ap):
+        # Преминаване към по-силна точка за достъп без пълно сканиране
+        print("WiFi: Преминаване към", ap[0], "(канал {}, {} dBm)".format(ap[2], ap[3]))
+        wifi = self._get_wifi_interface()
+        wifi.disconnect()
+        self._connected = False
+        self.roams += 1
+        self._select(ap)
+        self._start(wifi)
+    
+    def _join(self, wifi, direct=True):
+        # direct=False: обикновено свързване по SSID, запомнената точка за достъп остава в кеша
+        self._fast = direct and self._bssid is not None
+        self._join_ms = time.ticks_ms()
+        if self._fast:
+            print("WiFi: Директно свързване към", self._ssid, "(канал {})".format(self._channel))
+            try:
+                wifi.config(channel=self._channel)
+            except Exception:
+                pass
+            wifi.connect(self._ssid, self._password, bssid=self._bssid)
+        else:
+            print("WiFi: Свързване към", self._ssid, "...")
+            wifi.connect(self._ssid, self._password)
+    
+    def begin(self):
+        # Стартира опит за свързване без изчакване; връща False, ако няма какво да се прави
+        if self.is_connecting():
+            return True
         if not self._ssid or not self._password:
-            print("WiFi: SSID или паролата не са конфигурирани")
+            print("WiFi: Няма конфигурирани мрежи")
+            self.state = WIFI_FAILED
             return False
         
         wifi = self._get_wifi_interface()
-        
         if not wifi.active():
             wifi.active(True)
-            time.sleep(0.5)
-        
         if wifi.isconnected():
             self._connected = True
+            self.state = WIFI_CONNECTED
             return True
         
-        print("WiFi: Свързване към", self._ssid, "...")
-        wifi.connect(self._ssid, self._password)
-        
-        start_time = time.ticks_ms()
-        while time.ticks_diff(time.ticks_ms(), start_time) < (timeout_s * 1000):
-            if wifi.isconnected():
-                self._connected = True
-                ip = wifi.ifconfig()[0]
-                print("WiFi: Свързан! IP:", ip)
+        if self._bssid is None:
+            # Избор от кешираното сканиране; ново сканиране само ако е остаряло или без кандидати.
+            # Сканирането блокира ~2 s, затова е отделна стъпка, която планировчикът пуска след проба
+            if not self._scan or not self.scan_fresh():
+                self.state = WIFI_SCANNING
                 return True
-            time.sleep(0.5)
+            self._select(self._scan[0])
+        self._start(wifi)
+        return True
+    
+    def _start(self, wifi):
+        self.attempts += 1
+        self._last_connect_attempt = time.ticks_ms()
+        self.last_ip_ms = None
+        self._join(wifi)
+        self.state = WIFI_CONNECTING
+    
+    def _has_ip(self, wifi):
+        ifconfig = wifi.ifconfig()
+        return bool(ifconfig) and ifconfig[0] not in (None, "0.0.0.0")
+    
+    def _associated(self, wifi):
+        # RSSI има само след асоцииране с точката за достъп; DHCP може още да тече
+        try:
+            return bool(wifi.status('rssi'))
+        except Exception:
+            return False
+    
+    def needs_scan(self):
+        return self.state == WIFI_SCANNING
+    
+    def step(self):
+        # Един ход; връща True само при преминаване в свързано състояние
+        if self.state == WIFI_SCANNING:
+            # Единствената блокираща стъпка - само тя сканира
+            self.refresh_scan()
+            if self._scan:
+                self._select(self._scan[0])
+            self._start(self._get_wifi_interface())
+            return False
+        if self.state != WIFI_CONNECTING:
+            return False
         
-        self._connected = False
-        print("WiFi: Неуспешно свързване (timeout)")
+        wifi = self._get_wifi_interface()
+        elapsed = time.ticks_diff(time.ticks_ms(), self._last_connect_attempt)
+        status = wifi.status()
+        
+        if status == _STAT_GOT_IP and self._has_ip(wifi):
+            self.last_ip_ms = elapsed
+            if self._fast:
+                self.fast_joins += 1
+            self._connected = True
+            self.state = WIFI_CONNECTED
+            print("WiFi: Свързан! IP:", wifi.ifconfig()[0], "за {} ms".format(self.last_ip_ms))
+            return True
+        
+        failed = status not in (_STAT_CONNECTING, _STAT_IDLE, _STAT_GOT_IP)
+        if self._fast and failed:
+            # Грешка от точката за достъп (няма я, грешна парола...) - следващата от кешираното сканиране
+            print("WiFi: Директното свързване неуспешно (статус {})".format(status))
+            wifi.disconnect()
+            self._forget_ap()
+            if self._scan:
+                self._select(self._scan[0])
+            self._join(wifi)
+            return False
+        if self._fast and time.ticks_diff(time.ticks_ms(), self._join_ms) >= self._fast_timeout_ms and not self._associated(wifi):
+            # Няма асоцииране в срока: обикновено свързване; след асоцииране DHCP има целия WIFI_CONNECT_TIMEOUT_S.
+            # Само закъснението не е доказателство за сменена точка за достъп - кешът се пази
+            print("WiFi: Директното свързване не отговаря - обикновено свързване")
+            wifi.disconnect()
+            self._join(wifi, direct=False)
+            return False
+        
+        if failed or elapsed >= self._connect_timeout * 1000:
+            wifi.disconnect()
+            self._connected = False
+            self.failures += 1
+            self.state = WIFI_FAILED
+            print("WiFi: Неуспешно свързване (статус {})".format(status))
         return False
     
+    def is_connecting(self):
+        return self.state == WIFI_CONNECTING or self.state == WIFI_SCANNING
+    
+    def connect(self, timeout_s=None):
+
+        if timeout_s is not None:
+            self._connect_timeout = timeout_s
+        if not self.begin():
+            return False
+        while self.is_connecting():
+            time.sleep_ms(50)
+            self.step()
+        return self.state == WIFI_CONNECTED
+    
+    async def connect_async(self, timeout_s=None):
+
+        if timeout_s is not None:
+            self._connect_timeout = timeout_s
+        if not self.begin():
+            return False
+        while self.is_connecting():
+            await asyncio.sleep_ms(50)
+            self.step()
+        return self.state == WIFI_CONNECTED
+    
     def disconnect(self):
         wifi = self._get_wifi_interface()
         if wifi.active():
             wifi.disconnect()
             wifi.active(False)
             self._connected = False
+            self.state = WIFI_IDLE
             print("WiFi: Прекъснато")
     
     def is_connected(self):
@@ -89,13 +360,11 @@ class WiFiManager:
         ifconfig = wifi.ifconfig()
         ip = ifconfig[0] if ifconfig else None
         
+        ssid = self._ssid
         try:
-            status = wifi.status()
-            rssi = None
-            ssid = self._ssid
+            rssi = wifi.status('rssi')
         except Exception:
             rssi = None
-            ssid = self._ssid
         
         return True, ip, rssi, ssid
     
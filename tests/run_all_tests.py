@@ -8,6 +8,8 @@ from test_sensors import TestSensors
 from test_communication import TestCommunication
 from test_ota import TestOTA
 from test_speed_test import TestSpeedTest
+from test_telemetry import TestTelemetry
+from test_sim_transport import TestSIMTransport
 
 
 def main():
@@ -19,7 +21,7 @@ def main():
     total_failed = 0
     all_success = True
     
-    print("\n[1/4] Тестове за сензори...\n")
+    print("\n[1/6] Тестове за сензори...\n")
     sensor_tester = TestSensors()
     sensor_success = sensor_tester.run_all()
     total_passed += sensor_tester.tests_passed
@@ -29,7 +31,7 @@ def main():
     
     time.sleep(1)
     
-    print("\n[2/4] Тестове за комуникация...\n")
+    print("\n[2/6] Тестове за комуникация...\n")
     comm_tester = TestCommunication()
     comm_success = comm_tester.run_all()
     total_passed += comm_tester.tests_passed
@@ -39,7 +41,7 @@ def main():
     
     time.sleep(1)
     
-    print("\n[3/4] Тестове за OTA Updater...\n")
+    print("\n[3/6] Тестове за OTA Updater...\n")
     ota_tester = TestOTA()
     ota_success = ota_tester.run_all()
     total_passed += ota_tester.tests_passed
@@ -49,7 +51,7 @@ def main():
     
     time.sleep(1)
     
-    print("\n[4/4] Тестове за Speed Test...\n")
+    print("\n[4/6] Тестове за Speed Test...\n")
     speed_tester = TestSpeedTest()
     speed_success = speed_tester.run_all()
     total_passed += speed_tester.tests_passed
@@ -57,6 +59,26 @@ def main():
     if not speed_success:
         all_success = False
     
+    time.sleep(1)
+    
+    print("\n[5/6] Тестове за телеметрия...\n")
+    telemetry_tester = TestTelemetry()
+    telemetry_success = telemetry_tester.run_all()
+    total_passed += telemetry_tester.tests_passed
+    total_failed += telemetry_tester.tests_failed
+    if not telemetry_success:
+        all_success = False
+    
+    time.sleep(1)
+    
+    print("\n[6/6] Тестове за SIM транспорт...\n")
+    sim_transport_tester = TestSIMTransport()
+    sim_transport_success = sim_transport_tester.run_all()
+    total_passed += sim_transport_tester.tests_passed
+    total_failed += sim_transport_tester.tests_failed
+    if not sim_transport_success:
+        all_success = False
+    
     print("\n" + "=" * 60)
     print("ОБЩИ РЕЗУЛТАТИ")
     print("=" * 60)
@@ -6,6 +6,12 @@ if "src" not in sys.path:
 
 from sim7600 import SIM7600
 from wifi_manager import WiFiManager
+from offline_queue import OfflineQueue
+from mqtt_client import MQTTClient
+from at_engine import ATEngine
+from nmea import NMEAParser
+from gps_policy import GPSPolicy
+from link_manager import LinkManager, LINK_SIM, LINK_WIFI, csq_to_dbm
 
 
 class TestCommunication:
@@ -105,6 +111,846 @@ class TestCommunication:
             self._test_result("WiFi Manager Трафик статистика", False, str(e))
             return False
     
+    def test_wifi_fast_join(self):
+        class FakeWLAN:
+            # Асоцииране след 2 хода, IP след още 1; при сменена точка за достъп директното свързване не асоциира
+            def __init__(self):
+                self.scans = 0
+                self.joins = []
+                self.ap = b"\xaa\xbb\xcc\x00\x00\x01"
+                self.assoc_steps = 2
+                self.dhcp_steps = 3
+                self._active = False
+                self._steps = -1
+                self._bssid = None
+            
+            def active(self, value=None):
+                if value is None:
+                    return self._active
+                self._active = value
+            
+            def scan(self):
+                self.scans += 1
+                return [(b"depot", self.ap, 6, -55, 3, False), (b"other", b"\x01" * 6, 1, -40, 3, False)]
+            
+            def config(self, **kwargs):
+                pass
+            
+            def connect(self, ssid, password, bssid=None):
+                self.joins.append(bssid)
+                self._bssid = bssid
+                self._steps = 0
+            
+            def disconnect(self):
+                self._steps = -1
+            
+            def _ok(self):
+                return self._steps >= self.assoc_steps and (self._bssid is None or self._bssid == self.ap)
+            
+            def _ip(self):
+                return self._ok() and self._steps >= self.dhcp_steps
+            
+            def isconnected(self):
+                return self._ip()
+            
+            def status(self, param=None):
+                if param == 'rssi':
+                    if not self._ok():
+                        raise OSError("not connected")
+                    return -55
+                if self._steps >= 0:
+                    self._steps += 1
+                return 1010 if self._ip() else 1001
+            
+            def ifconfig(self):
+                return ("10.0.0.7", "255.255.255.0", "10.0.0.1", "10.0.0.1") if self._ip() else ("0.0.0.0",) * 4
+        
+        def run(wifi):
+            steps = 0
+            while wifi.is_connecting() and steps < 50:
+                steps += 1
+                if wifi.step():
+                    return steps
+            return None
+        
+        import uos
+        cache = "test_wifi_cache.json"
+        try:
+            wifi = WiFiManager("depot", "secret")
+            wifi._cache_file = cache
+            wlan = FakeWLAN()
+            wifi._wifi = wlan
+            
+            wifi.begin()
+            cold = run(wifi)
+            cold_ok = cold is not None and wlan.scans == 1 and wlan.joins == [wlan.ap] and wifi.last_ip_ms is not None
+            wifi.disconnect()
+            
+            # Нов обект (след рестарт): BSSID от кеша, без сканиране
+            wifi = WiFiManager("depot", "secret")
+            wifi._cache_file = cache
+            wifi._load_cache()
+            wifi._wifi = wlan
+            wifi.begin()
+            fast = run(wifi)
+            fast_ok = fast is not None and wlan.scans == 1 and wifi.fast_joins == 1
+            wifi.disconnect()
+            
+            # Бавен DHCP след асоцииране: срокът за директно свързване не го прекъсва
+            old_ap = wlan.ap
+            wlan.assoc_steps, wlan.dhcp_steps = 1, 8
+            wifi._fast_timeout_ms = 0
+            wifi.begin()
+            slow = run(wifi)
+            slow_ok = slow is not None and wifi.fast_joins == 2 and wlan.joins[-1] == old_ap and wifi._bssid == old_ap
+            wifi.disconnect()
+            wlan.assoc_steps, wlan.dhcp_steps = 2, 3
+            
+            # Точката за достъп е сменена: без асоцииране в срока се минава към обикновено свързване, кешът остава
+            wlan.ap = b"\xaa\xbb\xcc\x00\x00\x02"
+            wifi.begin()
+            fallback = run(wifi)
+            fallback_ok = fallback is not None and wlan.joins[-1] is None and wifi._bssid == old_ap
+            
+            ok = cold_ok and fast_ok and slow_ok and fallback_ok
+            if ok:
+                self._test_result("WiFi Директно свързване", True, "IP за {} ms".format(wifi.last_ip_ms))
+                return True
+            else:
+                self._test_result("WiFi Директно свързване", False, "{} {} {} {} {}".format(cold_ok, fast_ok, slow_ok, fallback_ok, wlan.joins))
+                return False
+        except Exception as e:
+            self._test_result("WiFi Директно свързване", False, str(e))
+            return False
+        finally:
+            try:
+                uos.remove(cache)
+            except OSError:
+                pass
+    
+    def test_wifi_roaming(self):
+        class FakeWLAN:
+            # Точки за достъп: BSSID -> (SSID, канал, RSSI); свързване след 2 хода, ако BSSID е в обхват
+            def __init__(self, aps):
+                self.aps = aps
+                self.scans = 0
+                self.joins = []
+                self._active = False
+                self._steps = -1
+                self._bssid = None
+            
+            def active(self, value=None):
+                if value is None:
+                    return self._active
+                self._active = value
+            
+            def scan(self):
+                self.scans += 1
+                return [(ap[0].encode(), bssid, ap[1], ap[2], 3, False) for bssid, ap in self.aps.items()]
+            
+            def config(self, **kwargs):
+                pass
+            
+            def connect(self, ssid, password, bssid=None):
+                self.joins.append(bssid)
+                self._bssid = bssid
+                if bssid is None:
+                    for known, ap in self.aps.items():
+                        if ap[0] == ssid:
+                            self._bssid = known
+                self._steps = 0
+            
+            def disconnect(self):
+                self._steps = -1
+            
+            def _ok(self):
+                return self._steps >= 2 and self._bssid in self.aps
+            
+            def isconnected(self):
+                return self._ok()
+            
+            def status(self, param=None):
+                if param == 'rssi':
+                    return self.aps[self._bssid][2]
+                if self._steps >= 0:
+                    self._steps += 1
+                if self._bssid not in self.aps:
+                    return 201  # няма такава точка за достъп
+                return 1010 if self._ok() else 1001
+            
+            def ifconfig(self):
+                return ("10.0.0.9", "255.255.255.0", "10.0.0.1", "10.0.0.1") if self._ok() else ("0.0.0.0",) * 4
+        
+        def run(wifi):
+            steps = 0
+            while wifi.is_connecting() and steps < 50:
+                steps += 1
+                if wifi.step():
+                    return True
+            return False
+        
+        import uos
+        cache = "test_wifi_roam.json"
+        a1 = b"\xa1" * 6
+        a2 = b"\xa2" * 6
+        b1 = b"\xb1" * 6
+        try:
+            wlan = FakeWLAN({
+                a1: ("depot_a", 1, -70),
+                b1: ("depot_b", 6, -60),
+                b"\xee" * 6: ("neighbour", 11, -30)
+            })
+            wifi = WiFiManager(networks=[("depot_a", "pass_a"), ("depot_b", "pass_b")])
+            wifi._cache_file = cache
+            wifi._wifi = wlan
+            
+            # begin() не сканира - сканирането е отделна стъпка
+            wifi.begin()
+            deferred = wifi.needs_scan() and wlan.scans == 0 and wifi.is_connecting()
+            
+            # Най-силната известна мрежа след наказанието за приоритет (-60 - 6 > -70)
+            chosen = run(wifi) and wlan.joins == [b1] and wifi.get_status()[3] == "depot_b"
+            
+            # Точката за достъп изчезва: следващата от кеша на сканирането, без ново сканиране
+            wifi.disconnect()
+            del wlan.aps[b1]
+            wifi.begin()
+            cached = run(wifi) and wlan.joins[-1] == a1 and wlan.scans == 1 and wifi._password == "pass_a"
+            
+            # Планирано сканиране вижда по-силна точка за достъп -> преминаване
+            wlan.aps[a2] = ("depot_a", 6, -45)
+            wifi.refresh_scan()
+            ap = wifi.better_ap()
+            if ap is not None:
+                wifi.roam(ap)
+            roamed = ap is not None and run(wifi) and wlan.joins[-1] == a2 and wifi.roams == 1 and wifi.better_ap() is None
+            
+            # Остарял кеш -> ново сканиране при следващото свързване
+            wifi.disconnect()
+            wifi._forget_ap()
+            wifi._scan_ms = time.ticks_add(time.ticks_ms(), -700000)
+            wifi.begin()
+            rescanned = run(wifi) and wlan.scans == 3 and wlan.joins[-1] == a2
+            
+            ok = deferred and chosen and cached and roamed and rescanned
+            if ok:
+                self._test_result("WiFi Роуминг", True, "Сканирания: {}, преминавания: {}".format(wifi.scans, wifi.roams))
+                return True
+            else:
+                self._test_result("WiFi Роуминг", False, "{} {} {} {} {} {}".format(deferred, chosen, cached, roamed, rescanned, wlan.joins))
+                return False
+        except Exception as e:
+            self._test_result("WiFi Роуминг", False, str(e))
+            return False
+        finally:
+            try:
+                uos.remove(cache)
+            except OSError:
+                pass
+    
+    def _remove_queue_dir(self, directory):
+        import uos
+        try:
+            for name in uos.listdir(directory):
+                uos.remove(directory + "/" + name)
+            uos.rmdir(directory)
+        except OSError:
+            pass
+    
+    def test_offline_queue(self):
+        directory = "test_mqtt_queue"
+        self._remove_queue_dir(directory)
+        try:
+            queue = OfflineQueue(directory, segment_size=128, max_bytes=4096)
+            for i in range(10):
+                queue.put("iot/test", "msg{}".format(i))
+            
+            # Нова инстанция симулира рестарт на устройството
+            queue = OfflineQueue(directory, segment_size=128, max_bytes=4096)
+            received = []
+            
+            def send(topic, payload):
+                if len(received) == 4:
+                    return False
+                received.append(payload)
+                return True
+            
+            first = queue.drain(send, 100)
+            received_first = list(received)
+            received.clear()
+            second = queue.drain(lambda topic, payload: received.append(payload) or True, 100)
+            
+            expected = [("msg{}".format(i)).encode() for i in range(10)]
+            if first == 4 and second == 6 and received_first + received == expected and queue.is_empty():
+                self._test_result("Офлайн опашка", True, "Изпратени {} + {} съобщения".format(first, second))
+                return True
+            else:
+                self._test_result("Офлайн опашка", False, "{} + {}".format(first, second))
+                return False
+        except Exception as e:
+            self._test_result("Офлайн опашка", False, str(e))
+            return False
+        finally:
+            self._remove_queue_dir(directory)
+    
+    def test_mqtt_inflight_window(self):
+        class FakeSocket:
+            def __init__(self):
+                self.sent = []
+            
+            def send(self, data):
+                self.sent.append(bytes(data))
+            
+            def close(self):
+                pass
+        
+        try:
+            client = MQTTClient(client_id="test", server="localhost")
+            client._sock = FakeSocket()
+            client._connected = True
+            
+            ids = []
+            for i in range(3):
+                client.publish("iot/test", "msg{}".format(i), qos=1)
+                ids.append(client._inflight_ids[client._find_inflight(client._msg_id - 1)])
+            
+            # PUBACK за второто съобщение освобождава само неговото място
+            client._handle_packet(0x40, bytes([ids[1] >> 8, ids[1] & 0xFF]))
+            acked_ok = client.inflight_count() == 2 and client._find_inflight(ids[1]) < 0
+            
+            client._retransmit(client._find_inflight(ids[0]))
+            dup_ok = (client._sock.sent[-1][0] & 0x08) != 0
+            
+            if acked_ok and dup_ok and len(set(ids)) == 3:
+                self._test_result("MQTT QoS 1 прозорец", True, "Непотвърдени: {}".format(client.inflight_count()))
+                return True
+            else:
+                self._test_result("MQTT QoS 1 прозорец", False, "ack={} dup={}".format(acked_ok, dup_ok))
+                return False
+        except Exception as e:
+            self._test_result("MQTT QoS 1 прозорец", False, str(e))
+            return False
+    
+    def test_mqtt_async_wait(self):
+        class FakeSocket:
+            def __init__(self):
+                self.sent = []
+            
+            def send(self, data):
+                self.sent.append(bytes(data))
+            
+            def close(self):
+                pass
+        
+        import uasyncio as asyncio
+        try:
+            client = MQTTClient(client_id="test", server="localhost")
+            client._sock = FakeSocket()
+            client._connected = True
+            # Прозорецът е пълен за данните: последното място е запазено за аларми
+            for i in range(client._window - 1):
+                client.publish("iot/test", "msg{}".format(i), qos=1)
+            first = client._inflight_ids[0]
+            ticks = []
+            
+            # Докато прозорецът е пълен, другите задачи продължават; PUBACK идва след ~60 ms
+            async def other():
+                for _ in range(6):
+                    ticks.append(time.ticks_ms())
+                    await asyncio.sleep_ms(10)
+                client._handle_packet(0x40, bytes([first >> 8, first & 0xFF]))
+            
+            async def scenario():
+                task = asyncio.create_task(other())
+                sent = await client.publish_async("iot/test", "late", qos=1)
+                await task
+                flushed = await client.flush_async(50)
+                return sent, flushed
+            
+            sent, flushed = asyncio.run(scenario())
+            asyncio.new_event_loop()
+            
+            ok = sent and not flushed and len(ticks) == 6 and client.inflight_count() == client._window - 1
+            if ok:
+                self._test_result("MQTT Асинхронно изчакване", True, "Задачи по време на изчакването: {}".format(len(ticks)))
+                return True
+            else:
+                self._test_result("MQTT Асинхронно изчакване", False, "{} {} {}".format(sent, flushed, len(ticks)))
+                return False
+        except Exception as e:
+            self._test_result("MQTT Асинхронно изчакване", False, str(e))
+            return False
+    
+    def test_mqtt_priority_ack(self):
+        class FakeSocket:
+            def send(self, data):
+                pass
+            
+            def close(self):
+                pass
+        
+        import uasyncio as asyncio
+        try:
+            client = MQTTClient(client_id="test", server="localhost")
+            client._sock = FakeSocket()
+            client._connected = True
+            for i in range(client._window - 1):
+                client.publish("iot/test", "msg{}".format(i), qos=1)
+            
+            async def ack(msg_id, delay_ms):
+                await asyncio.sleep_ms(delay_ms)
+                client._handle_packet(0x40, bytes([msg_id >> 8, msg_id & 0xFF]))
+            
+            async def scenario():
+                # Данните нямат свободно място; алармата заема запазеното веднага
+                data_free = client._has_slot()
+                start = time.ticks_ms()
+                alarm_sent = await client.publish_async("iot/test/alarm", "alarm", qos=1, priority=True)
+                sent_ms = time.ticks_diff(time.ticks_ms(), start)
+                alarm_id = client.last_msg_id
+                # PUBACK за данните идва първи и не бива да се брои за алармата
+                asyncio.create_task(ack(client._inflight_ids[0], 10))
+                asyncio.create_task(ack(alarm_id, 60))
+                start = time.ticks_ms()
+                acked = await client.wait_ack_async(alarm_id, 1000)
+                waited_ms = time.ticks_diff(time.ticks_ms(), start)
+                return data_free, alarm_sent, sent_ms, acked, waited_ms
+            
+            data_free, alarm_sent, sent_ms, acked, waited_ms = asyncio.run(scenario())
+            asyncio.new_event_loop()
+            
+            ok = not data_free and alarm_sent and sent_ms < 50 and acked and 50 <= waited_ms < 500
+            if ok:
+                self._test_result("MQTT Приоритет на алармите", True, "PUBACK на алармата след {} ms".format(waited_ms))
+                return True
+            else:
+                self._test_result("MQTT Приоритет на алармите", False, "{} {} {} {} {}".format(data_free, alarm_sent, sent_ms, acked, waited_ms))
+                return False
+        except Exception as e:
+            self._test_result("MQTT Приоритет на алармите", False, str(e))
+            return False
+    
+    def test_mqtt_async_reconnect(self):
+        class FakeSocket:
+            def send(self, data):
+                pass
+            
+            def close(self):
+                pass
+        
+        import uasyncio as asyncio
+        try:
+            client = MQTTClient(client_id="test", server="localhost")
+            client._sock = FakeSocket()
+            client._connected = True
+            for i in range(client._window):
+                client.publish("iot/test", "msg{}".format(i), qos=1)
+            calls = []
+            
+            def blocking_connect(clean_session=True):
+                calls.append("connect")
+                return False
+            
+            async def fake_connect_async(clean_session=True):
+                calls.append("connect_async")
+                client._connected = True
+                return True
+            
+            client.connect = blocking_connect
+            client.connect_async = fake_connect_async
+            
+            # Връзката пада, докато publish_async чака място; сесията пази прозореца, брокерът потвърждава едно
+            async def drop():
+                await asyncio.sleep_ms(30)
+                client._connected = False
+                first = client._inflight_ids[0]
+                client._handle_packet(0x40, bytes([first >> 8, first & 0xFF]))
+            
+            async def scenario():
+                task = asyncio.create_task(drop())
+                sent = await client.publish_async("iot/test", "late", qos=1)
+                await task
+                return sent
+            
+            sent = asyncio.run(scenario())
+            asyncio.new_event_loop()
+            
+            if sent and calls == ["connect_async"]:
+                self._test_result("MQTT Асинхронно преподключване", True, "Без блокиращо connect()")
+                return True
+            else:
+                self._test_result("MQTT Асинхронно преподключване", False, "{} {}".format(sent, calls))
+                return False
+        except Exception as e:
+            self._test_result("MQTT Асинхронно преподключване", False, str(e))
+            return False
+    
+    def test_mqtt_packet_decoder(self):
+        class ChunkSocket:
+            # Връща данните на малки парчета, както при разделени TCP сегменти
+            def __init__(self, data, chunk):
+                self.data = data
+                self.chunk = chunk
+                self.sent = []
+            
+            def recv(self, n):
+                n = min(n, self.chunk)
+                part = self.data[:n]
+                self.data = self.data[n:]
+                return part
+            
+            def send(self, data):
+                self.sent.append(bytes(data))
+        
+        try:
+            payload = b"x" * 200
+            body = b"\x00\x07cmd/led\x00\x05" + payload
+            stream = (
+                b"\x40\x02\x00\x01" +
+                b"\xd0\x00" +
+                b"\x32" + bytes([(len(body) & 0x7F) | 0x80, len(body) >> 7]) + body +
+                b"\x90\x03\x00\x02\x01"
+            )
+            client = MQTTClient(client_id="test", server="localhost")
+            client._sock = ChunkSocket(stream, 3)
+            client._connected = True
+            
+            received = []
+            client.set_callback(lambda topic, msg: received.append((topic, msg)))
+            while client._sock.data:
+                client._read_available()
+            
+            ok = (
+                client._pingresp and
+                received == [("cmd/led", payload)] and
+                client._sock.sent == [b"\x40\x02\x00\x05"] and
+                client._suback_id == 2 and client._suback_qos == 1 and
+                client._rx_len == 0
+            )
+            if ok:
+                self._test_result("MQTT декодер на пакети", True, "Разделени сегменти по 3 байта")
+                return True
+            else:
+                self._test_result("MQTT декодер на пакети", False, "Получени: {}".format(len(received)))
+                return False
+        except Exception as e:
+            self._test_result("MQTT декодер на пакети", False, str(e))
+            return False
+    
+    def test_mqtt_publish_encoding(self):
+        class FakeSocket:
+            def __init__(self):
+                self.sent = []
+            
+            def send(self, data):
+                self.sent.append(bytes(data))
+        
+        def expected(topic, payload, msg_id):
+            body = bytes([0, len(topic)]) + topic + bytes([msg_id >> 8, msg_id & 0xFF]) + payload
+            length = len(body)
+            header = bytearray([0x32])
+            while True:
+                b = length & 0x7F
+                length >>= 7
+                header.append(b | 0x80 if length else b)
+                if not length:
+                    return bytes(header) + body
+        
+        try:
+            client = MQTTClient(client_id="test", server="localhost")
+            client._sock = FakeSocket()
+            client._connected = True
+            
+            ok = True
+            for size in (10, 300, 3000):
+                payload = b"p" * size
+                msg_id = client._msg_id
+                client.publish("iot/sensors/dev", payload, qos=1)
+                wire = b"".join(client._sock.sent)
+                client._sock.sent = []
+                ok = ok and wire == expected(b"iot/sensors/dev", payload, msg_id)
+            
+            if ok and len(client._topic_cache) == 1:
+                self._test_result("MQTT кодиране на PUBLISH", True, "Кеширани topic-и: 1")
+                return True
+            else:
+                self._test_result("MQTT кодиране на PUBLISH", False, "Разлика в пакетите")
+                return False
+        except Exception as e:
+            self._test_result("MQTT кодиране на PUBLISH", False, str(e))
+            return False
+    
+    def test_at_engine_lines(self):
+        class FakeUART:
+            def __init__(self):
+                self.written = b""
+            
+            def any(self):
+                return 0
+            
+            def write(self, data):
+                self.written += data
+        
+        def feed(engine, data):
+            # Данните пристигат на части, както от UART
+            for i in range(0, len(data), 7):
+                chunk = data[i:i + 7]
+                engine._mv[engine._len:engine._len + len(chunk)] = chunk
+                engine._received(len(chunk))
+        
+        try:
+            engine = ATEngine(FakeUART(), 64)
+            regs = []
+            engine.on_urc("+CREG:", lambda line: regs.append(line))
+            
+            engine._begin("AT+CGPSINFO")
+            # "OK" в данните не бива да прекъсва отговора; URC по средата се пренасочва
+            feed(engine, b"AT+CGPSINFO\r\n+CREG: 5\r\n+CGPSINFO: 4240.1,N,02319.5,E,OK,,\r\n\r\nO")
+            partial = engine._final is None
+            feed(engine, b"K\r\n")
+            resp = engine._finish()
+            
+            feed(engine, b"+CREG: 1\r\nRING\r\n")
+            ok = (
+                partial and
+                resp == b"+CGPSINFO: 4240.1,N,02319.5,E,OK,,\r\nOK" and
+                regs == [b"+CREG: 5", b"+CREG: 1"] and
+                engine.urc_unhandled == 1 and engine._len == 0
+            )
+            if ok:
+                self._test_result("AT Редове и URC", True, "URC: {}".format(len(regs)))
+                return True
+            else:
+                self._test_result("AT Редове и URC", False, str(resp))
+                return False
+        except Exception as e:
+            self._test_result("AT Редове и URC", False, str(e))
+            return False
+    
+    def test_at_engine_async_interleave(self):
+        class FakeUART:
+            def __init__(self):
+                self.rx = b""
+                self.written = b""
+            
+            def any(self):
+                return len(self.rx)
+            
+            def readinto(self, buf):
+                n = min(len(buf), len(self.rx))
+                buf[:n] = self.rx[:n]
+                self.rx = self.rx[n:]
+                return n
+            
+            def write(self, data):
+                self.written += data
+        
+        import uasyncio as asyncio
+        try:
+            uart = FakeUART()
+            # Заместителят не е поток за asyncio - командата проверява any() на интервали
+            engine = ATEngine(uart, 64, stream=False)
+            fixes = []
+            engine.on_urc("+CGPSINFO:", lambda line: fixes.append(line))
+            
+            async def scenario():
+                task = asyncio.create_task(engine.command_async("AT+CSQ", 1000))
+                await asyncio.sleep_ms(5)
+                
+                # Синхронен poll() (GPS задачата) прочита част от отговора, докато командата чака
+                uart.rx += b"AT+CSQ\r\n+CSQ: 2"
+                engine.poll()
+                uart.rx += b"0,99\r\n+CGPSINFO: 4240.1,N\r\n"
+                await asyncio.sleep_ms(10)
+                
+                # poll() прочита и финалния "OK" - командата не бива да чака до изтичане на времето
+                uart.rx += b"\r\nOK\r\n"
+                engine.poll()
+                t0 = time.ticks_ms()
+                resp = await task
+                return resp, time.ticks_diff(time.ticks_ms(), t0)
+            
+            resp, waited = asyncio.run(scenario())
+            asyncio.new_event_loop()
+            
+            ok = (
+                resp == b"+CSQ: 20,99\r\nOK" and fixes == [b"+CGPSINFO: 4240.1,N"] and
+                waited < 200 and engine._len == 0 and not engine.is_busy()
+            )
+            if ok:
+                self._test_result("AT Асинхронна команда и poll()", True, "Отговор след {} ms".format(waited))
+                return True
+            else:
+                self._test_result("AT Асинхронна команда и poll()", False, "{} {} {}".format(resp, fixes, waited))
+                return False
+        except Exception as e:
+            self._test_result("AT Асинхронна команда и poll()", False, str(e))
+            return False
+    
+    def test_sim7600_status_cache(self):
+        try:
+            sim = SIM7600()
+            now = time.ticks_ms()
+            sim._present, sim._present_ms = True, now
+            sim._rssi, sim._rssi_ms = 20, now
+            sim._engine.last_rx_ms = now
+            cached = sim._status_command(False)
+            forced = sim._status_command(True)
+            
+            # Само изтеклото поле се обновява
+            sim._rssi_ms = time.ticks_add(now, -60000)
+            rssi_only = sim._status_command(False)
+            
+            sim._engine._on_line(b"+CSQ: 25,99")
+            sim._engine._on_line(b"+SIMCARD: NOT AVAILABLE")
+            removed = sim._present is False and sim.status_changed
+            # Съобщената промяна налага пълно обновяване веднъж и се изчиства
+            after_urc = sim._status_command(sim._take_changed(False))
+            cleared = not sim.status_changed
+            
+            # Регистрацията (отговор на AT+CREG? и URC) участва в статуса
+            sim._engine._on_line(b"+CREG: 1,1")
+            registered = sim._registered()
+            sim._engine._on_line(b"+CREG: 3")
+            ok = (
+                cached is None and
+                forced == "AT+CPIN?;+CSQ" and
+                rssi_only == "AT+CSQ" and
+                sim._rssi == 25 and removed and
+                after_urc == "AT+CPIN?;+CSQ" and cleared and
+                registered and not sim._registered() and sim.status_changed
+            )
+            if ok:
+                self._test_result("SIM7600 Кеширан статус", True, "Без AT команди при валиден кеш")
+                return True
+            else:
+                self._test_result("SIM7600 Кеширан статус", False, "{} {} {} {} {} {}".format(cached, forced, rssi_only, removed, after_urc, registered))
+                return False
+        except Exception as e:
+            self._test_result("SIM7600 Кеширан статус", False, str(e))
+            return False
+    
+    def test_nmea_parser(self):
+        def sentence(body):
+            checksum = 0
+            for c in body:
+                checksum ^= c
+            return b"$" + body + b"*%02X" % checksum
+        
+        try:
+            parser = NMEAParser()
+            rmc = sentence(b"GNRMC,120000.00,A,4241.2000,N,02319.5000,E,10.0,90.5,181026,,,A")
+            gga = sentence(b"GPGGA,120001.00,4241.2000,N,02319.5000,E,1,08,0.9,550.0,M,,,,")
+            bad = rmc[:-2] + b"00"
+            void = sentence(b"GNRMC,120002.00,V,,,,,,,181026,,,N")
+            
+            parser.feed(rmc)
+            parser.feed(gga)
+            rejected = not parser.feed(bad)
+            ok_fix = (
+                parser.position() == (42.686667, 23.325) and parser.valid and
+                parser.speed_kmh == 18.5 and parser.course == 90.5 and
+                parser.hdop == 0.9 and parser.satellites == 8 and
+                parser.fix_age_ms() is not None
+            )
+            parser.feed(void)
+            
+            # В потоков режим позицията идва като URC и се чете от кеша без AT команда
+            sim = SIM7600()
+            sim._gps_mode = "nmea"
+            sim._engine._on_line(gga)
+            sent = sim._engine.bytes_sent
+            lat, lon = sim.gps_read()
+            ok = (
+                ok_fix and rejected and parser.checksum_errors == 1 and
+                not parser.valid and parser.lat == 42.686667 and
+                (lat, lon) == (42.686667, 23.325) and sim._engine.bytes_sent == sent
+            )
+            if ok:
+                self._test_result("NMEA Парсер", True, "RMC/GGA, {} изречения".format(parser.sentences))
+                return True
+            else:
+                self._test_result("NMEA Парсер", False, "{} {} {}".format(parser.position(), parser.speed_kmh, (lat, lon)))
+                return False
+        except Exception as e:
+            self._test_result("NMEA Парсер", False, str(e))
+            return False
+    
+    def test_gps_policy(self):
+        try:
+            policy = GPSPolicy(fast_s=5, slow_s=300, radius_m=25, stationary_fixes=3, max_age_s=900)
+            first_due = policy.due()
+            
+            # Три фикса в радиус ~10 m -> неподвижна станция, бавно четене
+            policy.update(42.686667, 23.325)
+            policy.update(42.686700, 23.325050)
+            changed = policy.update(42.686640, 23.324960)
+            slow = policy.interval_ms() == 300000 and policy.stationary and not policy.due()
+            
+            # Загубен фикс: последният добър се пази; твърде стар фикс връща честото четене
+            policy.update(None, None)
+            kept = (policy.lat, policy.lon) == (42.686640, 23.324960) and policy.stationary
+            policy.fix_ms = time.ticks_add(time.ticks_ms(), -901000)
+            stale_fast = policy.interval_ms() == 5000
+            policy.fix_ms = time.ticks_ms()
+            
+            # Преместване на ~200 m -> отново бързо четене
+            policy.update(42.688467, 23.325)
+            moved = not policy.stationary and policy.interval_ms() == 5000 and policy.moves == 1
+            
+            ok = first_due and changed and slow and kept and stale_fast and moved
+            if ok:
+                self._test_result("GPS Адаптивно четене", True, "5 s <-> 300 s")
+                return True
+            else:
+                self._test_result("GPS Адаптивно четене", False, "{} {} {} {} {}".format(changed, slow, kept, stale_fast, moved))
+                return False
+        except Exception as e:
+            self._test_result("GPS Адаптивно четене", False, str(e))
+            return False
+    
+    def test_link_manager(self):
+        try:
+            # Симулирана история на двете връзки с явни моменти (ms)
+            links = LinkManager(primary=LINK_SIM, hysteresis=15, min_dwell_s=60, fail_threshold=3, hot_standby=False, now=0)
+            links.update(LINK_SIM, True, csq_to_dbm(20), now=0)
+            links.update(LINK_WIFI, False, now=0)
+            idle = links.evaluate(now=0) is None and not links.wants(LINK_WIFI)
+            
+            # SIM пада: WiFi се иска от първата неуспешна проверка, превключване след прага
+            links.update(LINK_SIM, False, now=10000)
+            standby = links.wants(LINK_WIFI) and links.active == LINK_SIM
+            links.update(LINK_SIM, False, now=20000)
+            links.update(LINK_WIFI, True, -80, now=20000)
+            held = links.evaluate(now=20000) is None
+            links.update(LINK_SIM, False, now=30000)
+            failover = links.evaluate(now=30000) == LINK_WIFI and links.failovers == 1
+            links.record_publish(LINK_WIFI, True, now=31500)
+            latency = links.last_failover_ms == 21500
+            
+            # SIM се връща с малко по-добра оценка: без превключване (минимално време и хистерезис)
+            links.update(LINK_SIM, True, -100, now=40000)
+            dwell = links.evaluate(now=40000) is None
+            close = links.score(LINK_SIM) > links.score(LINK_WIFI) and links.evaluate(now=95000) is None
+            
+            # Значително по-добра SIM след минималното време -> обратно към основната връзка
+            links.update(LINK_SIM, True, -60, now=96000)
+            back = links.evaluate(now=96000) == LINK_SIM and links.switches == 2 and not links.wants(LINK_WIFI)
+            
+            hot = LinkManager(hot_standby=True, now=0).wants(LINK_WIFI)
+            
+            ok = idle and standby and held and failover and latency and dwell and close and back and hot
+            if ok:
+                self._test_result("Избор на връзка", True, "Възстановяване за {} ms".format(links.last_failover_ms))
+                return True
+            else:
+                self._test_result("Избор на връзка", False, "{} {} {} {} {} {} {} {} {}".format(
+                    idle, standby, held, failover, latency, dwell, close, back, hot))
+                return False
+        except Exception as e:
+            self._test_result("Избор на връзка", False, str(e))
+            return False
+    
     def run_all(self):
         print("=" * 50)
         print("ТЕСТОВЕ ЗА КОМУНИКАЦИЯ")
@@ -113,10 +959,26 @@ class TestCommunication:
         self.test_sim7600_init()
         self.test_sim7600_status()
         self.test_sim7600_traffic_stats()
+        self.test_at_engine_lines()
+        self.test_at_engine_async_interleave()
+        self.test_sim7600_status_cache()
+        self.test_nmea_parser()
+        self.test_gps_policy()
         
         self.test_wifi_manager_init()
         self.test_wifi_manager_get_status()
         self.test_wifi_manager_traffic_stats()
+        self.test_wifi_fast_join()
+        self.test_wifi_roaming()
+        self.test_link_manager()
+        
+        self.test_offline_queue()
+        self.test_mqtt_inflight_window()
+        self.test_mqtt_async_wait()
+        self.test_mqtt_async_reconnect()
+        self.test_mqtt_priority_ack()
+        self.test_mqtt_packet_decoder()
+        self.test_mqtt_publish_encoding()
         
         print("=" * 50)
         print("РЕЗУЛТАТИ: {} преминали, {} провалени".format(self.tests_passed, self.tests_failed))
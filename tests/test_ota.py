@@ -89,6 +89,68 @@ class TestOTA:
             self._test_result("OTA Конфигурация", False, str(e))
             return False
     
+    def test_ota_hmac(self):
+        try:
+            ota = OTAUpdater()
+            # RFC 4231, тестов случай 2
+            digest = ota._hmac_sha256("Jefe", b"what do ya want for nothing?")
+            expected = "5bdcc146bf60754e6a042426089575c75a003f089d2739839dec58b964ec3843"
+            
+            if digest == expected:
+                self._test_result("OTA HMAC-SHA256", True, "Съвпада с RFC 4231")
+                return True
+            else:
+                self._test_result("OTA HMAC-SHA256", False, digest)
+                return False
+        except Exception as e:
+            self._test_result("OTA HMAC-SHA256", False, str(e))
+            return False
+    
+    def test_ota_manifest_signature(self):
+        try:
+            ota = OTAUpdater()
+            ota._manifest_key = "test_key"
+            body = b'{"version":"1","files":{"main.py":{"sha256":"00","size":1}}}'
+            signed = ota._hmac_sha256("test_key", body).encode() + b"\n" + body
+            tampered = signed.replace(b'"size":1', b'"size":2')
+            
+            manifest = ota._parse_manifest(signed)
+            rejected = ota._parse_manifest(tampered)
+            
+            if manifest is not None and manifest['version'] == "1" and rejected is None:
+                self._test_result("OTA Подпис на манифест", True, "Валидният е приет, промененият е отхвърлен")
+                return True
+            else:
+                self._test_result("OTA Подпис на манифест", False, "Грешна проверка на подписа")
+                return False
+        except Exception as e:
+            self._test_result("OTA Подпис на манифест", False, str(e))
+            return False
+    
+    def test_ota_atomic_swap(self):
+        try:
+            ota = OTAUpdater()
+            target = "ota_test_file.txt"
+            with open(target, 'w') as f:
+                f.write("old")
+            with open(target + ".tmp", 'w') as f:
+                f.write("new")
+            
+            swapped = ota._swap_file(target + ".tmp", target)
+            with open(target, 'r') as f:
+                content = f.read()
+            ota._discard(target)
+            
+            if swapped and content == "new" and ota._get_file_hash(target + ".tmp") is None:
+                self._test_result("OTA Атомарна замяна", True, "Временният файл замени целевия")
+                return True
+            else:
+                self._test_result("OTA Атомарна замяна", False, "Съдържание={}".format(content))
+                return False
+        except Exception as e:
+            self._test_result("OTA Атомарна замяна", False, str(e))
+            return False
+    
     def run_all(self):
         print("=" * 50)
         print("ТЕСТОВЕ ЗА OTA UPDATER")
@@ -98,6 +160,9 @@ class TestOTA:
         self.test_ota_get_status()
         self.test_ota_file_hash()
         self.test_ota_config()
+        self.test_ota_hmac()
+        self.test_ota_manifest_signature()
+        self.test_ota_atomic_swap()
         
         print("=" * 50)
         print("РЕЗУЛТАТИ: {} преминали, {} провалени".format(self.tests_passed, self.tests_failed))
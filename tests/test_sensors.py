@@ -7,6 +7,10 @@ if "src" not in sys.path:
 from dht22 import DHT22Sensor
 from mq2 import MQ2Sensor
 from sds011 import SDS011Sensor
+import config
+
+# Тестовете се изпълняват и на устройството, докато станцията семплира MQ-2 на MQ2_TIMER_ID
+_TEST_TIMER_ID = 2 if getattr(config, 'MQ2_TIMER_ID', 0) == 3 else 3
 
 
 class TestSensors:    
@@ -56,7 +60,7 @@ class TestSensors:
     
     def test_mq2_init(self):
         try:
-            sensor = MQ2Sensor()
+            sensor = MQ2Sensor(sample_hz=0)
             self._test_result("MQ-2 Инициализация", True, "Сензорът е инициализиран")
             return True
         except Exception as e:
@@ -65,7 +69,7 @@ class TestSensors:
     
     def test_mq2_read(self):
         try:
-            sensor = MQ2Sensor()
+            sensor = MQ2Sensor(sample_hz=0)
             value = sensor.read_avg()
             
             if value is None:
@@ -82,6 +86,29 @@ class TestSensors:
             self._test_result("MQ-2 Четене", False, str(e))
             return False
     
+    def test_mq2_background_sampling(self):
+        sensor = None
+        try:
+            sensor = MQ2Sensor(sample_hz=0)
+            sensor.start_sampling(200, timer_id=_TEST_TIMER_ID)
+            time.sleep_ms(300)
+            mean, lo, hi, ema = sensor.read_stats()
+            
+            if 0 <= lo <= mean <= hi <= 4095 and 0 <= ema <= 4095:
+                self._test_result("MQ-2 Фоново семплиране", True, 
+                                "Средно={}, Мин={}, Макс={}, EMA={}".format(mean, lo, hi, ema))
+                return True
+            else:
+                self._test_result("MQ-2 Фоново семплиране", False, 
+                                "Невалидни стойности: {}, {}, {}, {}".format(mean, lo, hi, ema))
+                return False
+        except Exception as e:
+            self._test_result("MQ-2 Фоново семплиране", False, str(e))
+            return False
+        finally:
+            if sensor is not None:
+                sensor.stop_sampling()
+    
     def test_sds011_init(self):
         """Тест за инициализация на SDS011"""
         try:
@@ -117,6 +144,31 @@ class TestSensors:
             self._test_result("SDS011 Четене", False, str(e))
             return False
     
+    def test_sds011_frame_parser(self):
+        try:
+            sensor = SDS011Sensor()
+            good_old = b"\xAA\xC0\x7B\x00\xC8\x01\x01\x02\x47\xAB"
+            corrupt = b"\xAA\xC0\x10\x00\x20\x00\x01\x02\x00\xAB"
+            good_new = b"\xAA\xC0\x96\x00\x2C\x01\x01\x02\xC6\xAB"
+            data = b"\x00" + good_old + corrupt + good_new
+            
+            sensor._buf[0:len(data)] = data
+            sensor._len = len(data)
+            pm25, pm10 = sensor._parse()
+            stats = sensor.get_stats()
+            
+            if pm25 == 15.0 and pm10 == 30.0 and stats['frames_ok'] == 2 and stats['frames_bad'] == 1:
+                self._test_result("SDS011 Парсване на рамки", True, 
+                                "PM2.5={}, PM10={}, {}".format(pm25, pm10, stats))
+                return True
+            else:
+                self._test_result("SDS011 Парсване на рамки", False, 
+                                "PM2.5={}, PM10={}, {}".format(pm25, pm10, stats))
+                return False
+        except Exception as e:
+            self._test_result("SDS011 Парсване на рамки", False, str(e))
+            return False
+    
     def run_all(self):
         print("=" * 50)
         print("ТЕСТОВЕ ЗА СЕНЗОРИ")
@@ -127,9 +179,11 @@ class TestSensors:
         
         self.test_mq2_init()
         self.test_mq2_read()
+        self.test_mq2_background_sampling()
         
         self.test_sds011_init()
         self.test_sds011_read()
+        self.test_sds011_frame_parser()
         
         print("=" * 50)
         print("РЕЗУЛТАТИ: {} преминали, {} провалени".format(self.tests_passed, self.tests_failed))
@@ -0,0 +1,350 @@
+import sys
+import time
+
+if "src" not in sys.path:
+    sys.path.append("src")
+
+import config
+from at_engine import ATEngine
+from sim_socket import SIMNetwork
+from mqtt_client import MQTTClient
+from http_client import HTTPClient
+from speed_test import SpeedTest
+
+
+class ScriptedModem:
+    # Заместител на SIM7600 по UART: отговаря на AT командите за TCP/IP, сървърът връща ехо
+
+    def __init__(self, rx_chunk=1500):
+        self._out = bytearray()
+        self._line = bytearray()
+        self._data_link = None
+        self._data_need = 0
+        self._data = bytearray()
+        self._rx_chunk = rx_chunk
+        self.links = {}
+        self.commands = []
+        self.auto_reply = None
+        self.uart_bytes = 0
+        # Закъснение на +NETOPEN URC (активиране на PDP контекста); отговорът идва по-късно
+        self.netopen_delay_ms = 0
+        self._later = []
+
+    def _release(self):
+        now = time.ticks_ms()
+        while self._later and time.ticks_diff(now, self._later[0][0]) >= 0:
+            self._out.extend(self._later.pop(0)[1])
+
+    def any(self):
+        self._release()
+        return len(self._out)
+
+    def readinto(self, buf):
+        self._release()
+        n = min(len(buf), len(self._out))
+        buf[0:n] = self._out[0:n]
+        del self._out[0:n]
+        self.uart_bytes += n
+        return n
+
+    def _reply(self, data):
+        self._out.extend(data)
+
+    def server_send(self, link, data):
+        # Данни от сървъра: модемът ги буферира и известява с URC
+        self.links[link].extend(data)
+        self._reply(b"\r\n+CIPRXGET: 1,%d\r\n" % link)
+
+    def write(self, data):
+        self.uart_bytes += len(data)
+        for b in bytes(data):
+            if self._data_need:
+                self._data.append(b)
+                self._data_need -= 1
+                if not self._data_need:
+                    self._on_data()
+            elif b == 0x0A:
+                self._on_command(bytes(self._line).strip())
+                self._line = bytearray()
+            else:
+                self._line.append(b)
+        return len(data)
+
+    def _on_data(self):
+        link = self._data_link
+        data = bytes(self._data)
+        self._data = bytearray()
+        self._reply(b"\r\nOK\r\n\r\n+CIPSEND: %d,%d,%d\r\n" % (link, len(data), len(data)))
+        if self.auto_reply is not None:
+            self.server_send(link, self.auto_reply(data))
+
+    def _on_command(self, cmd):
+        self.commands.append(cmd)
+        if cmd == b"AT+NETOPEN":
+            if self.netopen_delay_ms:
+                self._reply(b"\r\nOK\r\n")
+                self._later.append((time.ticks_add(time.ticks_ms(), self.netopen_delay_ms), b"\r\n+NETOPEN: 0\r\n"))
+            else:
+                self._reply(b"\r\nOK\r\n\r\n+NETOPEN: 0\r\n")
+        elif cmd.startswith(b"AT+CIPOPEN="):
+            link = int(cmd[11:].split(b",")[0])
+            self.links[link] = bytearray()
+            self._reply(b"\r\nOK\r\n\r\n+CIPOPEN: %d,0\r\n" % link)
+        elif cmd.startswith(b"AT+CIPSEND="):
+            link, n = cmd[11:].split(b",")
+            self._data_link = int(link)
+            self._data_need = int(n)
+            self._reply(b"\r\n>")
+        elif cmd.startswith(b"AT+CIPRXGET=2,"):
+            link, n = [int(x) for x in cmd[14:].split(b",")]
+            pending = self.links[link]
+            n = min(n, len(pending), self._rx_chunk)
+            chunk = bytes(pending[0:n])
+            del pending[0:n]
+            self._reply(b"\r\n+CIPRXGET: 2,%d,%d,%d\r\n" % (link, n, len(pending)) + chunk + b"\r\nOK\r\n")
+        elif cmd.startswith(b"AT+CIPCLOSE="):
+            link = int(cmd[12:])
+            self.links.pop(link, None)
+            self._reply(b"\r\nOK\r\n\r\n+CIPCLOSE: %d,0\r\n" % link)
+        else:
+            self._reply(b"\r\nOK\r\n")
+
+
+class FakeSIM:
+
+    def __init__(self, modem):
+        self._engine = ATEngine(modem, 512, stream=False)
+
+    def engine(self):
+        return self._engine
+
+
+class TestSIMTransport:
+
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+        self.test_results = []
+
+    def _test_result(self, test_name, passed, message=""):
+        if passed:
+            self.tests_passed += 1
+            status = "ПРОМИНАЛ"
+            print("✓", test_name, "-", status, message)
+        else:
+            self.tests_failed += 1
+            status = "ПРОВАЛЕН"
+            print("✗", test_name, "-", status, message)
+        self.test_results.append((test_name, passed, message))
+
+    def test_socket_roundtrip(self):
+        try:
+            modem = ScriptedModem(rx_chunk=5)
+            modem.auto_reply = lambda data: data.upper()
+            net = SIMNetwork(FakeSIM(modem))
+
+            addr = net.getaddrinfo("example.com", 80)[0][-1]
+            a = net.socket()
+            a.connect(addr)
+            b = net.socket()
+            b.connect(addr)
+
+            # Отговорът идва на части от по 5 байта; readline ги сглобява
+            a.send(b"hello\nworld\n")
+            b.send(b"other")
+            line = a.readline()
+            rest = a.readline()
+            other = b.recv(64)
+
+            modem.server_send(b._link, b"late")
+            poller = net.poll()
+            poller.register(b)
+            ready = poller.poll(100)
+            late = b.recv(64)
+
+            a.close()
+            ok = (
+                line == b"HELLO\n" and rest == b"WORLD\n" and other == b"OTHER" and
+                len(ready) == 1 and late == b"late" and
+                a._link is None and b._link == 1 and 0 not in modem.links
+            )
+            if ok:
+                self._test_result("SIM Сокет обмен", True, "2 връзки, {} AT команди".format(len(modem.commands)))
+                return True
+            else:
+                self._test_result("SIM Сокет обмен", False, "{} {} {} {}".format(line, rest, other, late))
+                return False
+        except Exception as e:
+            self._test_result("SIM Сокет обмен", False, str(e))
+            return False
+
+    def test_mqtt_over_sim(self):
+        try:
+            modem = ScriptedModem()
+            # Брокерът отговаря с CONNACK на CONNECT и с PUBACK на QoS 1 PUBLISH
+            def broker(data):
+                if data[0] == 0x10:
+                    return b"\x20\x02\x00\x00"
+                if data[0] & 0xF0 == 0x30 and data[0] & 0x06:
+                    topic_len = (data[2] << 8) | data[3]
+                    i = 4 + topic_len
+                    return b"\x40\x02" + data[i:i + 2]
+                return b""
+            modem.auto_reply = broker
+            net = SIMNetwork(FakeSIM(modem))
+
+            client = MQTTClient(client_id="sim-test", server="broker", port=1883, net=net)
+            connected = client.connect()
+            published = client.publish("iot/test", b"payload", qos=1)
+            client.flush(1000)
+            ok = connected and published and client.inflight_count() == 0
+            client.disconnect()
+            if ok:
+                self._test_result("SIM MQTT клиент", True, "CONNECT/PUBLISH през AT+CIPSEND")
+                return True
+            else:
+                self._test_result("SIM MQTT клиент", False, "{} {}".format(connected, published))
+                return False
+        except Exception as e:
+            self._test_result("SIM MQTT клиент", False, str(e))
+            return False
+
+    def test_async_open(self):
+        import uasyncio as asyncio
+        try:
+            modem = ScriptedModem()
+            modem.netopen_delay_ms = 300
+            modem.auto_reply = lambda data: b"\x20\x02\x00\x00" if data[0] == 0x10 else data
+            net = SIMNetwork(FakeSIM(modem))
+            client = MQTTClient(client_id="sim-test", server="broker", port=1883, net=net)
+            ticks = []
+
+            async def other():
+                while len(ticks) < 100:
+                    ticks.append(time.ticks_ms())
+                    await asyncio.sleep_ms(10)
+
+            async def scenario():
+                # Докато модемът отваря мрежата, другите задачи продължават
+                task = asyncio.create_task(other())
+                t0 = time.ticks_ms()
+                connected = await client.connect_async()
+                elapsed = time.ticks_diff(time.ticks_ms(), t0)
+                sock = net.socket()
+                await sock.connect_async(net.getaddrinfo("example.com", 80)[0][-1])
+                sock.send(b"ping\n")
+                line = await sock.readline_async()
+                ran = len(ticks)
+                ticks.extend([0] * 100)
+                await task
+                return connected, elapsed, line, ran
+
+            connected, elapsed, line, ran = asyncio.run(scenario())
+            asyncio.new_event_loop()
+
+            ok = connected and elapsed >= 300 and line == b"ping\n" and ran >= 20 and modem.commands.count(b"AT+NETOPEN") == 1
+            if ok:
+                self._test_result("SIM Асинхронно отваряне", True, "{} задачи за {} ms".format(ran, elapsed))
+                return True
+            else:
+                self._test_result("SIM Асинхронно отваряне", False, "{} {} {} {}".format(connected, elapsed, line, ran))
+                return False
+        except Exception as e:
+            self._test_result("SIM Асинхронно отваряне", False, str(e))
+            return False
+
+    def test_http_over_sim(self):
+        import uasyncio as asyncio
+        try:
+            modem = ScriptedModem(rx_chunk=16)
+            modem.auto_reply = lambda data: b"HTTP/1.1 200 OK\r\nContent-Length: 11\r\n\r\nhello world"
+            net = SIMNetwork(FakeSIM(modem))
+            # Клиентите започват през WiFi и се превключват към SIM като MQTT
+            client = HTTPClient(timeout_s=2)
+            client.set_network(net)
+            speed = SpeedTest(test_url="http://example.com/", timeout_s=2)
+            speed.set_network(net)
+
+            async def scenario():
+                resp = await client.get_async("http://example.com/file")
+                body = await resp.read_all_async()
+                again = await (await client.get_async("http://example.com/file")).read_all_async()
+                result = await speed.quick_test_async(include_upload=False)
+                return resp.status, body, again, result
+
+            status, body, again, result = asyncio.run(scenario())
+            asyncio.new_event_loop()
+
+            ok = (
+                status == 200 and body == b"hello world" and again == body and
+                client.connections_opened == 1 and
+                result['ping_ms'] is not None and result['bytes_received'] == 11
+            )
+            if ok:
+                self._test_result("SIM HTTP клиент", True, "HTTP и тест на скоростта през AT+CIPOPEN")
+                return True
+            else:
+                self._test_result("SIM HTTP клиент", False, "{} {} {} {}".format(status, body, again, result))
+                return False
+        except Exception as e:
+            self._test_result("SIM HTTP клиент", False, str(e))
+            return False
+
+    def test_throughput(self):
+        try:
+            modem = ScriptedModem()
+            modem.auto_reply = lambda data: data
+            net = SIMNetwork(FakeSIM(modem))
+            sock = net.socket()
+            sock.connect(net.getaddrinfo("example.com", 80)[0][-1])
+
+            block = bytes(range(256)) * 4
+            total = 32 * 1024
+            modem.uart_bytes = 0
+            received = 0
+            t0 = time.ticks_ms()
+            for _ in range(total // len(block)):
+                sock.send(block)
+                got = 0
+                while got < len(block):
+                    data = sock.recv(len(block))
+                    if not data:
+                        break
+                    got += len(data)
+                received += got
+            elapsed_ms = max(1, time.ticks_diff(time.ticks_ms(), t0))
+
+            # Обработка в двете посоки спрямо скоростта на UART (8N1 = 10 бита на байт)
+            engine_rate = 2 * total * 1000 // elapsed_ms
+            uart_rate = getattr(config, 'SIM_BAUD', 115200) // 10
+            efficiency = 2.0 * total / modem.uart_bytes
+            ok = received == total and engine_rate > uart_rate and efficiency > 0.9
+            msg = "{} B/s срещу UART {} B/s, полезни данни {:.1f}%".format(engine_rate, uart_rate, efficiency * 100)
+            self._test_result("SIM Пропускателна способност", ok, msg)
+            return ok
+        except Exception as e:
+            self._test_result("SIM Пропускателна способност", False, str(e))
+            return False
+
+    def run_all(self):
+        print("=" * 50)
+        print("ТЕСТОВЕ ЗА SIM ТРАНСПОРТ")
+        print("=" * 50)
+
+        self.test_socket_roundtrip()
+        self.test_mqtt_over_sim()
+        self.test_async_open()
+        self.test_http_over_sim()
+        self.test_throughput()
+
+        print("=" * 50)
+        print("РЕЗУЛТАТИ: {} преминали, {} провалени".format(self.tests_passed, self.tests_failed))
+        print("=" * 50)
+
+        return self.tests_failed == 0
+
+
+if __name__ == "__main__":
+    tester = TestSIMTransport()
+    success = tester.run_all()
+    sys.exit(0 if success else 1)
@@ -5,9 +5,65 @@ if "src" not in sys.path:
     sys.path.append("src")
 
 from speed_test import SpeedTest
+from http_client import parse_url, HTTPClient
 import config
 
 
+class FakeServerSocket:
+    # Всеки изпратен HTTP request получава следващия отговор от списъка; празен списък = затворена връзка
+    def __init__(self, responses):
+        self.responses = responses
+        self.rx = b""
+        self.requests = []
+        self.closed = False
+    
+    def settimeout(self, timeout_s):
+        pass
+    
+    def connect(self, addr):
+        pass
+    
+    def write(self, data):
+        data = bytes(data)
+        if b" HTTP/1.1\r\n" in data:
+            self.requests.append(data)
+            if self.responses:
+                self.rx += self.responses.pop(0)
+    
+    def readline(self):
+        end = self.rx.find(b"\n")
+        end = len(self.rx) if end < 0 else end + 1
+        line, self.rx = self.rx[:end], self.rx[end:]
+        return line
+    
+    def readinto(self, buf):
+        n = min(len(buf), len(self.rx))
+        buf[:n] = self.rx[:n]
+        self.rx = self.rx[n:]
+        return n
+    
+    def close(self):
+        self.closed = True
+
+
+class FakeNet:
+    # Мрежов слой като socket/SIMNetwork; всяка нова връзка получава следващия сценарий
+    AF_INET = 2
+    SOCK_STREAM = 1
+    
+    def __init__(self, *scenarios):
+        self.scenarios = list(scenarios)
+        self.sockets = []
+    
+    def getaddrinfo(self, host, port):
+        return [(self.AF_INET, self.SOCK_STREAM, 0, "", (host, port))]
+    
+    def socket(self, family, kind):
+        sock = FakeServerSocket(list(self.scenarios.pop(0)) if self.scenarios else [])
+        self.sockets.append(sock)
+        return sock
+
+
 class TestSpeedTest:
     
     def __init__(self):
@@ -52,6 +108,142 @@ class TestSpeedTest:
             self._test_result("Speed Test URL парсване", False, str(e))
             return False
     
+    def test_http_parse_url(self):
+        try:
+            result = parse_url("https://raw.githubusercontent.com/user/repo/main/main.py")
+            expected = (True, "raw.githubusercontent.com", 443, "/user/repo/main/main.py")
+            custom = parse_url("http://example.com:8080")
+            
+            if result == expected and custom == (False, "example.com", 8080, "/"):
+                self._test_result("HTTP клиент URL парсване", True, "{}".format(result))
+                return True
+            else:
+                self._test_result("HTTP клиент URL парсване", False, "{} {}".format(result, custom))
+                return False
+        except Exception as e:
+            self._test_result("HTTP клиент URL парсване", False, str(e))
+            return False
+    
+    def test_http_content_length(self):
+        try:
+            net = FakeNet([b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhelloEXTRA"])
+            client = HTTPClient(net=net)
+            resp = client.get("http://example.com/a")
+            body = resp.read_all()
+            
+            # Тялото спира на Content-Length; връзката се връща в пула
+            ok = resp.status == 200 and body == b"hello" and resp.complete and len(client._pool) == 1
+            if ok:
+                self._test_result("HTTP Content-Length", True, "{} B".format(len(body)))
+                return True
+            else:
+                self._test_result("HTTP Content-Length", False, "{} {}".format(body, resp.complete))
+                return False
+        except Exception as e:
+            self._test_result("HTTP Content-Length", False, str(e))
+            return False
+    
+    def test_http_chunked(self):
+        try:
+            net = FakeNet([
+                b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"5\r\nhello\r\n6;ext=1\r\n world\r\n0\r\nX-Trailer: 1\r\n\r\n"
+            ])
+            client = HTTPClient(net=net)
+            resp = client.get("http://example.com/chunked")
+            body = resp.read_all(4)
+            
+            ok = body == b"hello world" and resp.complete and len(client._pool) == 1 and net.sockets[0].rx == b""
+            if ok:
+                self._test_result("HTTP Chunked", True, "{}".format(body))
+                return True
+            else:
+                self._test_result("HTTP Chunked", False, "{} {}".format(body, resp.complete))
+                return False
+        except Exception as e:
+            self._test_result("HTTP Chunked", False, str(e))
+            return False
+    
+    def test_http_keep_alive_pool(self):
+        try:
+            ok_response = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+            net = FakeNet(
+                [ok_response, b"HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: 3\r\n\r\nbye"],
+                [ok_response]
+            )
+            client = HTTPClient(net=net)
+            first = client.get("http://example.com/1").read_all()
+            
+            # Втората заявка използва същата връзка; "Connection: close" я изважда от пула
+            second = client.get("http://example.com/2").read_all()
+            reused = client.connections_opened == 1 and len(net.sockets[0].requests) == 2
+            closed = net.sockets[0].closed and not client._pool
+            
+            third = client.get("http://example.com/3").read_all()
+            reopened = client.connections_opened == 2 and len(client._pool) == 1
+            
+            ok = (first, second, third) == (b"ok", b"bye", b"ok") and reused and closed and reopened
+            if ok:
+                self._test_result("HTTP Keep-alive пул", True, "Връзки: {}".format(client.connections_opened))
+                return True
+            else:
+                self._test_result("HTTP Keep-alive пул", False, "{} {} {} {}".format(first, reused, closed, reopened))
+                return False
+        except Exception as e:
+            self._test_result("HTTP Keep-alive пул", False, str(e))
+            return False
+    
+    def test_http_stale_retry(self):
+        try:
+            # Сървърът затваря неактивната връзка след първия отговор
+            net = FakeNet(
+                [b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\na"],
+                [b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\nb"]
+            )
+            client = HTTPClient(net=net)
+            first = client.get("http://example.com/").read_all()
+            second = client.get("http://example.com/").read_all()
+            
+            ok = (
+                first == b"a" and second == b"b" and client.connections_opened == 2 and
+                net.sockets[0].closed and len(net.sockets[1].requests) == 1
+            )
+            if ok:
+                self._test_result("HTTP Повторен опит", True, "Нова връзка след затворена keep-alive")
+                return True
+            else:
+                self._test_result("HTTP Повторен опит", False, "{} {} {}".format(first, second, client.connections_opened))
+                return False
+        except Exception as e:
+            self._test_result("HTTP Повторен опит", False, str(e))
+            return False
+    
+    def test_http_malformed_response(self):
+        try:
+            # Грешен статус и Content-Length: OSError и затворена връзка, без нищо в пула
+            net = FakeNet(
+                [b"HTTP/1.1 abc OK\r\n\r\n"],
+                [b"HTTP/1.1 200 OK\r\nContent-Length: x\r\n\r\n"]
+            )
+            client = HTTPClient(net=net)
+            errors = 0
+            for _ in range(2):
+                try:
+                    client.get("http://example.com/")
+                except OSError:
+                    errors += 1
+            
+            ok = errors == 2 and net.sockets[0].closed and net.sockets[1].closed and not client._pool
+            if ok:
+                self._test_result("HTTP Невалиден отговор", True, "OSError и затворена връзка")
+                return True
+            else:
+                self._test_result("HTTP Невалиден отговор", False, "грешки={} пул={}".format(errors, client._pool))
+                return False
+        except Exception as e:
+            self._test_result("HTTP Невалиден отговор", False, str(e))
+            return False
+    
     def test_speed_test_config(self):
         try:
             has_interval = hasattr(config, 'SPEED_TEST_INTERVAL_S')
@@ -76,6 +268,12 @@ class TestSpeedTest:
         
         self.test_speed_test_init()
         self.test_speed_test_parse_url()
+        self.test_http_parse_url()
+        self.test_http_content_length()
+        self.test_http_chunked()
+        self.test_http_keep_alive_pool()
+        self.test_http_stale_retry()
+        self.test_http_malformed_response()
         self.test_speed_test_config()
         
         print("=" * 50)
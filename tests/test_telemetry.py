@@ -0,0 +1,587 @@
+import sys
+import time
+
+if "src" not in sys.path:
+    sys.path.append("src")
+
+from profiler import StageProfiler
+from aggregator import WindowAggregator
+from payload_codec import PayloadCodec, encode_cbor
+from sample_batch import SampleBatch
+from deadband import DeadbandFilter
+from alarm import AlarmEngine
+from track import TrackBuffer, encode_polyline, encode_varint, zigzag, unzigzag
+from scheduler import Scheduler
+import config
+
+try:
+    # Декодерът от backend/ работи на сървъра; на устройството тези тестове се пропускат
+    import os
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+    import payload_decoder
+except (ImportError, AttributeError):
+    payload_decoder = None
+
+
+class TestTelemetry:
+    
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+        self.test_results = []
+    
+    def _test_result(self, test_name, passed, message=""):
+        if passed:
+            self.tests_passed += 1
+            status = "ПРОМИНАЛ"
+            print("✓", test_name, "-", status, message)
+        else:
+            self.tests_failed += 1
+            status = "ПРОВАЛЕН"
+            print("✗", test_name, "-", status, message)
+        self.test_results.append((test_name, passed, message))
+    
+    def test_profiler_percentiles(self):
+        try:
+            profiler = StageProfiler(enabled=True)
+            stage = profiler.stage("test")
+            for _ in range(90):
+                stage.record(800)
+            for _ in range(10):
+                stage.record(150000)
+            
+            summary = profiler.summary()['stages']['test']
+            if summary['n'] == 100 and summary['p50_us'] == 1000 and summary['p95_us'] == 150000 and summary['max_us'] == 150000:
+                self._test_result("Профилиране Хистограма", True, 
+                                "p50={} us, p95={} us".format(summary['p50_us'], summary['p95_us']))
+                return True
+            else:
+                self._test_result("Профилиране Хистограма", False, str(summary))
+                return False
+        except Exception as e:
+            self._test_result("Профилиране Хистограма", False, str(e))
+            return False
+    
+    def test_profiler_stage_timing(self):
+        try:
+            profiler = StageProfiler(enabled=True)
+            with profiler.stage("sleep"):
+                time.sleep_ms(20)
+            
+            summary = profiler.summary()['stages']['sleep']
+            profiler.reset()
+            reset_summary = profiler.summary()['stages']['sleep']
+            
+            if summary['n'] == 1 and summary['max_us'] >= 20000 and reset_summary['n'] == 0:
+                self._test_result("Профилиране Измерване", True, "max={} us".format(summary['max_us']))
+                return True
+            else:
+                self._test_result("Профилиране Измерване", False, str(summary))
+                return False
+        except Exception as e:
+            self._test_result("Профилиране Измерване", False, str(e))
+            return False
+    
+    def test_profiler_overlapping_entries(self):
+        try:
+            # Две задачи в един и същ етап: всяко влизане пази собственото си начало
+            profiler = StageProfiler(enabled=True)
+            outer = profiler.stage("mqtt", wall=True)
+            inner = profiler.stage("mqtt", wall=True)
+            outer.__enter__()
+            time.sleep_ms(20)
+            inner.__enter__()
+            inner.__exit__(None, None, None)
+            outer.__exit__(None, None, None)
+            
+            summary = profiler.summary()['stages']['mqtt']
+            if summary['n'] == 2 and summary['max_us'] >= 20000 and summary['p50_us'] < 20000 and summary.get('wall') and 'mem_avg' not in summary:
+                self._test_result("Профилиране Припокриване", True, "max={} us".format(summary['max_us']))
+                return True
+            else:
+                self._test_result("Профилиране Припокриване", False, str(summary))
+                return False
+        except Exception as e:
+            self._test_result("Профилиране Припокриване", False, str(e))
+            return False
+    
+    def test_aggregator_window_stats(self):
+        try:
+            aggregator = WindowAggregator(("pm25",))
+            for i in range(1, 1001):
+                aggregator.add("pm25", i)
+            aggregator.add("pm25", None)
+            
+            stats = aggregator.summary()['pm25']
+            p95_ok = abs(stats['p95'] - 950) <= 20
+            if stats['n'] == 1000 and stats['min'] == 1 and stats['max'] == 1000 and stats['mean'] == 500.5 and p95_ok:
+                aggregator.reset()
+                if aggregator.summary()['pm25'] is None:
+                    self._test_result("Агрегатор Статистика", True, 
+                                    "mean={}, std={}, p95={}".format(stats['mean'], stats['std'], stats['p95']))
+                    return True
+            self._test_result("Агрегатор Статистика", False, str(stats))
+            return False
+        except Exception as e:
+            self._test_result("Агрегатор Статистика", False, str(e))
+            return False
+    
+    def test_payload_codec(self):
+        try:
+            import ustruct
+            reading = {
+                'temperature': 23.47,
+                'humidity': 55.1,
+                'mq2': 1834,
+                'pm25': 12.3,
+                'pm10': None,
+                'unix': 1760000000,
+                'flags': 5
+            }
+            packed = PayloadCodec('struct').encode(reading)
+            fields = ustruct.unpack("<BIhHHHHB", packed)
+            struct_ok = len(packed) == 16 and fields == (1, 1760000000, 2347, 5510, 1834, 123, 0xFFFF, 5)
+            
+            # Примери от RFC 8949, приложение A
+            cbor_ok = (
+                encode_cbor({"a": 1, "b": [2, 3]}) == b"\xa2\x61\x61\x01\x61\x62\x82\x02\x03" and
+                encode_cbor(-500) == b"\x39\x01\xf3" and
+                encode_cbor(1000000) == b"\x1a\x00\x0f\x42\x40" and
+                encode_cbor(1.5) == b"\xfa\x3f\xc0\x00\x00" and
+                encode_cbor(None) == b"\xf6"
+            )
+            cbor_payload = PayloadCodec('cbor').encode(reading)
+            sniff_ok = 0xA0 <= cbor_payload[0] <= 0xBF and packed[0] != 0x7B and not (0xA0 <= packed[0] <= 0xBF)
+            
+            if struct_ok and cbor_ok and sniff_ok:
+                self._test_result("Двоично кодиране", True, "struct={} B, cbor={} B".format(len(packed), len(cbor_payload)))
+                return True
+            else:
+                self._test_result("Двоично кодиране", False, "struct={} cbor={} sniff={}".format(struct_ok, cbor_ok, sniff_ok))
+                return False
+        except Exception as e:
+            self._test_result("Двоично кодиране", False, str(e))
+            return False
+    
+    def test_sample_batch(self):
+        try:
+            import ustruct
+            batch = SampleBatch('struct', max_samples=3, max_age_s=60, use_deflate=False)
+            for i in range(3):
+                batch.add({'temperature': 20.0 + i, 'humidity': 50.0, 'mq2': 100 + i, 'pm25': None, 'pm10': 5.5, 'unix': 1000, 'flags': 1})
+            ready = batch.is_ready() and not batch.add({'temperature': 1.0})
+            
+            payload = batch.encode()
+            batch.reset()
+            version, t0, count = ustruct.unpack_from("<BIH", payload, 0)
+            last = ustruct.unpack_from("<HhHHHHB", payload, 7 + 2 * 13)
+            ok = (
+                ready and version == 2 and t0 == 1000 and count == 3 and
+                len(payload) == 7 + 3 * 13 and
+                last[1:] == (2200, 5000, 102, 0xFFFF, 55, 1) and
+                batch.count == 0 and not batch.is_ready()
+            )
+            if ok:
+                self._test_result("Пакет с проби", True, "{} проби в {} B".format(count, len(payload)))
+                return True
+            else:
+                self._test_result("Пакет с проби", False, "Заглавка: {} {} {}".format(version, t0, count))
+                return False
+        except Exception as e:
+            self._test_result("Пакет с проби", False, str(e))
+            return False
+    
+    def test_deadband_filter(self):
+        try:
+            bands = {"pm25": (2.0, 600), "temperature": (0.5, 1)}
+            dead = DeadbandFilter(bands, min_interval_s=0, heartbeat_s=1)
+            
+            first = dead.check({"pm25": 10.0, "temperature": 20.0})
+            dead.mark({"pm25": 10.0, "temperature": 20.0})
+            # Малки колебания не се публикуват; промяна над мъртвата зона - да
+            small = dead.check({"pm25": 11.5, "temperature": 20.2})
+            missing = dead.check({"pm25": None, "temperature": 20.4})
+            large = dead.check({"pm25": 12.5, "temperature": 20.2})
+            reason = dead.reason
+            dead.mark({"pm25": 12.5, "temperature": 20.2})
+            
+            time.sleep(1.1)
+            silence = dead.check({"pm25": 12.5, "temperature": 20.2})
+            heartbeat = dead.heartbeat_due()
+            dead.mark_heartbeat()
+            
+            if first and not small and not missing and large and reason == "pm25" and silence and heartbeat and not dead.heartbeat_due():
+                self._test_result("Мъртва зона", True, "Потиснати: {}".format(dead.suppressed))
+                return True
+            else:
+                self._test_result("Мъртва зона", False, "{} {} {} {}".format(first, small, large, silence))
+                return False
+        except Exception as e:
+            self._test_result("Мъртва зона", False, str(e))
+            return False
+    
+    def test_alarm_engine(self):
+        try:
+            engine = AlarmEngine({
+                "mq2": {"high": 100, "clear": 80},
+                "pm25": {"high": 500.0, "clear": 400.0, "rate": 10.0}
+            })
+            events = []
+            for value in (50, 120, 130, 90, 70, 85):
+                alarm = engine.evaluate("mq2", value)
+                events.append(alarm["event"] if alarm else None)
+            
+            # Рязко нарастване под прага също е аларма
+            engine.evaluate("pm25", 10.0)
+            time.sleep(0.1)
+            rate_alarm = engine.evaluate("pm25", 13.0)
+            
+            latency = engine.record_latency(engine.pending[0])
+            expected = [None, "high", None, None, "clear", None]
+            if events == expected and rate_alarm and rate_alarm["event"] == "rate" and len(engine.pending) == 3 and latency >= 100:
+                self._test_result("Аларми", True, "Събития: {}".format(engine.raised))
+                return True
+            else:
+                self._test_result("Аларми", False, "Събития: {}".format(events))
+                return False
+        except Exception as e:
+            self._test_result("Аларми", False, str(e))
+            return False
+    
+    def test_alarm_rate_ramp(self):
+        try:
+            engine = AlarmEngine({"mq2": {"high": 2500, "clear": 2200, "rate": 400}})
+            
+            # Равномерно нарастване 450/s: една аларма по скорост, после "high" при прага, без изчистване между тях
+            events = []
+            now = 0
+            for value in (200, 650, 1100, 1550, 2000, 2450, 2900, 2900, 2000):
+                alarm = engine.evaluate("mq2", value, now=now)
+                events.append(alarm["event"] if alarm else None)
+                now += 1000
+            ramp_ok = events == [None, "rate", None, None, None, None, "high", None, "clear"]
+            
+            # Скок под прага: изчистване едва след спиране на нарастването и минималното задържане
+            spike = AlarmEngine({"pm25": {"high": 75.0, "clear": 55.0, "rate": 20.0, "hold_s": 30}})
+            spike_events = []
+            for value, at in ((10.0, 0), (40.0, 1000), (40.0, 2000), (41.0, 20000), (40.0, 31000)):
+                alarm = spike.evaluate("pm25", value, now=at)
+                spike_events.append(alarm["event"] if alarm else None)
+            spike_ok = spike_events == [None, "rate", None, None, "clear"]
+            
+            if ramp_ok and spike_ok:
+                self._test_result("Аларми по скорост", True, "Събития: {}".format(engine.raised))
+                return True
+            else:
+                self._test_result("Аларми по скорост", False, "{} {}".format(events, spike_events))
+                return False
+        except Exception as e:
+            self._test_result("Аларми по скорост", False, str(e))
+            return False
+    
+    def test_track_buffer(self):
+        try:
+            track = TrackBuffer(tolerance_m=10, max_points=16)
+            # Права отсечка на изток с трептене ~2 m, после завой на север
+            t = 1000
+            for i in range(12):
+                track.add(42.70000 + (0.00002 if i % 3 == 1 else 0.0), 23.30000 + i * 0.0005, t)
+                t += 5
+            for i in range(1, 11):
+                track.add(42.70000 + i * 0.0005, 23.30550, t)
+                t += 5
+            # Трептене на място след края не добавя върхове
+            track.add(42.70501, 23.30551, t)
+            points = track.take()
+            
+            corner = (4270000, 2330550, 1055)
+            shape_ok = (
+                len(points) == 3 and points[0] == (4270000, 2330000, 1000) and
+                points[1] == corner and points[2][:2] == (4270501, 2330551) and
+                track.received == 23 and track.take() == []
+            )
+            
+            # Пример от описанието на Google encoded polyline (Δt = 0 -> "?")
+            google = [(3850000, -12020000, 0), (4070000, -12095000, 0), (4325200, -12645300, 0)]
+            polyline_ok = encode_polyline(google, 0) == "_p~iF~ps|U?_ulLnnqC?_mqNvxq`@?"
+            zigzag_ok = [zigzag(v) for v in (0, -1, 1, -2)] == [0, 1, 2, 3] and unzigzag(zigzag(-12345)) == -12345
+            
+            packed = encode_varint(points, 1000)
+            raw = len(points) * 12
+            batch = SampleBatch('struct', max_samples=2, max_age_s=60, use_deflate=False)
+            batch.add({'temperature': 20.0, 'unix': 1000, 'flags': 0})
+            payload = batch.encode(points)
+            ok = (
+                shape_ok and polyline_ok and zigzag_ok and
+                payload[0] == 3 and payload.endswith(packed) and len(packed) <= raw // 2
+            )
+            if ok:
+                self._test_result("GPS трак", True, "23 точки -> {} върха, {} B".format(len(points), len(packed)))
+                return True
+            else:
+                self._test_result("GPS трак", False, "{} {}".format(points, encode_polyline(google, 0)))
+                return False
+        except Exception as e:
+            self._test_result("GPS трак", False, str(e))
+            return False
+    
+    def _reading(self, i=0):
+        return {
+            'temperature': 21.5 + i,
+            'humidity': 45.25,
+            'mq2': 1234 + i,
+            'pm25': 12.3,
+            'pm10': None,
+            'unix': 1760000000,
+            'flags': 5
+        }
+    
+    def _samples_ok(self, samples, count):
+        if len(samples) != count:
+            return False
+        for i in range(count):
+            sample = samples[i]
+            if (
+                sample['unix'] != 1760000000 or sample['temperature'] != 21.5 + i or
+                sample['humidity'] != 45.25 or sample['mq2'] != 1234 + i or
+                sample['pm25'] != 12.3 or sample['pm10'] is not None or
+                sample['communication'] != {"type": "sim", "sim_available": False, "wifi_connected": True}
+            ):
+                return False
+        return True
+    
+    def _track_ok(self, decoded, track):
+        expected = [{"unix": t, "lat": lat / 100000.0, "lon": lon / 100000.0} for lat, lon, t in track]
+        return decoded == expected
+    
+    def test_decoder_single(self):
+        try:
+            decode = payload_decoder.decode
+            reading = self._reading()
+            
+            struct_result = decode(PayloadCodec('struct').encode(reading))
+            struct_ok = (
+                struct_result['format'] == 'struct' and struct_result['version'] == 1 and
+                self._samples_ok([struct_result], 1)
+            )
+            
+            stats = {'mq2': {'n': 10, 'min': 1200, 'max': 1300, 'mean': 1250.5, 'std': 30.25, 'p95': 1290}}
+            cbor_result = decode(PayloadCodec('cbor').encode(reading, stats))
+            cbor_ok = (
+                cbor_result['format'] == 'cbor' and cbor_result['stats'] == stats and
+                cbor_result['temperature'] == 21.5 and cbor_result['mq2'] == 1234 and
+                cbor_result['unix'] == 1760000000 and cbor_result['communication']['wifi_connected']
+            )
+            
+            if struct_ok and cbor_ok:
+                self._test_result("Декодер Единична проба", True, "struct v1, CBOR със статистика")
+                return True
+            else:
+                self._test_result("Декодер Единична проба", False, "{} {}".format(struct_result, cbor_result))
+                return False
+        except Exception as e:
+            self._test_result("Декодер Единична проба", False, str(e))
+            return False
+    
+    def test_decoder_batch(self):
+        try:
+            decode = payload_decoder.decode
+            track = [(4268667, 2332500, 1760000005), (4268700, 2332612, 1760000020), (4268510, 2332400, 1760000041)]
+            aggregator = WindowAggregator(("pm25",))
+            for i in range(3):
+                aggregator.add("pm25", self._reading(i)['pm25'])
+            stats = aggregator.summary()
+            results = {}
+            for fmt in ('struct', 'cbor'):
+                for with_track in (False, True):
+                    batch = SampleBatch(fmt, max_samples=3, use_deflate=False)
+                    for i in range(3):
+                        batch.add(self._reading(i))
+                    if with_track:
+                        results[(fmt, with_track)] = decode(batch.encode(track, stats))
+                    else:
+                        results[(fmt, with_track)] = decode(batch.encode())
+            
+            v2 = results[('struct', False)]
+            v3 = results[('struct', True)]
+            cbor = results[('cbor', True)]
+            ok = (
+                v2['version'] == 2 and 'track' not in v2 and self._samples_ok(v2['samples'], 3) and
+                v3['version'] == 3 and self._samples_ok(v3['samples'], 3) and self._track_ok(v3['track'], track) and
+                cbor['format'] == 'cbor' and self._samples_ok(cbor['samples'], 3) and self._track_ok(cbor['track'], track) and
+                cbor['stats']['pm25']['n'] == 3 and 'stats' not in v3 and
+                'track' not in results[('cbor', False)]
+            )
+            if ok:
+                self._test_result("Декодер Пакет", True, "struct v2/v3, CBOR с GPS трак и статистика")
+                return True
+            else:
+                self._test_result("Декодер Пакет", False, "{} {}".format(v3, cbor))
+                return False
+        except Exception as e:
+            self._test_result("Декодер Пакет", False, str(e))
+            return False
+    
+    def test_decoder_json_zlib(self):
+        try:
+            import zlib
+            decode = payload_decoder.decode
+            track = [(4268667, 2332500, 1760000005), (4268700, 2332612, 1760000020)]
+            batch = SampleBatch('json', max_samples=20, use_deflate=True)
+            for i in range(20):
+                batch.add(self._reading(i % 3))
+            payload = batch.encode(track)
+            if payload[0] != 0x78:
+                # Без модула deflate устройството изпраща некомпресиран JSON - същият zlib формат
+                payload = zlib.compress(payload)
+            
+            result = decode(payload)
+            samples = [s for i, s in enumerate(result['samples']) if i < 3]
+            ok = (
+                result.get('compressed') and result['format'] == 'json' and
+                len(result['samples']) == 20 and self._samples_ok(samples, 3) and
+                self._track_ok(result['track'], track) and result['device_id'] == config.DEVICE_NAME
+            )
+            if ok:
+                self._test_result("Декодер JSON и zlib", True, "{} B компресирани".format(len(payload)))
+                return True
+            else:
+                self._test_result("Декодер JSON и zlib", False, "{}".format(result))
+                return False
+        except Exception as e:
+            self._test_result("Декодер JSON и zlib", False, str(e))
+            return False
+    
+    def _run_scheduler(self, scheduler, duration_ms):
+        import uasyncio as asyncio
+        
+        async def bounded():
+            try:
+                await asyncio.wait_for_ms(scheduler._main(), duration_ms)
+            except asyncio.TimeoutError:
+                pass
+        
+        try:
+            asyncio.run(bounded())
+        finally:
+            asyncio.new_event_loop()
+    
+    def _gaps(self, starts):
+        return [time.ticks_diff(starts[i], starts[i - 1]) for i in range(1, len(starts))]
+    
+    def test_scheduler_period(self):
+        try:
+            import uasyncio as asyncio
+            starts = []
+            
+            # Задача от 30 ms с период 50 ms: стартовете са през 50 ms, а не през 80
+            async def task():
+                starts.append(time.ticks_ms())
+                await asyncio.sleep_ms(30)
+            
+            scheduler = Scheduler()
+            scheduler.every("task", 0.05, task)
+            self._run_scheduler(scheduler, 275)
+            
+            gaps = self._gaps(starts)
+            ok = 5 <= len(starts) <= 6 and all(35 <= gap <= 75 for gap in gaps)
+            if ok:
+                self._test_result("Планировчик Период", True, "Интервали: {} ms".format(gaps))
+                return True
+            else:
+                self._test_result("Планировчик Период", False, "{}".format(gaps))
+                return False
+        except Exception as e:
+            self._test_result("Планировчик Период", False, str(e))
+            return False
+    
+    def test_scheduler_catch_up(self):
+        try:
+            starts = []
+            
+            # Първото изпълнение блокира 130 ms: следва веднага ново, без натрупване на пропуснатите
+            async def task():
+                starts.append(time.ticks_ms())
+                if len(starts) == 1:
+                    time.sleep_ms(130)
+            
+            scheduler = Scheduler()
+            scheduler.every("task", 0.05, task)
+            self._run_scheduler(scheduler, 300)
+            
+            gaps = self._gaps(starts)
+            ok = len(gaps) >= 3 and 125 <= gaps[0] <= 160 and all(35 <= gap <= 75 for gap in gaps[1:])
+            if ok:
+                self._test_result("Планировчик Закъснение", True, "Интервали: {} ms".format(gaps))
+                return True
+            else:
+                self._test_result("Планировчик Закъснение", False, "{}".format(gaps))
+                return False
+        except Exception as e:
+            self._test_result("Планировчик Закъснение", False, str(e))
+            return False
+    
+    def test_scheduler_exception_isolation(self):
+        try:
+            calls = {"failing": 0, "healthy": 0}
+            
+            async def failing():
+                calls["failing"] += 1
+                raise ValueError("тестова грешка")
+            
+            async def healthy():
+                calls["healthy"] += 1
+            
+            # Грешката в една задача не спира нито нея, нито останалите
+            scheduler = Scheduler()
+            scheduler.every("failing", 0.05, failing)
+            scheduler.every("healthy", 0.05, healthy)
+            self._run_scheduler(scheduler, 230)
+            
+            ok = calls["failing"] >= 4 and calls["healthy"] >= 4
+            if ok:
+                self._test_result("Планировчик Изолация на грешки", True, str(calls))
+                return True
+            else:
+                self._test_result("Планировчик Изолация на грешки", False, str(calls))
+                return False
+        except Exception as e:
+            self._test_result("Планировчик Изолация на грешки", False, str(e))
+            return False
+    
+    def run_all(self):
+        print("=" * 50)
+        print("ТЕСТОВЕ ЗА ТЕЛЕМЕТРИЯ")
+        print("=" * 50)
+        
+        self.test_profiler_percentiles()
+        self.test_profiler_stage_timing()
+        self.test_profiler_overlapping_entries()
+        self.test_aggregator_window_stats()
+        self.test_payload_codec()
+        self.test_sample_batch()
+        self.test_deadband_filter()
+        self.test_alarm_engine()
+        self.test_alarm_rate_ramp()
+        self.test_track_buffer()
+        if payload_decoder is not None:
+            self.test_decoder_single()
+            self.test_decoder_batch()
+            self.test_decoder_json_zlib()
+        else:
+            print("Декодер: тестовете се пропускат (няма backend/)")
+        self.test_scheduler_period()
+        self.test_scheduler_catch_up()
+        self.test_scheduler_exception_isolation()
+        
+        print("=" * 50)
+        print("РЕЗУЛТАТИ: {} преминали, {} провалени".format(self.tests_passed, self.tests_failed))
+        print("=" * 50)
+        
+        return self.tests_failed == 0
+
+
+if __name__ == "__main__":
+    tester = TestTelemetry()
+    success = tester.run_all()
+    sys.exit(0 if success else 1)